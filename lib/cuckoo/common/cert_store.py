@@ -0,0 +1,86 @@
+import hashlib
+import logging
+import os
+import sqlite3
+
+from lib.cuckoo.common.constants import CUCKOO_ROOT
+
+log = logging.getLogger(__name__)
+
+CERT_STORE_PATH = os.path.join(CUCKOO_ROOT, "storage", "certs.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certs (sha1 TEXT PRIMARY KEY, der BLOB NOT NULL, first_task INTEGER) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sightings (task_id INTEGER, sha1 TEXT, PRIMARY KEY (task_id, sha1)) WITHOUT ROWID;
+"""
+
+
+class CertStore:
+    """SQLite store of DER certificates keyed by sha1, with the tasks each one was seen in.
+
+    Certificates are stored once, first_task is the lowest task id that saw them.
+    """
+
+    def __init__(self, path=CERT_STORE_PATH, readonly=False):
+        self.path = path
+        if readonly:
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path)
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_many(self, certificates):
+        """Add (sha1, der, task_id) tuples in one transaction"""
+        rows = [(sha1, der, task_id) for sha1, der, task_id in certificates]
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO certs (sha1, der, first_task) VALUES (?, ?, ?) "
+                "ON CONFLICT (sha1) DO UPDATE SET first_task = excluded.first_task "
+                "WHERE certs.first_task IS NULL OR excluded.first_task < certs.first_task",
+                rows,
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO sightings (task_id, sha1) VALUES (?, ?)",
+                [(task_id, sha1) for sha1, _, task_id in rows if task_id is not None],
+            )
+
+    def add(self, der, task_id=None):
+        sha1 = hashlib.sha1(der).hexdigest()
+        self.add_many([(sha1, der, task_id)])
+        return sha1
+
+    def get(self, sha1):
+        """Return (der, first_task) or None"""
+        return self.db.execute("SELECT der, first_task FROM certs WHERE sha1 = ?", (sha1.lower(),)).fetchone()
+
+    def __contains__(self, sha1):
+        return self.db.execute("SELECT 1 FROM certs WHERE sha1 = ?", (sha1.lower(),)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM certs").fetchone()[0]
+
+    def task_certs(self, task_id):
+        """Return the sha1 of every certificate seen in task_id"""
+        return [row[0] for row in self.db.execute("SELECT sha1 FROM sightings WHERE task_id = ?", (int(task_id),))]
+
+
+def task_cert_sha1s(task_id, path=CERT_STORE_PATH):
+    """Certificates recorded for a task, or an empty list if there is no store yet"""
+    if task_id is None or not os.path.exists(path):
+        return []
+    try:
+        with CertStore(path, readonly=True) as store:
+            return store.task_certs(task_id)
+    except sqlite3.Error as e:
+        log.warning("Can't read certificate store %s: %s", path, e)
+        return []
@@ -0,0 +1,79 @@
+try:
+    import ahocorasick
+
+    HAVE_AHOCORASICK = True
+except ImportError:
+    HAVE_AHOCORASICK = False
+
+# Literal substrings that command-line signatures look for. Signature modules register
+# their anchors at import time so every analysis scans each command line only once.
+_registered_terms = set()
+
+# Single-entry cache: signatures of one analysis run back to back against the same
+# executed_commands list, so keep the index for as long as that list is current.
+_cached_commands = None
+_cached_index = None
+
+
+def register_terms(*terms):
+    """Register lowercase literals to be precomputed by every future CommandLineIndex."""
+    _registered_terms.update(term.lower() for term in terms)
+
+
+class CommandLineIndex:
+    """Per-analysis view of behavior.summary.executed_commands.
+
+    Holds the lowercased commands plus the positions of the commands that contain each
+    registered literal.
+    """
+
+    def __init__(self, commands, terms=None):
+        self.commands = list(commands)
+        self.lowered = [cmdline.lower() for cmdline in self.commands]
+        self._hits = {}
+        self._scan(_registered_terms if terms is None else {term.lower() for term in terms})
+
+    def _scan(self, terms):
+        terms = [term for term in terms if term and term not in self._hits]
+        if not terms:
+            return
+        for term in terms:
+            self._hits[term] = []
+        if HAVE_AHOCORASICK and len(terms) > 1:
+            automaton = ahocorasick.Automaton()
+            for term in terms:
+                automaton.add_word(term, term)
+            automaton.make_automaton()
+            for position, lower in enumerate(self.lowered):
+                seen = set()
+                for _, term in automaton.iter(lower):
+                    if term not in seen:
+                        seen.add(term)
+                        self._hits[term].append(position)
+        else:
+            for term in terms:
+                self._hits[term] = [position for position, lower in enumerate(self.lowered) if term in lower]
+
+    def iter_lowered(self):
+        """Yield (cmdline, lowercased cmdline) for every executed command."""
+        return zip(self.commands, self.lowered)
+
+    def containing(self, *terms):
+        """Yield (cmdline, lowercased cmdline) for commands containing any of the given literals, in execution order."""
+        self._scan({term.lower() for term in terms})
+        if len(terms) == 1:
+            positions = self._hits[terms[0].lower()]
+        else:
+            positions = sorted(set().union(*(self._hits[term.lower()] for term in terms)))
+        for position in positions:
+            yield self.commands[position], self.lowered[position]
+
+
+def get_cmdline_index(results):
+    """Return the command-line index for the analysis behind results, building it on first use."""
+    global _cached_commands, _cached_index
+    commands = results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
+    if _cached_index is None or _cached_commands is not commands or len(commands) != len(_cached_index.commands):
+        _cached_index = CommandLineIndex(commands)
+        _cached_commands = commands
+    return _cached_index
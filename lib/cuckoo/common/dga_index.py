@@ -0,0 +1,185 @@
+"""Memory-mappable DGA domain index.
+
+Layout (little endian):
+    header      MAGIC, bloom bit count, bloom hash count, entry count, family count,
+                then the offsets of the bloom, bucket, entry, string and family sections
+    bloom       bit array, double hashing over a blake2b digest of the domain
+    buckets     65537 uint32, first entry index for each top-16-bit hash prefix
+    entries     (hash uint64, string offset uint32, string length uint16, family uint16), sorted by hash
+    strings     concatenated UTF-8 domains
+    families    newline separated UTF-8 family names
+
+The file is only ever opened read-only through mmap, so every worker of a host
+shares the same page cache copy and nothing is decoded per task.
+"""
+
+import logging
+import math
+import mmap
+import os
+import struct
+from hashlib import blake2b
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"CAPEDGA1"
+HEADER = struct.Struct("<8sQIQI5Q")
+ENTRY = struct.Struct("<QIHH")
+BUCKET = struct.Struct("<I")
+BUCKET_BITS = 16
+BUCKET_COUNT = (1 << BUCKET_BITS) + 1
+
+_indexes = {}
+
+
+def _hashes(domain):
+    digest = blake2b(domain, digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+
+
+def write_dga_index(path, lookup_dict, false_positive_rate=0.0001):
+    """Write a domain -> family mapping to path in the mmap-able layout above."""
+    families = sorted(set(lookup_dict.values()))
+    if len(families) > 0xFFFF:
+        raise ValueError("Too many DGA families for the index format: %d" % len(families))
+    family_ids = {family: position for position, family in enumerate(families)}
+
+    records = {}
+    for domain, family in lookup_dict.items():
+        encoded = domain.lower().encode()
+        records[encoded] = family_ids[family]
+
+    count = max(len(records), 1)
+    num_bits = max(int(-count * math.log(false_positive_rate) / (math.log(2) ** 2)), 8)
+    num_bits += -num_bits % 8
+    num_hashes = max(int(round(num_bits / count * math.log(2))), 1)
+    bloom = bytearray(num_bits // 8)
+
+    entries = []
+    strings = bytearray()
+    for encoded, family_id in records.items():
+        h1, h2 = _hashes(encoded)
+        for i in range(num_hashes):
+            bit = (h1 + i * h2) % num_bits
+            bloom[bit >> 3] |= 1 << (bit & 7)
+        entries.append((h1, len(strings), len(encoded), family_id))
+        strings += encoded
+    entries.sort()
+
+    buckets = [0] * BUCKET_COUNT
+    for h1, _, _, _ in entries:
+        buckets[(h1 >> (64 - BUCKET_BITS)) + 1] += 1
+    for position in range(1, BUCKET_COUNT):
+        buckets[position] += buckets[position - 1]
+
+    family_blob = "\n".join(families).encode()
+    bloom_offset = HEADER.size
+    bucket_offset = bloom_offset + len(bloom)
+    entry_offset = bucket_offset + BUCKET_COUNT * BUCKET.size
+    string_offset = entry_offset + len(entries) * ENTRY.size
+    family_offset = string_offset + len(strings)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC,
+                num_bits,
+                num_hashes,
+                len(entries),
+                len(families),
+                bloom_offset,
+                bucket_offset,
+                entry_offset,
+                string_offset,
+                family_offset,
+            )
+        )
+        f.write(bloom)
+        f.write(b"".join(BUCKET.pack(value) for value in buckets))
+        f.write(b"".join(ENTRY.pack(*entry) for entry in entries))
+        f.write(strings)
+        f.write(family_blob)
+    # Atomic swap so workers that already mapped the old file keep a consistent view
+    os.replace(tmp_path, path)
+
+
+class DGAIndex:
+    """Read-only view of a file written by write_dga_index."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            self.num_bits,
+            self.num_hashes,
+            self.num_entries,
+            num_families,
+            self._bloom_offset,
+            self._bucket_offset,
+            self._entry_offset,
+            self._string_offset,
+            family_offset,
+        ) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError("%s is not a DGA index" % path)
+        self.families = self._map[family_offset:].decode().split("\n") if num_families else []
+
+    def __len__(self):
+        return self.num_entries
+
+    def _in_bloom(self, h1, h2):
+        for i in range(self.num_hashes):
+            bit = (h1 + i * h2) % self.num_bits
+            if not self._map[self._bloom_offset + (bit >> 3)] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def family(self, domain):
+        """Return the DGA family of domain, or None."""
+        encoded = domain.lower().encode()
+        h1, h2 = _hashes(encoded)
+        if not self._in_bloom(h1, h2):
+            return None
+        bucket = h1 >> (64 - BUCKET_BITS)
+        low = BUCKET.unpack_from(self._map, self._bucket_offset + bucket * BUCKET.size)[0]
+        high = BUCKET.unpack_from(self._map, self._bucket_offset + (bucket + 1) * BUCKET.size)[0]
+        while low < high:
+            middle = (low + high) // 2
+            if ENTRY.unpack_from(self._map, self._entry_offset + middle * ENTRY.size)[0] < h1:
+                low = middle + 1
+            else:
+                high = middle
+        while low < self.num_entries:
+            entry_hash, offset, length, family_id = ENTRY.unpack_from(self._map, self._entry_offset + low * ENTRY.size)
+            if entry_hash != h1:
+                break
+            start = self._string_offset + offset
+            if self._map[start : start + length] == encoded:
+                return self.families[family_id]
+            low += 1
+        return None
+
+    def __contains__(self, domain):
+        return self.family(domain) is not None
+
+
+def get_dga_index(path):
+    """Return the process-wide DGAIndex for path, or None if it is missing or unreadable."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _indexes.get(path)
+    # A regenerated file replaces the old one, remap it on the next lookup
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        index = DGAIndex(path)
+    except (OSError, ValueError, struct.error) as e:
+        log.warning("Can't map DGA index %s: %s", path, e)
+        return None
+    _indexes[path] = (mtime, index)
+    return index
@@ -0,0 +1,178 @@
+from functools import lru_cache
+
+try:
+    import re2 as re
+except ImportError:
+    import re
+
+HOST_HEADER = "Host: "
+HTTPS_PREFIX = "https://"
+
+
+class HostCategoryMatcher:
+    """Compiled matcher for categorised domain lists.
+
+    Host categories match an HTTP "Host: <domain>" header in a buffer or an
+    "https://<domain>" URL prefix. Substring categories match the domain anywhere in a
+    buffer, and URLs with the regex the signatures have always used for them,
+    "https://.*\\<domain>": only the first character of the domain is escaped, so its
+    other dots match any character. Every buffer and URL is
+    scanned once for all categories and the result is memoized, so signatures sharing
+    a matcher and receiving the same call do not repeat the work.
+    """
+
+    def __init__(self, host_categories=None, substring_categories=None, cache_size=256):
+        self.host_domains = {}
+        for category, domains in (host_categories or {}).items():
+            for domain in domains:
+                self.host_domains.setdefault(domain, set()).add(category)
+        self.substring_domains = {}
+        for category, domains in (substring_categories or {}).items():
+            for domain in domains:
+                self.substring_domains.setdefault(domain, set()).add(category)
+
+        # Host header values are compared by prefix, so only the distinct domain lengths need probing
+        self._host_lengths = sorted({len(domain) for domain in self.host_domains}, reverse=True)
+        self._host_re = re.compile(re.escape(HOST_HEADER) + r"([^\r\n]*)")
+        self._substring_re = None
+        if self.substring_domains:
+            needles = sorted(self.substring_domains, key=len, reverse=True)
+            self._substring_re = re.compile("|".join(re.escape(needle) for needle in needles))
+        self._url_substring_res = {
+            category: re.compile(re.escape(HTTPS_PREFIX) + ".*(?:" + "|".join("\\" + domain for domain in domains) + ")")
+            for category, domains in (substring_categories or {}).items()
+            if domains
+        }
+
+        self.scan_buffer = lru_cache(maxsize=cache_size)(self._scan_buffer)
+        self.scan_url = lru_cache(maxsize=cache_size)(self._scan_url)
+
+    def _host_prefix_hits(self, value, hits):
+        for length in self._host_lengths:
+            categories = self.host_domains.get(value[:length])
+            if categories:
+                hits.update(categories)
+
+    def _substring_hits(self, value, hits):
+        if self._substring_re is None:
+            return
+        for match in self._substring_re.finditer(value):
+            hits.update(self.substring_domains[match.group(0)])
+
+    def _scan_buffer(self, buff):
+        hits = set()
+        if self._host_lengths and HOST_HEADER in buff:
+            for match in self._host_re.finditer(buff):
+                self._host_prefix_hits(match.group(1), hits)
+        self._substring_hits(buff, hits)
+        return frozenset(hits)
+
+    def _scan_url(self, url):
+        hits = set()
+        if url.startswith(HTTPS_PREFIX):
+            self._host_prefix_hits(url[len(HTTPS_PREFIX) :], hits)
+            for category, regex in self._url_substring_res.items():
+                if regex.match(url):
+                    hits.add(category)
+        return frozenset(hits)
+
+
+class DomainSuffixTrie:
+    """Reversed-label trie of domain names.
+
+    "example.com" matches that exact name, "*.example.com" matches any subdomain of it.
+    Lookups are case-insensitive and cost one dict access per label of the queried name.
+    """
+
+    _EXACT = "\x00exact"
+    _WILDCARD = "\x00wildcard"
+
+    def __init__(self, domains=None):
+        self._root = {}
+        self.size = 0
+        for domain in domains or ():
+            self.add(domain)
+
+    def add(self, domain, value=True):
+        domain = domain.lower().strip(".")
+        wildcard = domain.startswith("*.")
+        if wildcard:
+            domain = domain[2:]
+        node = self._root
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, {})
+        node[self._WILDCARD if wildcard else self._EXACT] = value
+        self.size += 1
+
+    def lookup(self, domain):
+        """Return the value of the most specific entry covering domain, or None."""
+        if not domain:
+            return None
+        labels = domain.lower().rstrip(".").split(".")
+        node = self._root
+        found = None
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.get(label)
+            if node is None:
+                break
+            if depth < len(labels) and self._WILDCARD in node:
+                found = node[self._WILDCARD]
+        else:
+            if self._EXACT in node:
+                return node[self._EXACT]
+        return found
+
+    def __contains__(self, domain):
+        return self.lookup(domain) is not None
+
+    def __len__(self):
+        return self.size
+
+
+# Plain host names, optionally with a stray trailing slash as found in some feeds
+_PLAIN_DOMAIN_RE = re.compile(r"^[A-Za-z0-9\-.]+/?$")
+# Regex spelling of "any subdomain of", e.g. ".*\.nanopool\.org"
+_WILDCARD_DOMAIN_RE = re.compile(r"^\.\*\\\.((?:[A-Za-z0-9\-]+\\\.)*[A-Za-z0-9\-]+)$")
+
+
+class DomainListMatcher:
+    """Domain list lookup for signatures.
+
+    Plain entries and "any subdomain" regexes go into a DomainSuffixTrie, the remaining
+    true regexes are compiled once into a single alternation, so a domain is checked
+    against the whole list with one trie walk and at most one regex match.
+
+    With prefix=True every entry is also kept in the alternation, which gives the
+    semantics of any(re.match(pattern, domain)) over the list: entries match at the start
+    of the domain only, so "pool.com" also matches "pool.com.evil.com", and "." matches
+    any character. The trie then only short-cuts the common exact and subdomain hits.
+    Matching is case-insensitive either way.
+    """
+
+    def __init__(self, patterns, prefix=False):
+        self.trie = DomainSuffixTrie()
+        regexes = []
+        for pattern in patterns:
+            if _PLAIN_DOMAIN_RE.match(pattern):
+                self.trie.add(pattern.rstrip("/"))
+                if prefix:
+                    regexes.append(pattern)
+                continue
+            wildcard = _WILDCARD_DOMAIN_RE.match(pattern)
+            if wildcard:
+                self.trie.add("*." + wildcard.group(1).replace("\\.", "."))
+                if prefix:
+                    regexes.append(pattern)
+                continue
+            regexes.append(pattern)
+        self.regexes = regexes
+        self._regex = re.compile("|".join("(?:%s)" % pattern for pattern in regexes), re.IGNORECASE) if regexes else None
+
+    def match(self, domain):
+        if not domain:
+            return False
+        if domain in self.trie:
+            return True
+        return bool(self._regex and self._regex.match(domain))
+
+    __contains__ = match
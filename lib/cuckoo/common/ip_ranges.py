@@ -0,0 +1,83 @@
+import csv
+import ipaddress
+import logging
+import os
+import pickle
+from bisect import bisect_right
+
+log = logging.getLogger(__name__)
+
+CACHE_SUFFIX = ".pickle"
+
+
+class IPRangeSet:
+    """Set of IPv4/IPv6 networks backed by merged, sorted integer intervals.
+
+    Membership is a bisect over the interval starts, so a lookup costs O(log n) with
+    no per-prefix ip_network allocation. Instances only hold lists of ints and pickle
+    cheaply, which lets a parsed prefix list be cached on disk next to its source.
+    """
+
+    def __init__(self, prefixes=()):
+        intervals = {4: [], 6: []}
+        for prefix in prefixes:
+            try:
+                network = ipaddress.ip_network(prefix.strip(), strict=False)
+            except ValueError:
+                log.debug("Skipping invalid network prefix: %s", prefix)
+                continue
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+        self._starts = {}
+        self._ends = {}
+        for version, ranges in intervals.items():
+            starts, ends = [], []
+            for start, end in sorted(ranges):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._starts[version] = starts
+            self._ends[version] = ends
+
+    def __contains__(self, ip):
+        try:
+            address = ip if isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)) else ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        starts = self._starts[address.version]
+        value = int(address)
+        position = bisect_right(starts, value) - 1
+        return position >= 0 and value <= self._ends[address.version][position]
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    @classmethod
+    def from_csv(cls, path, column="Prefix", use_cache=True):
+        """Load prefixes from a CSV column, reusing a pickled copy next to the CSV while it is fresh."""
+        cache_path = path + CACHE_SUFFIX
+        if use_cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            try:
+                with open(cache_path, "rb") as f:
+                    ranges = pickle.load(f)
+                if isinstance(ranges, cls):
+                    return ranges
+            except Exception as e:
+                log.debug("Ignoring unreadable IP range cache %s: %s", cache_path, e)
+
+        with open(path, "r") as f:
+            ranges = cls(row[column] for row in csv.DictReader(f) if row.get(column))
+
+        if use_cache:
+            try:
+                with open(cache_path, "wb") as f:
+                    pickle.dump(ranges, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError as e:
+                log.debug("Can't write IP range cache %s: %s", cache_path, e)
+        return ranges
+
+
+# Loopback and RFC1918 ranges, for allowlisting local traffic
+PRIVATE_IP_RANGES = IPRangeSet(["127.0.0.0/8", "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"])
@@ -0,0 +1,108 @@
+import codecs
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from lib.cuckoo.common.constants import CUCKOO_ROOT
+
+try:
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+    HAVE_JINJA2 = True
+except ImportError:
+    HAVE_JINJA2 = False
+
+log = logging.getLogger(__name__)
+
+TEMPLATES_PATH = os.path.join(CUCKOO_ROOT, "data", "html")
+BYTECODE_CACHE_PATH = os.path.join(CUCKOO_ROOT, "storage", "jinja2_cache")
+
+_environment = None
+
+
+def get_environment():
+    """Process-wide Jinja2 environment for report templates.
+
+    Compiled templates stay in the environment cache across tasks handled by the same
+    worker, and their bytecode is cached on disk for the next worker.
+    """
+    global _environment
+    if _environment is not None:
+        return _environment
+
+    from web.analysis.templatetags.analysis_tags import flare_capa_attck, flare_capa_capabilities, flare_capa_mbc, malware_config
+    from web.analysis.templatetags.key_tags import dict2list, getkey, parentfixup, str2list
+    from web.analysis.templatetags.pdf_tags import datefmt
+
+    bytecode_cache = None
+    try:
+        os.makedirs(BYTECODE_CACHE_PATH, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(BYTECODE_CACHE_PATH)
+    except OSError as e:
+        log.warning("Jinja2 bytecode cache disabled: %s", e)
+
+    env = Environment(autoescape=True, loader=FileSystemLoader(TEMPLATES_PATH), bytecode_cache=bytecode_cache, cache_size=50)
+    env.globals["malware_config"] = malware_config
+    env.filters.update(
+        {
+            "getkey": getkey,
+            "str2list": str2list,
+            "dict2list": dict2list,
+            "parentfixup": parentfixup,
+            "malware_config": malware_config,
+            "flare_capa_capability": flare_capa_capabilities,
+            "flare_capa_attck": flare_capa_attck,
+            "flare_capa_mbc": flare_capa_mbc,
+            "datefmt": datefmt,
+        }
+    )
+    _environment = env
+    return env
+
+
+def get_template(name):
+    return get_environment().get_template(name)
+
+
+def template_exists(name):
+    return os.path.exists(os.path.join(TEMPLATES_PATH, name))
+
+
+def write_streamed(template, context, path):
+    """Render template chunk by chunk into path, replacing it only once rendering succeeded"""
+    tmp_path = f"{path}.tmp"
+    try:
+        with codecs.open(tmp_path, "w", encoding="utf-8") as report:
+            for chunk in template.generate(context):
+                report.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class StageTimer:
+    """Wall clock time of the stages of a report, logged once the report is done"""
+
+    def __init__(self, report):
+        self.report = report
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def log(self, task_id=None):
+        total = sum(elapsed for _, elapsed in self.stages)
+        log.info(
+            "Task %s: %s generated in %.2fs (%s)",
+            task_id,
+            self.report,
+            total,
+            ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.stages),
+        )
@@ -0,0 +1,97 @@
+import base64
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+
+    HAVE_PIL = True
+except ImportError:
+    HAVE_PIL = False
+
+log = logging.getLogger(__name__)
+
+# Folder of the thumbnails, next to the shots folder so they go away with the analysis
+THUMBNAILS_FOLDER = "thumbnails"
+THUMBNAIL_SIZE = (150, 100)
+SCREENSHOT_EXTENSIONS = (".jpg", ".png")
+
+
+class LazyScreenshot:
+    """Screenshot handed to report templates.
+
+    The image is only read and base64 encoded when the template asks for its data, so a
+    streamed render holds one screenshot in memory at a time and nothing ends up in results.
+    """
+
+    __slots__ = ("id", "path")
+
+    def __init__(self, shot_id, path):
+        self.id = shot_id
+        self.path = path
+
+    @property
+    def data(self):
+        try:
+            with open(self.path, "rb") as f:
+                return base64.b64encode(f.read()).decode()
+        except OSError as e:
+            log.warning("Can't read screenshot %s: %s", self.path, e)
+            return ""
+
+    def __getitem__(self, key):
+        # templates use both shot.data and shot["data"]
+        if key in self.__slots__ or key == "data":
+            return getattr(self, key)
+        raise KeyError(key)
+
+
+def list_screenshots(shots_path):
+    """Return the non-empty screenshots of an analysis as (id, path), sorted by id"""
+    shots = []
+    if not os.path.isdir(shots_path):
+        return shots
+    for shot_name in os.listdir(shots_path):
+        if not shot_name.endswith(SCREENSHOT_EXTENSIONS):
+            continue
+        shot_path = os.path.join(shots_path, shot_name)
+        if os.path.getsize(shot_path) == 0:
+            continue
+        shots.append((os.path.splitext(shot_name)[0], shot_path))
+    shots.sort()
+    return shots
+
+
+def thumbnail(path, size=THUMBNAIL_SIZE, cache_path=None):
+    """Return the path of a JPEG thumbnail of path, cached in the analysis folder, or None"""
+    if cache_path is None:
+        cache_path = os.path.join(os.path.dirname(os.path.dirname(path)), THUMBNAILS_FOLDER)
+    name = os.path.splitext(os.path.basename(path))[0]
+    cached = os.path.join(cache_path, f"{name}_{size[0]}x{size[1]}.jpg")
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+        return cached
+    if not HAVE_PIL:
+        return None
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        with Image.open(path) as img:
+            img = img.convert("RGB").resize(size, Image.LANCZOS)
+            tmp_path = f"{cached}.{os.getpid()}.tmp"
+            img.save(tmp_path, format="JPEG")
+        os.replace(tmp_path, cached)
+    except Exception as e:
+        log.debug("Can't create thumbnail of %s: %s", path, e)
+        return None
+    return cached
+
+
+def load_screenshots(shots_path, thumbnails=False, workers=4):
+    """Return LazyScreenshot objects for an analysis, thumbnailed in a thread pool when asked"""
+    shots = list_screenshots(shots_path)
+    if not thumbnails:
+        return [LazyScreenshot(shot_id, path) for shot_id, path in shots]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        paths = list(pool.map(thumbnail, [path for _, path in shots]))
+    # like before, a screenshot that can't be resized is still listed, without data
+    return [LazyScreenshot(shot_id, path or os.devnull) for (shot_id, _), path in zip(shots, paths)]
@@ -0,0 +1,91 @@
+import logging
+from collections import Counter, defaultdict
+
+log = logging.getLogger(__name__)
+
+
+class SignatureDispatchIndex:
+    """API-call dispatch table for evented signatures.
+
+    Built once from the ``filter_apinames``/``filter_categories`` sets of every evented
+    signature so that each call is only offered to the signatures subscribed to it,
+    instead of every signature rejecting it again inside its own filters.
+
+    The RunSignatures loop in CAPE core is meant to build one index per analysis from its
+    evented signatures and replace the per-signature filter checks of its call loop with
+    ``for sig in index.dispatch(call, process): ...``, calling ``retire()`` where it stops
+    streaming calls to a signature and adding ``stats()`` to its debug output.
+    """
+
+    def __init__(self, signatures):
+        self.signatures = [sig for sig in signatures if getattr(sig, "evented", False)]
+        self._order = {id(sig): position for position, sig in enumerate(self.signatures)}
+        self._by_api = defaultdict(list)
+        self._by_category = defaultdict(list)
+        self._unfiltered = []
+        # (api, category) -> ordered tuple of subscribers, filled lazily
+        self._routes = {}
+        self._retired = set()
+        # signature name -> number of calls actually handed to on_call
+        self.delivered = Counter()
+        self.offered = 0
+
+        for sig in self.signatures:
+            apinames = getattr(sig, "filter_apinames", None)
+            categories = getattr(sig, "filter_categories", None)
+            if apinames:
+                for api in apinames:
+                    self._by_api[api].append(sig)
+            elif categories:
+                for category in categories:
+                    self._by_category[category].append(sig)
+            else:
+                self._unfiltered.append(sig)
+
+    def subscribers(self, api, category=None):
+        """Return the signatures subscribed to an API name/category pair, in load order."""
+        key = (api, category)
+        route = self._routes.get(key)
+        if route is None:
+            candidates = []
+            for sig in self._by_api.get(api, ()):
+                # signatures filtering on both API and category must satisfy both
+                categories = getattr(sig, "filter_categories", None)
+                if categories and category not in categories:
+                    continue
+                candidates.append(sig)
+            candidates.extend(self._by_category.get(category, ()))
+            candidates.extend(self._unfiltered)
+            candidates.sort(key=lambda sig: self._order[id(sig)])
+            route = self._routes[key] = tuple(candidates)
+        return route
+
+    def retire(self, sig):
+        """Stop delivering calls to a signature, e.g. once it has matched or crashed."""
+        self._retired.add(id(sig))
+
+    def dispatch(self, call, process):
+        """Deliver a call to its subscribers and return the signatures whose on_call matched."""
+        self.offered += 1
+        matched = []
+        process_name = process.get("process_name")
+        for sig in self.subscribers(call.get("api"), call.get("category")):
+            if id(sig) in self._retired:
+                continue
+            processnames = getattr(sig, "filter_processnames", None)
+            if processnames and process_name not in processnames:
+                continue
+            self.delivered[sig.name] += 1
+            try:
+                result = sig.on_call(call, process)
+            except Exception as e:
+                log.exception("Failed to run evented signature %s: %s", sig.name, e)
+                self.retire(sig)
+                continue
+            if result is True:
+                matched.append(sig)
+        return matched
+
+    def stats(self):
+        """Per-signature delivered call counts plus the total number of calls offered."""
+        return {"offered": self.offered, "delivered": dict(self.delivered)}
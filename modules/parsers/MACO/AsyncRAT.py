@@ -4,7 +4,7 @@ from cape_parsers.CAPE.community.AsyncRAT import extract_config
 from maco.extractor import Extractor
 from maco.model import ExtractorModel as MACOModel
 
-from modules.parsers.utils import get_YARA_rule
+from modules.parsers.utils import LazyYARARule
 
 
 def convert_to_MACO(raw_config: dict) -> MACOModel:
@@ -57,7 +57,7 @@ class AsyncRAT(Extractor):
     family = "AsyncRAT"
     last_modified = "2024-10-26"
     sharing = "TLP:CLEAR"
-    yara_rule = get_YARA_rule(family)
+    yara_rule = LazyYARARule()
 
     def run(self, stream, matches):
         return convert_to_MACO(extract_config(stream.read()))
@@ -2,7 +2,7 @@ from cape_parsers.CAPE.core.Azorult import YARA_RULES, extract_config
 from maco.extractor import Extractor
 from maco.model import ExtractorModel as MACOModel
 
-from modules.parsers.utils import get_YARA_rule
+from modules.parsers.utils import LazyYARARule
 
 
 def convert_to_MACO(raw_config: dict):
@@ -21,7 +21,7 @@ class Azorult(Extractor):
     family = "Azorult"
     last_modified = "2024-10-26"
     sharing = "TLP:CLEAR"
-    yara_rule = get_YARA_rule(family) or YARA_RULES
+    yara_rule = LazyYARARule(fallback=YARA_RULES)
 
     def run(self, stream, matches):
         return convert_to_MACO(extract_config(stream.read()))
@@ -2,8 +2,6 @@ from cape_parsers.CAPE.core.ChChes import extract_config, rule_source
 from maco.extractor import Extractor
 from maco.model import ExtractorModel as MACOModel
 
-from modules.parsers.utils import get_YARA_rule
-
 
 def convert_to_MACO(raw_config: dict):
     if not (raw_config and isinstance(raw_config, dict)):
@@ -23,8 +21,6 @@ class ChChes(Extractor):
     family = "ChChes"
     last_modified = "2024-10-26"
     sharing = "TLP:CLEAR"
-    yara_rule = get_YARA_rule(family)
-
     yara_rule = rule_source
 
     def run(self, stream, matches):
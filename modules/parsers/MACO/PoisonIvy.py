@@ -2,7 +2,7 @@ from cape_parsers.CAPE.community.PoisonIvy import extract_config
 from maco.extractor import Extractor
 from maco.model import ExtractorModel as MACOModel
 
-from modules.parsers.utils import get_YARA_rule
+from modules.parsers.utils import LazyYARARule
 
 
 def convert_to_MACO(raw_config: dict):
@@ -39,7 +39,7 @@ class PoisonIvy(Extractor):
     family = "PoisonIvy"
     last_modified = "2024-10-26"
     sharing = "TLP:CLEAR"
-    yara_rule = get_YARA_rule(family)
+    yara_rule = LazyYARARule()
 
     def run(self, stream, matches):
         output = extract_config(stream.read())
@@ -2,8 +2,6 @@ from cape_parsers.CAPE.community.Stealc import RULE_SOURCE, extract_config
 from maco.extractor import Extractor
 from maco.model import ExtractorModel as MACOModel
 
-from modules.parsers.utils import get_YARA_rule
-
 
 def convert_to_MACO(raw_config: dict):
     if not (raw_config and isinstance(raw_config, dict)):
@@ -23,8 +21,6 @@ class Stealc(Extractor):
     family = "Stealc"
     last_modified = "2024-10-26"
     sharing = "TLP:CLEAR"
-    yara_rule = get_YARA_rule(family)
-
     yara_rule = RULE_SOURCE
 
     def run(self, stream, matches):
@@ -0,0 +1,174 @@
+"""Persistent cache of extracted MACO configs keyed by payload content.
+
+The same payload shows up in many tasks, so extractor results are stored in SQLite under
+(payload sha256, extractor, extractor version). The version is opaque here, the runner builds
+it from last_modified, the cape-parsers release and a hash of the extractor and backend source
+(runner.extractor_version). A new version makes the old entries unreachable, they are purged
+by purge_stale() or aged out by the LRU eviction that keeps the store under max_bytes. "No config" results are cached as well,
+they are most of the lookups.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+log = logging.getLogger(__name__)
+
+CAPE_ROOT = os.path.dirname(__file__).split("/modules", 1)[0]
+CONFIG_CACHE_PATH = os.path.join(CAPE_ROOT, "storage", "maco_configs.db")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Puts between two checks of the store size
+EVICT_INTERVAL = 100
+# Evict down to this fraction of max_bytes, so eviction doesn't run on every put
+EVICT_TARGET = 0.9
+# Approximate bytes of a row besides the config
+ROW_OVERHEAD = 100
+
+# last_modified holds the extractor version, the column keeps its name so existing stores still open
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    sha256 TEXT, extractor TEXT, last_modified TEXT, config TEXT, size INTEGER, last_used REAL,
+    PRIMARY KEY (sha256, extractor, last_modified)
+);
+CREATE INDEX IF NOT EXISTS configs_last_used ON configs (last_used);
+CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER) WITHOUT ROWID;
+"""
+COUNTERS = ("hits", "misses", "stores", "evictions")
+
+# Distinguishes a cached "no config" from a cache miss
+MISS = object()
+
+
+def serialize(result) -> str:
+    if result is None:
+        return None
+    if hasattr(result, "model_dump_json"):
+        return json.dumps({"model": json.loads(result.model_dump_json(exclude_defaults=True))})
+    return json.dumps({"raw": result})
+
+
+def deserialize(config: str):
+    if config is None:
+        return None
+    data = json.loads(config)
+    if "model" in data:
+        from maco.model import ExtractorModel
+
+        return ExtractorModel.model_validate(data["model"])
+    return data["raw"]
+
+
+class ConfigCache:
+    """SQLite cache of extractor results, shared by the processes of a host.
+
+    Hit, miss, store and eviction counters are kept in memory and added to the persistent
+    totals on flush() and close().
+    """
+
+    def __init__(self, path=CONFIG_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._puts = 0
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, sha256, extractor, version):
+        """Return the cached result, None for a cached "no config", or MISS"""
+        key = (sha256, extractor, version)
+        row = self.db.execute("SELECT config FROM configs WHERE sha256 = ? AND extractor = ? AND last_modified = ?", key).fetchone()
+        if row is None:
+            self.counters["misses"] += 1
+            return MISS
+        self.counters["hits"] += 1
+        with self.db:
+            self.db.execute(
+                "UPDATE configs SET last_used = ? WHERE sha256 = ? AND extractor = ? AND last_modified = ?", (time.time(),) + key
+            )
+        try:
+            return deserialize(row[0])
+        except Exception as e:
+            log.warning("Dropping unreadable cached config of %s for %s: %s", extractor, sha256, e)
+            return MISS
+
+    def put(self, sha256, extractor, version, result):
+        config = serialize(result)
+        # keys count too, or "no config" rows would never be evicted
+        size = ROW_OVERHEAD + (len(config) if config else 0)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO configs (sha256, extractor, last_modified, config, size, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, extractor, version, config, size, time.time()),
+            )
+        self.counters["stores"] += 1
+        self._puts += 1
+        if self._puts % EVICT_INTERVAL == 0:
+            self.evict()
+            self.flush()
+
+    def size(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM configs").fetchone()[0]
+
+    def evict(self):
+        """Delete the least recently used entries until the store is under max_bytes"""
+        total = self.size()
+        if total <= self.max_bytes:
+            return 0
+        excess = total - int(self.max_bytes * EVICT_TARGET)
+        evicted = 0
+        with self.db:
+            while excess > 0:
+                rows = self.db.execute("SELECT rowid, size FROM configs ORDER BY last_used LIMIT 500").fetchall()
+                if not rows:
+                    break
+                batch = []
+                for rowid, size in rows:
+                    if excess <= 0:
+                        break
+                    batch.append((rowid,))
+                    excess -= size
+                self.db.executemany("DELETE FROM configs WHERE rowid = ?", batch)
+                evicted += len(batch)
+        self.counters["evictions"] += evicted
+        return evicted
+
+    def purge_stale(self, versions):
+        """Delete the entries of extractors whose version isn't the one in {extractor: version}"""
+        with self.db:
+            cursor = self.db.executemany("DELETE FROM configs WHERE extractor = ? AND last_modified != ?", list(versions.items()))
+        return cursor.rowcount
+
+    def flush(self):
+        """Add the counters of this process to the persistent totals"""
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                list(self.counters.items()),
+            )
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def stats(self):
+        """Return the persistent counters including this process, hit rate and store size"""
+        totals = dict(self.db.execute("SELECT name, value FROM stats"))
+        stats = {name: totals.get(name, 0) + self.counters[name] for name in COUNTERS}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = self.db.execute("SELECT COUNT(*) FROM configs").fetchone()[0]
+        stats["bytes"] = self.size()
+        stats["max_bytes"] = self.max_bytes
+        return stats
@@ -0,0 +1,166 @@
+"""Manifest of the MACO extractors, built from their source without importing them.
+
+Importing an extractor pulls its cape_parsers backend (and everything that one imports), so
+listing the available families that way means importing all of them. The manifest is
+read from the extractor class bodies instead and cached in MACO/manifest.json.
+"""
+
+import ast
+import glob
+import importlib
+import json
+import logging
+import os
+import re
+
+from modules.parsers.utils import get_YARA_rule, yara_rule_paths
+
+log = logging.getLogger(__name__)
+
+MACO_FOLDER = os.path.join(os.path.dirname(__file__), "MACO")
+MANIFEST_PATH = os.path.join(MACO_FOLDER, "manifest.json")
+MANIFEST_VERSION = 3
+# Extractor metadata kept in the manifest
+METADATA_FIELDS = ("author", "family", "last_modified", "sharing")
+
+RULE_NAME_RE = re.compile(r"^\s*(?:(?:private|global)\s+)*rule\s+(\w+)", re.M)
+
+
+def rule_names(rule_source: str) -> list:
+    return RULE_NAME_RE.findall(rule_source or "")
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return None
+
+
+def _yara_family(node, family):
+    """Rule family of a yara_rule assignment, None when the rule comes from the backend module"""
+    if isinstance(node, ast.Call) and getattr(node.func, "id", None) in ("LazyYARARule", "get_YARA_rule"):
+        if node.args:
+            return _literal(node.args[0])
+        for keyword in node.keywords:
+            if keyword.arg == "family":
+                return _literal(keyword.value)
+        return family
+    if isinstance(node, ast.BoolOp):
+        return _yara_family(node.values[0], family)
+    return None
+
+
+def scan_extractor(path: str) -> list:
+    """Return the manifest entries of the Extractor subclasses defined in path"""
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    module = os.path.basename(path)[:-3]
+    entries = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef) or not any(getattr(base, "id", None) == "Extractor" for base in node.bases):
+            continue
+        entry = {"module": module, "class": node.name}
+        rule_node = None
+        for statement in node.body:
+            if not isinstance(statement, ast.Assign) or len(statement.targets) != 1:
+                continue
+            name = getattr(statement.targets[0], "id", None)
+            if name in METADATA_FIELDS:
+                entry[name] = _literal(statement.value)
+            elif name == "yara_rule":
+                # last assignment wins, like in the class body
+                rule_node = statement.value
+        entry["yara_family"] = _yara_family(rule_node, entry.get("family")) if rule_node is not None else None
+        entry["embedded_rule"] = rule_node is not None and entry["yara_family"] is None
+        entries.append(entry)
+    return entries
+
+
+def is_extractor_module(name: str) -> bool:
+    # test_* modules hold placeholders without a rule, which would run on every payload.
+    # Retired extractors are kept as Name.py_deprecated.py, which can't be imported as a module
+    return not name.startswith(("_", "test_")) and "." not in name and not name.endswith("_deprecated")
+
+
+def extractor_paths(folder: str = MACO_FOLDER) -> list:
+    return sorted(path for path in glob.glob(os.path.join(folder, "*.py")) if is_extractor_module(os.path.basename(path)[:-3]))
+
+
+def sources_mtime(folder: str = MACO_FOLDER) -> float:
+    """Newest mtime of the extractors and of the local rules their rule names come from"""
+    return max((os.path.getmtime(path) for path in extractor_paths(folder) + yara_rule_paths()), default=0)
+
+
+def build_manifest(folder: str = MACO_FOLDER) -> dict:
+    """Scan the extractors and resolve rule names from local rules only, never downloading them"""
+    extractors = []
+    for path in extractor_paths(folder):
+        try:
+            entries = scan_extractor(path)
+        except (OSError, SyntaxError) as e:
+            log.warning("Can't scan MACO extractor %s: %s", path, e)
+            continue
+        for entry in entries:
+            if entry["yara_family"]:
+                entry["rules"] = rule_names(get_YARA_rule(entry["yara_family"], offline=True))
+            else:
+                entry["rules"] = []
+            extractors.append(entry)
+    return {
+        "version": MANIFEST_VERSION,
+        "mtime": sources_mtime(folder),
+        "extractors": extractors,
+    }
+
+
+def write_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+_manifest = None
+
+
+def load_manifest(path: str = MANIFEST_PATH, rebuild: bool = False) -> dict:
+    """Return the manifest, rebuilding it when an extractor or a rule file is newer than the cached copy"""
+    global _manifest
+    if _manifest is not None and not rebuild:
+        return _manifest
+
+    manifest = None
+    if not rebuild and os.path.exists(path):
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Can't load MACO manifest %s: %s", path, e)
+        if manifest and (manifest.get("version") != MANIFEST_VERSION or manifest.get("mtime", 0) < sources_mtime()):
+            manifest = None
+
+    if manifest is None:
+        manifest = build_manifest()
+        try:
+            write_manifest(manifest, path)
+        except OSError as e:
+            log.debug("Can't write MACO manifest %s: %s", path, e)
+
+    _manifest = manifest
+    return manifest
+
+
+def families() -> dict:
+    """Return {family: [manifest entries]}"""
+    by_family = {}
+    for entry in load_manifest()["extractors"]:
+        by_family.setdefault(entry.get("family"), []).append(entry)
+    return by_family
+
+
+def load_extractor(entry: dict):
+    """Import the extractor class of a manifest entry"""
+    module = importlib.import_module(f"modules.parsers.MACO.{entry['module']}")
+    return getattr(module, entry["class"])
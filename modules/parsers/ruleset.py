@@ -0,0 +1,163 @@
+"""One compiled YARA ruleset for all MACO extractors.
+
+Every extractor's rules are compiled together, each extractor in its own namespace, so a
+payload is scanned once and the matches are handed to the Extractor.run of the namespaces
+that hit. The compiled rules are saved with yara.save under a hash of the rule sources and
+reused by every process until an extractor's rule changes.
+"""
+
+import hashlib
+import io
+import logging
+import os
+
+from modules.parsers import registry
+from modules.parsers.utils import MACO_YARA_FOLDER
+
+try:
+    import yara
+
+    HAVE_YARA = True
+except ImportError:
+    HAVE_YARA = False
+
+try:
+    from maco.extractor import DEFAULT_YARA_RULE
+except ImportError:
+    # what maco gives an extractor without a rule: match everything
+    DEFAULT_YARA_RULE = """
+rule {name}
+{{
+    condition:
+        true
+}}
+"""
+
+log = logging.getLogger(__name__)
+
+COMPILED_FOLDER = os.path.join(MACO_YARA_FOLDER, "compiled")
+
+
+def extractor_namespace(extractor) -> str:
+    return f"{extractor.__module__.rsplit('.', 1)[-1]}.{extractor.__name__}"
+
+
+def load_extractors(entries=None) -> dict:
+    """Return {namespace: Extractor subclass} for the manifest entries, all extractors by default"""
+    extractors = {}
+    for entry in entries if entries is not None else registry.load_manifest()["extractors"]:
+        try:
+            extractor = registry.load_extractor(entry)
+        except Exception as e:
+            log.warning("Can't load MACO extractor %s.%s: %s", entry["module"], entry["class"], e)
+            continue
+        extractors[extractor_namespace(extractor)] = extractor
+    return extractors
+
+
+def sources_digest(sources: dict) -> str:
+    digest = hashlib.sha256(yara.__version__.encode() if HAVE_YARA else b"")
+    for namespace in sorted(sources):
+        digest.update(b"\0" + namespace.encode() + b"\0" + sources[namespace].encode())
+    return digest.hexdigest()
+
+
+def valid_sources(sources: dict) -> dict:
+    """Drop the sources that don't compile on their own, so one broken rule doesn't disable every extractor"""
+    valid = {}
+    for namespace, source in sources.items():
+        try:
+            yara.compile(source=source)
+        except yara.Error as e:
+            log.warning("Skipping YARA rule of MACO extractor %s: %s", namespace, e)
+            continue
+        valid[namespace] = source
+    return valid
+
+
+def compile_ruleset(sources: dict, folder: str = COMPILED_FOLDER):
+    """Return the compiled rules of {namespace: source}, from the saved copy when there is one"""
+    if not HAVE_YARA:
+        raise ImportError("yara-python is needed to compile the MACO extractor rules")
+    path = os.path.join(folder, f"{sources_digest(sources)}.yarc")
+    if os.path.exists(path):
+        try:
+            return yara.load(path)
+        except yara.Error as e:
+            log.warning("Can't load compiled YARA rules %s, recompiling: %s", path, e)
+
+    try:
+        rules = yara.compile(sources=sources)
+    except yara.Error as e:
+        log.warning("Can't compile the MACO rules together: %s", e)
+        rules = yara.compile(sources=valid_sources(sources))
+
+    try:
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        rules.save(tmp_path)
+        os.replace(tmp_path, path)
+    except (OSError, yara.Error) as e:
+        log.debug("Can't save compiled YARA rules %s: %s", path, e)
+    return rules
+
+
+class ExtractorRuleset:
+    """Scan payloads once against every extractor's rules and run the extractors that matched.
+
+    Extractors are only instantiated when their rules first match a payload. Like in maco's
+    collector, an extractor without a rule gets one matching every payload.
+    """
+
+    def __init__(self, extractors: dict = None, folder: str = COMPILED_FOLDER):
+        self.extractors = extractors if extractors is not None else load_extractors()
+        self.sources = {}
+        self.match_all = []
+        for namespace, extractor in self.extractors.items():
+            if extractor.yara_rule:
+                self.sources[namespace] = extractor.yara_rule
+            else:
+                log.info("MACO extractor %s has no YARA rule, it runs on every payload", namespace)
+                self.sources[namespace] = DEFAULT_YARA_RULE.format(name=extractor.__name__)
+                self.match_all.append(namespace)
+        self.rules = compile_ruleset(self.sources, folder)
+        self._instances = {}
+
+    def instance(self, namespace: str):
+        extractor = self._instances.get(namespace)
+        if extractor is None:
+            extractor = self._instances[namespace] = self.extractors[namespace]()
+        return extractor
+
+    def scan(self, data: bytes, timeout: int = 60) -> dict:
+        """Return {namespace: [yara matches]} for one payload"""
+        matches = {}
+        for match in self.rules.match(data=data, timeout=timeout):
+            matches.setdefault(match.namespace, []).append(match)
+        return matches
+
+    def run_extractor(self, namespace: str, data: bytes, matches: list):
+        try:
+            return self.instance(namespace).run(io.BytesIO(data), matches)
+        except Exception as e:
+            log.warning("MACO extractor %s failed: %s", namespace, e)
+
+    def run(self, data: bytes) -> dict:
+        """Return {namespace: ExtractorModel} of the extractors that matched and produced a config"""
+        results = {}
+        for namespace, matches in self.scan(data).items():
+            result = self.run_extractor(namespace, data, matches)
+            if result:
+                results[namespace] = result
+        return results
+
+
+_ruleset = None
+
+
+def get_ruleset() -> ExtractorRuleset:
+    """Process-wide ruleset, built on first use"""
+    global _ruleset
+    if _ruleset is None:
+        _ruleset = ExtractorRuleset()
+    return _ruleset
@@ -0,0 +1,332 @@
+"""Run the MACO extractors matched by a payload in a process pool.
+
+A decoder looping on a pathological payload or allocating without bound must not take the
+whole config extraction down with it. Every extractor call runs in a pool worker with an
+address space limit and an alarm; a worker that doesn't come back in time (stuck in C code)
+gets the pool killed and restarted.
+
+Workers get the path of the payload and mmap it, so the payload isn't pickled once per
+extractor. Payloads given as bytes are written once to /dev/shm for that.
+"""
+
+import hashlib
+import inspect
+import logging
+import mmap
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from importlib import metadata
+
+from modules.parsers import registry
+from modules.parsers.config_cache import MISS
+from modules.parsers.ruleset import get_ruleset
+
+try:
+    import resource
+
+    HAVE_RESOURCE = True
+except ImportError:
+    HAVE_RESOURCE = False
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+# Seconds a single extractor call may take
+DEFAULT_TIMEOUT = 60
+# Address space limit of the workers, in MiB
+DEFAULT_MEMORY_LIMIT = 2048
+# Extra seconds before a worker that ignored the alarm is killed
+KILL_GRACE = 5
+# Upper bounds in seconds of the latency histogram buckets, the last one is open
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+SHM_FOLDER = "/dev/shm"
+
+
+class ExtractorTimeout(Exception):
+    pass
+
+
+class ScannedMatch:
+    """Picklable stand-in for a yara.Match handed to Extractor.run in a worker"""
+
+    __slots__ = ("rule", "namespace", "tags", "meta")
+
+    def __init__(self, match):
+        self.rule = match.rule
+        self.namespace = match.namespace
+        self.tags = list(match.tags)
+        self.meta = dict(match.meta)
+
+    def __repr__(self):
+        return self.rule
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def extractor_version(extractor) -> str:
+    """Cache version of an extractor class.
+
+    last_modified is edited by hand and a cape-parsers checkout doesn't change its release on
+    every edit, so a hash of the extractor module and of its extract_config backend goes in too.
+    """
+    digest = hashlib.sha256()
+    module = sys.modules.get(extractor.__module__)
+    for obj in (module, getattr(module, "extract_config", None)):
+        try:
+            with open(inspect.getsourcefile(obj), "rb") as f:
+                digest.update(f.read())
+        except (OSError, TypeError):
+            continue
+    return f"{extractor.last_modified}:{package_version('cape-parsers')}:{digest.hexdigest()[:16]}"
+
+
+def _raise_timeout(signum, frame):
+    raise ExtractorTimeout()
+
+
+@contextmanager
+def alarm(seconds):
+    """Interrupt Python code running longer than seconds, main thread only"""
+    if not seconds or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+_extractors = {}
+
+
+def _watch_parent(parent):
+    # workers block on the task queue forever once their parent is gone, SIGKILL included
+    while os.getppid() == parent:
+        time.sleep(1)
+    os._exit(1)
+
+
+def _init_worker(memory_limit, parent):
+    threading.Thread(target=_watch_parent, args=(parent,), daemon=True).start()
+    if memory_limit and HAVE_RESOURCE:
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_extractor(namespace, path, matches, timeout=DEFAULT_TIMEOUT):
+    """Run one extractor on the payload at path, returns (status, result, elapsed seconds)"""
+    extractor = _extractors.get(namespace)
+    if extractor is None:
+        module, name = namespace.split(".", 1)
+        extractor = _extractors[namespace] = registry.load_extractor({"module": module, "class": name})()
+
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as stream, alarm(timeout):
+            result = extractor.run(stream, matches)
+        return "ok", result, time.perf_counter() - start
+    except ExtractorTimeout:
+        return "timeout", None, time.perf_counter() - start
+    except MemoryError:
+        return "memory", None, time.perf_counter() - start
+    except Exception as e:
+        log.debug("MACO extractor %s failed on %s: %s", namespace, path, e)
+        return "error", str(e), time.perf_counter() - start
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.statuses = {}
+        self.total = 0.0
+
+    def add(self, status, elapsed):
+        self.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.total += elapsed
+
+    def as_dict(self):
+        labels = [f"<={bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        count = sum(self.buckets)
+        return {
+            "count": count,
+            "mean": self.total / count if count else 0,
+            "buckets": dict(zip(labels, self.buckets)),
+            "statuses": dict(self.statuses),
+        }
+
+
+class MACORunner:
+    """Scan payloads with the combined ruleset and run the matched extractors in a process pool.
+
+    Processing workers are often daemonic, which multiprocessing refuses to start children
+    from. The flag only guards that check, the parent doesn't read it back, so it is lifted
+    while the pool lives. Should the pool still be unavailable, the extractors run inline
+    without the memory limit, under the alarm only when called from the main thread.
+
+    With a ConfigCache, extractors that already ran on the same payload at their current
+    version (see extractor_version) are not run again.
+    """
+
+    def __init__(
+        self,
+        workers=DEFAULT_WORKERS,
+        timeout=DEFAULT_TIMEOUT,
+        memory_limit=DEFAULT_MEMORY_LIMIT,
+        maxtasksperchild=200,
+        ruleset=None,
+        cache=None,
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.maxtasksperchild = maxtasksperchild
+        self.ruleset = ruleset or get_ruleset()
+        self.families = {namespace: extractor.family for namespace, extractor in self.ruleset.extractors.items()}
+        self.versions = {namespace: extractor_version(extractor) for namespace, extractor in self.ruleset.extractors.items()}
+        self.cache = cache
+        self.histograms = {}
+        self.pool = None
+        self._pool_failed = workers <= 1
+        self._daemon = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get_pool(self):
+        if self.pool is None and not self._pool_failed:
+            process = multiprocessing.current_process()
+            self._daemon = process.daemon
+            try:
+                # the pool starts workers again later (maxtasksperchild), so the flag stays lifted until close()
+                process.daemon = False
+                self.pool = multiprocessing.Pool(
+                    self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.memory_limit, os.getpid()),
+                    maxtasksperchild=self.maxtasksperchild,
+                )
+            except (AssertionError, OSError) as e:
+                process.daemon = self._daemon
+                log.warning("MACO process pool unavailable, running extractors inline without memory limit: %s", e)
+                self._pool_failed = True
+        return self.pool
+
+    def close(self, kill=False):
+        if self.pool is None:
+            return
+        if kill:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+        self.pool = None
+        multiprocessing.current_process().daemon = self._daemon
+
+    def record(self, namespace, status, elapsed):
+        family = self.families.get(namespace) or namespace
+        if isinstance(family, list):
+            family = family[0]
+        self.histograms.setdefault(family, LatencyHistogram()).add(status, elapsed)
+
+    def run_file(self, path):
+        """Return {namespace: ExtractorModel} of the extractors that matched the file and produced a config"""
+        matches = {}
+        for match in self.ruleset.rules.match(path, timeout=self.timeout):
+            matches.setdefault(match.namespace, []).append(ScannedMatch(match))
+        if not matches:
+            return {}
+
+        results = {}
+        digest = None
+        if self.cache is not None:
+            digest = file_sha256(path)
+            for namespace in list(matches):
+                cached = self.cache.get(digest, namespace, self.versions.get(namespace))
+                if cached is not MISS:
+                    del matches[namespace]
+                    if cached:
+                        results[namespace] = cached
+            if not matches:
+                return results
+
+        outcomes = {}
+        pool = self._get_pool()
+        if pool is None:
+            for namespace, hits in matches.items():
+                outcomes[namespace] = run_extractor(namespace, path, hits, self.timeout)
+        else:
+            outcomes = self._run_pooled(pool, path, matches)
+
+        for namespace, (status, result, elapsed) in outcomes.items():
+            self.record(namespace, status, elapsed)
+            if status == "ok":
+                if digest:
+                    self.cache.put(digest, namespace, self.versions.get(namespace), result)
+                if result:
+                    results[namespace] = result
+            elif status == "error":
+                log.warning("MACO extractor %s failed on %s: %s", namespace, path, result)
+            else:
+                log.warning("MACO extractor %s on %s: %s after %.1fs", namespace, path, status, elapsed)
+        return results
+
+    def _run_pooled(self, pool, path, matches):
+        pending = {
+            namespace: pool.apply_async(run_extractor, (namespace, path, hits, self.timeout)) for namespace, hits in matches.items()
+        }
+        # calls queue behind each other when there are more matches than workers
+        rounds = -(-len(pending) // self.workers)
+        deadline = time.monotonic() + rounds * self.timeout + KILL_GRACE
+        outcomes = {}
+        stuck = False
+        for namespace, job in pending.items():
+            try:
+                outcomes[namespace] = job.get(timeout=max(deadline - time.monotonic(), 0))
+            except multiprocessing.TimeoutError:
+                outcomes[namespace] = ("timeout", None, self.timeout + KILL_GRACE)
+                stuck = True
+            except Exception as e:
+                outcomes[namespace] = ("error", str(e), 0.0)
+        if stuck:
+            # a worker ignored the alarm, probably stuck in C code
+            self.close(kill=True)
+        return outcomes
+
+    def run(self, data):
+        """run_file for a payload in memory, written once to shared memory for the workers"""
+        folder = SHM_FOLDER if os.path.isdir(SHM_FOLDER) else None
+        with tempfile.NamedTemporaryFile(prefix="maco_", dir=folder) as f:
+            f.write(data)
+            f.flush()
+            return self.run_file(f.name)
+
+    def stats(self):
+        """Return {family: latency histogram} of the calls made so far"""
+        return {family: histogram.as_dict() for family, histogram in sorted(self.histograms.items())}
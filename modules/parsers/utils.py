@@ -1,24 +1,55 @@
+import glob
+import json
+import logging
 import os
 
-import requests
+log = logging.getLogger(__name__)
 
 # Raw file download template (default to Github-based raw download URL)
 CAPE_RAW_DOWNLOAD_TEMPLATE = os.environ.get(
     "CAPE_RAW_DOWNLOAD_TEMPLATE",
     "https://raw.githubusercontent.com/kevoreilly/CAPEv2/refs/heads/master/data/yara/CAPE/{family}.yar",
 )
+# Never try to download missing rules, for air-gapped deployments
+CAPE_YARA_OFFLINE = os.environ.get("CAPE_YARA_OFFLINE", "").lower() in ("1", "yes", "true")
 
+MACO_YARA_FOLDER = os.path.join(os.path.dirname(__file__), "yara")
+CAPE_YARA_FOLDER = os.path.join(os.path.dirname(__file__).split("/modules", 1)[0], "data", "yara", "CAPE")
+# Prebuilt {family: rule source} bundle, see utils/build_maco_bundle.py
+YARA_BUNDLE_PATH = os.path.join(MACO_YARA_FOLDER, "bundle.json")
 
-def get_YARA_rule(family: str) -> str | None:
+_bundle = None
+
+
+def get_YARA_bundle() -> dict:
+    """Return the prebuilt rule bundle, loaded once per process"""
+    global _bundle
+    if _bundle is None:
+        _bundle = {}
+        if os.path.exists(YARA_BUNDLE_PATH):
+            try:
+                with open(YARA_BUNDLE_PATH) as f:
+                    _bundle = json.load(f)
+            except (OSError, ValueError) as e:
+                log.warning("Can't load YARA bundle %s: %s", YARA_BUNDLE_PATH, e)
+    return _bundle
+
+
+def yara_rule_paths() -> list:
+    """Local rule files get_YARA_rule reads, in the order they are looked up"""
+    return [path for folder in (MACO_YARA_FOLDER, CAPE_YARA_FOLDER) for path in sorted(glob.glob(os.path.join(folder, "*.yar")))]
+
+
+def get_YARA_rule(family: str, offline: bool = CAPE_YARA_OFFLINE) -> str | None:
     root = os.path.join(os.path.dirname(__file__))
-    maco_yara_folder = os.path.join(root, "yara")
+    maco_yara_folder = MACO_YARA_FOLDER
     # Check to see if the rules local to MACO extractors exist (this can be rules cached from a previous run)
     if not os.path.exists(os.path.join(root, "yara")):
         os.makedirs(maco_yara_folder)
 
     # YARA rule paths that differ based on relativity to the MACO extractor
     maco_yara_path = f"{maco_yara_folder}/{family}.yar"
-    cape_yara_path = os.path.join(os.path.dirname(__file__).split("/modules", 1)[0], f"data/yara/CAPE/{family}.yar")
+    cape_yara_path = os.path.join(CAPE_YARA_FOLDER, f"{family}.yar")
 
     if os.path.exists(maco_yara_path):
         # Return rule that seems to be directly related to MACO extractor
@@ -30,7 +61,14 @@ def get_YARA_rule(family: str) -> str | None:
         with open(cape_yara_path) as f:
             return f.read()
 
+    # The bundle only stands in for rule files that aren't there, so a stale bundle can't shadow an updated rule
+    bundled = get_YARA_bundle().get(family)
+    if bundled or offline:
+        return bundled
+
     try:
+        import requests
+
         # Local rule doesn't exist, but maybe we can retrieve the corresponding core rule from CAPEv2
         # NOTE: This won't work in an air-gapped environment unless a mirror exists
         resp = requests.get(CAPE_RAW_DOWNLOAD_TEMPLATE.format(family=family), timeout=10)
@@ -42,3 +80,26 @@ def get_YARA_rule(family: str) -> str | None:
     except Exception as e:
         # No rule to be found, assume that extractor has proper exception handling or the rule is embedded
         return
+
+
+class LazyYARARule:
+    """Extractor.yara_rule resolved through get_YARA_rule on first access instead of at import.
+
+    The rule name defaults to the extractor's family, fallback is used when no rule is found.
+    Once resolved, the value replaces the descriptor on the extractor class.
+    """
+
+    def __init__(self, family: str = None, fallback: str = None):
+        self.family = family
+        self.fallback = fallback
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def rule_family(self, owner) -> str:
+        return self.family or owner.family
+
+    def __get__(self, instance, owner):
+        rule = get_YARA_rule(self.rule_family(owner)) or self.fallback
+        setattr(owner, self.name, rule)
+        return rule
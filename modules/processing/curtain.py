@@ -1,9 +1,14 @@
 from __future__ import absolute_import
 import ast
 import base64
+import hashlib
 import itertools
 import logging
+import multiprocessing
 import os
+import signal
+import threading
+import time
 import xml.etree.ElementTree as ET
 
 from lib.cuckoo.common.abstracts import Processing
@@ -30,228 +35,269 @@ message = """here_weg"""
 print(deobfuscate(message))
 '''
 
-
-def buildBehaviors(entry, behaviorTags):
-    # Generates possible code injection variations
-    # {Behavior:[["entry1","entry2"],["entry3","entry4"]]}
-
-    codeInject = (
-        ("VirtualAlloc", "NtAllocateVirtualMemory", "ZwAllocateVirtualMemory", "HeapAlloc"),
+# Deobfuscation budget, overridable with the workers/timeout options of the curtain module
+DEFAULT_WORKERS = 4
+DEFAULT_BLOCK_TIMEOUT = 30
+TIMEOUT_MESSAGE = "Deobfuscation timed out."
+# Deobfuscated blocks kept by the parent, keyed on the block text
+MEMO_SIZE = 1024
+_deobfuscated = {}
+
+
+# Generates possible code injection variations
+# {Behavior:[["entry1","entry2"],["entry3","entry4"]]}
+CODE_INJECT = (
+    ("VirtualAlloc", "NtAllocateVirtualMemory", "ZwAllocateVirtualMemory", "HeapAlloc"),
+    (
+        "CallWindowProcA",
+        "CallWindowProcW",
+        "DialogBoxIndirectParamA",
+        "DialogBoxIndirectParamW",
+        "EnumCalendarInfoA",
+        "EnumCalendarInfoW",
+        "EnumDateFormatsA",
+        "EnumDateFormatsW",
+        "EnumDesktopWindows",
+        "EnumDesktopsA",
+        "EnumDesktopsW",
+        "EnumLanguageGroupLocalesA",
+        "EnumLanguageGroupLocalesW",
+        "EnumPropsExA",
+        "EnumPropsExW",
+        "EnumPwrSchemes",
+        "EnumResourceTypesA",
+        "EnumResourceTypesW",
+        "EnumResourceTypesExA",
+        "EnumResourceTypesExW",
+        "EnumSystemCodePagesA",
+        "EnumSystemCodePagesW",
+        "EnumSystemLanguageGroupsA",
+        "EnumSystemLanguageGroupsW",
+        "EnumSystemLocalesA",
+        "EnumSystemLocalesW",
+        "EnumThreadWindows",
+        "EnumTimeFormatsA",
+        "EnumTimeFormatsW",
+        "EnumUILanguagesA",
+        "EnumUILanguagesW",
+        "EnumWindowStationsA",
+        "EnumWindowStationsW",
+        "EnumWindows",
+        "EnumerateLoadedModules",
+        "EnumerateLoadedModulesEx",
+        "EnumerateLoadedModulesExW",
+        "GrayStringA",
+        "GrayStringW",
+        "NotifyIpInterfaceChange",
+        "NotifyTeredoPortChange",
+        "NotifyUnicastIpAddressChange",
+        "SHCreateThread",
+        "SHCreateThreadWithHandle",
+        "SendMessageCallbackA",
+        "SendMessageCallbackW",
+        "SetWinEventHook",
+        "SetWindowsHookExA",
+        "SetWindowsHookExW",
+        "CreateThread",
+    ),
+)
+
+BEHAVIOR_COL = {
+    "Code Injection": tuple(itertools.product(*CODE_INJECT)),
+    "Downloader": (
+        ("New-Object", "Net.WebClient", "DownloadFile"),
+        ("New-Object", "Net.WebClient", "DownloadString"),
+        ("New-Object", "Net.WebClient", "DownloadData"),
+        ("WebProxy", "Net.CredentialCache"),
         (
-            "CallWindowProcA",
-            "CallWindowProcW",
-            "DialogBoxIndirectParamA",
-            "DialogBoxIndirectParamW",
-            "EnumCalendarInfoA",
-            "EnumCalendarInfoW",
-            "EnumDateFormatsA",
-            "EnumDateFormatsW",
-            "EnumDesktopWindows",
-            "EnumDesktopsA",
-            "EnumDesktopsW",
-            "EnumLanguageGroupLocalesA",
-            "EnumLanguageGroupLocalesW",
-            "EnumPropsExA",
-            "EnumPropsExW",
-            "EnumPwrSchemes",
-            "EnumResourceTypesA",
-            "EnumResourceTypesW",
-            "EnumResourceTypesExA",
-            "EnumResourceTypesExW",
-            "EnumSystemCodePagesA",
-            "EnumSystemCodePagesW",
-            "EnumSystemLanguageGroupsA",
-            "EnumSystemLanguageGroupsW",
-            "EnumSystemLocalesA",
-            "EnumSystemLocalesW",
-            "EnumThreadWindows",
-            "EnumTimeFormatsA",
-            "EnumTimeFormatsW",
-            "EnumUILanguagesA",
-            "EnumUILanguagesW",
-            "EnumWindowStationsA",
-            "EnumWindowStationsW",
-            "EnumWindows",
-            "EnumerateLoadedModules",
-            "EnumerateLoadedModulesEx",
-            "EnumerateLoadedModulesExW",
-            "GrayStringA",
-            "GrayStringW",
-            "NotifyIpInterfaceChange",
-            "NotifyTeredoPortChange",
-            "NotifyUnicastIpAddressChange",
-            "SHCreateThread",
-            "SHCreateThreadWithHandle",
-            "SendMessageCallbackA",
-            "SendMessageCallbackW",
-            "SetWinEventHook",
-            "SetWindowsHookExA",
-            "SetWindowsHookExW",
-            "CreateThread",
+            "Import-Module BitsTransfer",
+            "Start-BitsTransfer",
+            "Source",
+            "Destination",
         ),
+        ("New-Object", "Net.Sockets.TCPClient", "GetStream"),
+        ("$env:LocalAppData",),
+        ("Invoke-WebRequest",),
+        ("wget",),
+        ("Get-Content",),
+    ),
+    "Starts Process": (
+        ("Start-Process",),
+        ("New-Object", "IO.MemoryStream", "IO.StreamReader"),
+        ("Diagnostics.Process)::Start",),
+    ),
+    "Compression": (
+        ("Convert", "FromBase64String", "System.Text.Encoding"),
+        ("IO.Compression.GzipStream",),
+        ("(IO.Compression.CompressionMode)::Decompress",),
+        ("IO.Compression.DeflateStream",),
+    ),
+    "Uses Stealth": (
+        ("WindowStyle", "Hidden"),
+        ("CreateNoWindow=$true",),
+        ("ErrorActionPreference", "SilentlyContinue"),
+    ),
+    "Key Logging": (("GetAsyncKeyState", "Windows.Forms.Keys"),),
+    "Screen Scraping": (
+        ("New-Object", "Drawing.Bitmap", "Width", "Height"),
+        ("(Drawing.Graphics)::FromImage",),
+        ("CopyFroMScreen", "Location", "(Drawing.Point)::Empty", "Size"),
+    ),
+    "Custom Web Fields": (("Headers.Add",), ("SessionKey", "SessiodID")),
+    "Persistence": (
+        ("New-Object", "-COMObject", "Schedule.Service"),
+        ("SCHTASKS",),
+    ),
+    "Sleeps": (("Start-Sleep",),),
+    "Uninstalls Apps": (("foreach", "UninstallString"),),
+    "Obfuscation": (("-Join", "(int)", "-as", "(char)"),),
+    "Crypto": (
+        (
+            "New-Object",
+            "Security.Cryptography.AESCryptoServiceProvider",
+            "Mode",
+            "Key",
+            "IV",
+        ),
+        ("CreateEncryptor().TransformFinalBlock",),
+        ("CreateDecryptor().TransformFinalBlock",),
+    ),
+    "Enumeration/Profiling": (
+        ("(Environment)::UserDomainName",),
+        ("(Environment)::UserName",),
+        ("$env:username",),
+        ("(Environment)::MachineName",),
+        ("(Environment)::GetFolderPath",),
+        ("(System.IO.Path)::GetTempPath",),
+        ("$env:windir",),
+        ("GWMI Win32_NetworkAdapterConfiguration",),
+        ("Get-WMIObject Win32_NetworkAdapterConfiguration",),
+        ("GWMI Win32_OperatingSystem",),
+        ("Get-WMIObject Win32_OperatingSystem",),
+        ("(Security.Principal.WindowsIdentity)::GetCurrent",),
+        ("(Security.Principal.WindowsBuiltInRole)", "Administrator"),
+        ("(System.Diagnostics.Process)::GetCurrentProcess",),
+        ("PSVersionTable.PSVersion",),
+        ("New-Object", "Diagnostics.ProcessStartInfo"),
+        ("GWMI Win32_ComputerSystemProduct",),
+        ("Get-WMIObject Win32_ComputerSystemProduct",),
+        ("Get-Process -id",),
+        ("$env:userprofile",),
+        ("(Windows.Forms.SystemInformation)::VirtualScreen",),
+    ),
+    "Registry": (
+        ("HKCU:\\",),
+        ("HKLM:\\",),
+        ("New-ItemProperty", "-Path", "-Name", "-PropertyType", "-Value"),
+    ),
+    "Sends Data": (("UploadData", "POST"),),
+    "AppLocker Bypass": (("regsvr32", "/i:http", "scrobj.dll"),),
+    "AMSI Bypass": (
+        ("Management.Automation.AMSIUtils", "amsiInitFailed"),
+        ("Expect100Continue",),
+    ),
+    "Disables Windows Defender": (
+        ("DisableBehaviorMonitoring",),
+        ("DisableBlockAtFirstSeen",),
+        ("DisableIntrusionPreventionSystem",),
+        ("DisableIOAVProtection",),
+        ("DisablePrivacyMode",),
+        ("DisableRealtimeMonitoring",),
+        ("DisableScriptScanning",),
+        ("LowThreatDefaultAction",),
+        ("ModerateThreatDefaultAction",),
+        ("SevereThreatDefaultAction)",),
+    ),
+    "Clear Logs": (("GlobalSession.ClearLog",),),
+    "Invokes C# .NET Assemblies": (("Add-Type",),),
+    "Modifies Shadowcopy": (("Win32_Shadowcopy",),),
+}
+
+
+def _keyword_sets(checks):
+    return tuple(frozenset(value.lower() for value in check) for check in checks)
+
+
+# Lowercased keyword sets per behavior and every distinct keyword, searched once per message
+BEHAVIOR_KEYWORDS = {behavior: _keyword_sets(checks) for behavior, checks in BEHAVIOR_COL.items()}
+ALL_KEYWORDS = frozenset().union(*(keywords for checks in BEHAVIOR_KEYWORDS.values() for keywords in checks))
+
+
+def messageKeywords(message):
+    """Return the set of behavior keywords present in a message."""
+    lowered = message.lower()
+    return {keyword for keyword in ALL_KEYWORDS if keyword in lowered}
+
+
+def isObfuscatedByFrequency(message):
+    # Character Frequency Analysis
+    return (
+        message.count("w") >= 500
+        or message.count("4") >= 250
+        or message.count("_") >= 250
+        or message.count("D") >= 250
+        or message.count("C") >= 200
+        or message.count("K") >= 200
+        or message.count("O") >= 200
+        or message.count(":") >= 100
+        or message.count(";") >= 100
+        or message.count(",") >= 100
+        or (message.count("(") >= 50 and message.count(")") >= 50)
+        or (message.count("[") >= 50 and message.count("]") >= 50)
+        or (message.count("{") >= 50 and message.count("}") >= 50)
     )
 
-    behaviorCol = {
-        "Code Injection": list(itertools.product(*codeInject)),
-        "Downloader": (
-            ("New-Object", "Net.WebClient", "DownloadFile"),
-            ("New-Object", "Net.WebClient", "DownloadString"),
-            ("New-Object", "Net.WebClient", "DownloadData"),
-            ("WebProxy", "Net.CredentialCache"),
-            (
-                "Import-Module BitsTransfer",
-                "Start-BitsTransfer",
-                "Source",
-                "Destination",
-            ),
-            ("New-Object", "Net.Sockets.TCPClient", "GetStream"),
-            ("$env:LocalAppData"),
-            ("Invoke-WebRequest"),
-            ("wget"),
-            ("Get-Content"),
-        ),
-        "Starts Process": (
-            ("Start-Process"),
-            ("New-Object", "IO.MemoryStream", "IO.StreamReader"),
-            ("Diagnostics.Process)::Start"),
-        ),
-        "Compression": (
-            ("Convert", "FromBase64String", "System.Text.Encoding"),
-            ("IO.Compression.GzipStream"),
-            ("(IO.Compression.CompressionMode)::Decompress"),
-            ("IO.Compression.DeflateStream"),
-        ),
-        "Uses Stealth": (
-            ("WindowStyle", "Hidden"),
-            ("CreateNoWindow=$true"),
-            ("ErrorActionPreference", "SilentlyContinue"),
-        ),
-        "Key Logging": (("GetAsyncKeyState", "Windows.Forms.Keys")),
-        "Screen Scraping": (
-            ("New-Object", "Drawing.Bitmap", "Width", "Height"),
-            ("(Drawing.Graphics)::FromImage"),
-            ("CopyFroMScreen", "Location", "(Drawing.Point)::Empty", "Size"),
-        ),
-        "Custom Web Fields": (("Headers.Add"), ("SessionKey", "SessiodID")),
-        "Persistence": (
-            ("New-Object", "-COMObject", "Schedule.Service"),
-            ("SCHTASKS"),
-        ),
-        "Sleeps": (("Start-Sleep")),
-        "Uninstalls Apps": (("foreach", "UninstallString")),
-        "Obfuscation": (("-Join", "(int)", "-as", "(char)")),
-        "Crypto": (
-            (
-                "New-Object",
-                "Security.Cryptography.AESCryptoServiceProvider",
-                "Mode",
-                "Key",
-                "IV",
-            ),
-            ("CreateEncryptor().TransformFinalBlock"),
-            ("CreateDecryptor().TransformFinalBlock"),
-        ),
-        "Enumeration/Profiling": (
-            ("(Environment)::UserDomainName"),
-            ("(Environment)::UserName"),
-            ("$env:username"),
-            ("(Environment)::MachineName"),
-            ("(Environment)::GetFolderPath"),
-            ("(System.IO.Path)::GetTempPath"),
-            ("$env:windir"),
-            ("GWMI Win32_NetworkAdapterConfiguration"),
-            ("Get-WMIObject Win32_NetworkAdapterConfiguration"),
-            ("GWMI Win32_OperatingSystem"),
-            ("Get-WMIObject Win32_OperatingSystem"),
-            ("(Security.Principal.WindowsIdentity)::GetCurrent"),
-            ("(Security.Principal.WindowsBuiltInRole)", "Administrator"),
-            ("(System.Diagnostics.Process)::GetCurrentProcess"),
-            ("PSVersionTable.PSVersion"),
-            ("New-Object", "Diagnostics.ProcessStartInfo"),
-            ("GWMI Win32_ComputerSystemProduct"),
-            ("Get-WMIObject Win32_ComputerSystemProduct"),
-            ("Get-Process -id"),
-            ("$env:userprofile"),
-            ("(Windows.Forms.SystemInformation)::VirtualScreen"),
-        ),
-        "Registry": (
-            ("HKCU:\\"),
-            ("HKLM:\\"),
-            ("New-ItemProperty", "-Path", "-Name", "-PropertyType", "-Value"),
-        ),
-        "Sends Data": (("UploadData", "POST")),
-        "AppLocker Bypass": (("regsvr32", "/i:http", "scrobj.dll")),
-        "AMSI Bypass": (
-            ("Management.Automation.AMSIUtils", "amsiInitFailed"),
-            ("Expect100Continue"),
-        ),
-        "Disables Windows Defender": (
-            ("DisableBehaviorMonitoring"),
-            ("DisableBlockAtFirstSeen"),
-            ("DisableIntrusionPreventionSystem"),
-            ("DisableIOAVProtection"),
-            ("DisablePrivacyMode"),
-            ("DisableRealtimeMonitoring"),
-            ("DisableScriptScanning"),
-            ("LowThreatDefaultAction"),
-            ("ModerateThreatDefaultAction"),
-            ("SevereThreatDefaultAction)"),
-        ),
-        "Clear Logs": (("GlobalSession.ClearLog")),
-        "Invokes C# .NET Assemblies": (("Add-Type")),
-        "Modifies Shadowcopy": (("Win32_Shadowcopy")),
-    }
 
+def buildBehaviors(entry, behaviorTags):
     for event in entry:
         for message in entry[event]:
             message = entry[event][message]
-            for behavior in behaviorCol:
+            present = messageKeywords(message)
+            for behavior, checks in BEHAVIOR_KEYWORDS.items():
+                if behavior in behaviorTags:
+                    continue
                 # Check Behavior Keywords
-                for check in behaviorCol[behavior]:
-                    if behavior not in behaviorTags and all(value.lower() in message.lower() for value in check):
-                        behaviorTags.append(behavior)
-                # Check Character Frequency Analysis
-                if (
-                    behavior == "Obfuscation"
-                    and (
-                        (
-                            message.count("w") >= 500
-                            or message.count("4") >= 250
-                            or message.count("_") >= 250
-                            or message.count("D") >= 250
-                            or message.count("C") >= 200
-                            or message.count("K") >= 200
-                            or message.count("O") >= 200
-                            or message.count(":") >= 100
-                            or message.count(";") >= 100
-                            or message.count(",") >= 100
-                            or (message.count("(") >= 50 and message.count(")") >= 50)
-                            or (message.count("[") >= 50 and message.count("]") >= 50)
-                            or (message.count("{") >= 50 and message.count("}") >= 50)
-                        )
-                    )
-                    and behavior not in behaviorTags
-                ):
+                if any(check <= present for check in checks):
+                    behaviorTags.append(behavior)
+                elif behavior == "Obfuscation" and isObfuscatedByFrequency(message):
                     behaviorTags.append(behavior)
 
     return behaviorTags
 
 
+FORMAT_RE = re.compile(r"(\"|')(\{[0-9]{1,2}\})+(\"|')[ -fF].+?'.+?'\)(?!(\"|'|;))")
+CHAR_RE = re.compile(r"\[[Cc][Hh][Aa][Rr]\][0-9]{1,3}")
+MULTISPACE_RE = re.compile(" +")
+PARENS_QUOTED_RE = re.compile(r"\(('[\w\d\s,\/\-\/\*\.:'+]+')\)")
+PARENS_OPEN_RE = re.compile(r"\('[\w\d\s,\/\-\/\*\.:]+")
+PARENS_CLOSE_RE = re.compile(r"'[\w\d\s,\/\-\/\*\.:]+'\)")
+DIGITS_RE = re.compile(r"\d+")
+DIGITS_3_RE = re.compile(r"\d{1,3}")
+NUMBER_RE = re.compile("[0-9]+")
+QUOTED_RE = re.compile("('.+?'|\".+?\")")
+QUOTE_START_RE = re.compile("(\"|').+")
+CHAR_WORD_RE = re.compile("char", re.IGNORECASE)
+SPLIT_JOIN_RE = re.compile(r"-join\s+?\(\s?'(.+)\.split\(.+\)\s+?\|\s+?foreach", re.I)
+XOR_JOIN_RE = re.compile(r"join\(\s?['\"]+\s?,\(\s?['\"].+'\s?\)\s?\|\s?foreach-object\s?.+-bxor\s?(0x[\d\w]+)", re.I)
+FORMAT_REPLACE_RE = re.compile(r'"([{\d{1,3}\}]+)"\-f(.+)\)\)\s+(-replace.*)', re.I)
+CHAR_BLOCKS_RE = re.compile(r"([\[cHAR\]\d{1,3}\+']+\)),(\[char\]\d{1,3})", re.I)
+
+
 def formatReplace(inputString, MODFLAG):
     """
     OLD: ("{1}{0}{2}" -F"AMP","EX","LE")
     NEW: "EXAMPLE"
     """
     # Find group of obfuscated string
-    obfGroup = re.search(r"(\"|')(\{[0-9]{1,2}\})+(\"|')[ -fF].+?'.+?'\)(?!(\"|'|;))", inputString).group()
+    obfGroup = FORMAT_RE.search(inputString).group()
     # There are issues with multiple nested groupings that I haven't been able to solve yet, but doesn't change the final output of the PS script
     # obfGroup = re.search(r"(\"|\')(\{[0-9]{1,2}\})+(\"|\')[ -fF]+?(\"|\').+?(\"|\')(?=\)([!.\"\';)( ]))", inputString).group()
 
     # Build index and string lists
-    indexList = [int(x) for x in re.findall(r"\d+", obfGroup.split("-", 1)[0])]
+    indexList = [int(x) for x in DIGITS_RE.findall(obfGroup.split("-", 1)[0])]
 
     # This is to address scenarios where the string built is more PS commands with quotes
-    stringList = re.search("(\"|').+", "-".join(obfGroup.split("-")[1:])[:-1]).group()
+    stringList = QUOTE_START_RE.search("-".join(obfGroup.split("-")[1:])[:-1]).group()
     stringChr = stringList[0]
     stringList = stringList.replace(f"{stringChr},{stringChr}", "\x00")[1:-1]
     stringList = stringList.replace("'", "\x01").replace('"', "\x02")
@@ -281,7 +327,7 @@ def charReplace(inputString, MODFLAG):
     OLD: [char]101
     NEW: e
     """
-    for value in re.findall(r"\[[Cc][Hh][Aa][Rr]\][0-9]{1,3}", inputString):
+    for value in CHAR_RE.findall(inputString):
         inputString = inputString.replace(value, f'"{chr(int(value.split("]", 2)[1]))}"')
     if MODFLAG == 0:
         MODFLAG = 1
@@ -293,7 +339,7 @@ def spaceReplace(inputString, MODFLAG):
     OLD: $var=    "EXAMPLE"
     NEW: $var= "EXAMPLE"
     """
-    return re.sub(" +", " ", inputString), MODFLAG
+    return MULTISPACE_RE.sub(" ", inputString), MODFLAG
 
 
 def joinStrings(inputString, MODFLAG):
@@ -352,19 +398,19 @@ def removeParenthesis(inputString, MODFLAG):
     OLD ('ls11, ')+('tls'))
     NEW: tls11,tls
     """
-    matches = re.findall(r"\(('[\w\d\s,\/\-\/\*\.:'+]+')\)", inputString)
+    matches = PARENS_QUOTED_RE.findall(inputString)
     if matches:
         MODFLAG = 1
     for pattern in matches:
         inputString = inputString.replace(f"({pattern})", pattern)  # .replace("'", "")
 
-    matches = re.findall(r"\('[\w\d\s,\/\-\/\*\.:]+", inputString)
+    matches = PARENS_OPEN_RE.findall(inputString)
     if matches:
         MODFLAG = 1
     for pattern in matches:
         inputString = inputString.replace(f"({pattern}", pattern)
 
-    matches += re.findall(r"'[\w\d\s,\/\-\/\*\.:]+'\)", inputString)
+    matches += PARENS_CLOSE_RE.findall(inputString)
     if matches:
         MODFLAG = 1
     for pattern in matches:
@@ -412,7 +458,7 @@ def replaceDecoder(inputString, MODFLAG):
                 firstPart = " ".join(replaceString.split(",", 1)[0].split("[")[1:]).replace("'", "").replace('"', "")
 
             elif "'" in replaceString.split(",", 1)[0].strip() or '"' in replaceString.split(",", 1)[0].strip():
-                firstPart = re.search("('.+?'|\".+?\")", replaceString.split(",", 1)[0]).group().replace("'", "").replace('"', "")
+                firstPart = QUOTED_RE.search(replaceString.split(",", 1)[0]).group().replace("'", "").replace('"', "")
 
             else:
                 firstPart = replaceString.split(",", 1)[0].split("'", 2)[1].replace("'", "").replace('"', "")
@@ -423,18 +469,18 @@ def replaceDecoder(inputString, MODFLAG):
             firstPart = replaceString.split(",", 1)[0].rsplit("(", 1)[-1].replace("'", "").replace('"', "")
         secondPart = replaceString.split(",", 2)[1].split(")", 1)[0].replace("'", "").replace('"', "")
         if "+" in firstPart:
-            newFirst = "".join(chr(int(re.search("[0-9]+", entry).group())) for entry in firstPart.split("+"))
+            newFirst = "".join(chr(int(NUMBER_RE.search(entry).group())) for entry in firstPart.split("+"))
             firstPart = newFirst
 
-        if re.search("char", firstPart, re.IGNORECASE):
-            firstPart = chr(int(re.search("[0-9]+", firstPart).group()))
+        if CHAR_WORD_RE.search(firstPart):
+            firstPart = chr(int(NUMBER_RE.search(firstPart).group()))
 
         if "+" in secondPart:
-            newSecond = "".join(chr(int(re.search("[0-9]+", entry).group())) for entry in secondPart.split("+"))
+            newSecond = "".join(chr(int(NUMBER_RE.search(entry).group())) for entry in secondPart.split("+"))
             secondPart = newSecond
 
-        if re.search("char", secondPart, re.IGNORECASE):
-            secondPart = chr(int(re.search("[0-9]+", secondPart).group()))
+        if CHAR_WORD_RE.search(secondPart):
+            secondPart = chr(int(NUMBER_RE.search(secondPart).group()))
 
         tempString = tempString.replace(firstPart, secondPart)
         inputString = tempString
@@ -469,42 +515,38 @@ def deobfuscate(MESSAGE):
     # Original and altered will be saved
     ALTMSG = MESSAGE.strip()
 
-    if re.search("\x00", ALTMSG):
+    if "\x00" in ALTMSG:
         ALTMSG, MODFLAG = removeNull(ALTMSG, MODFLAG)
 
-    if re.search("(\\\"|\\')", ALTMSG):
+    if '"' in ALTMSG or "'" in ALTMSG:
         ALTMSG, MODFLAG = removeEscape(ALTMSG, MODFLAG)
 
-    if re.search("`", ALTMSG):
+    if "`" in ALTMSG:
         ALTMSG, MODFLAG = removeTick(ALTMSG, MODFLAG)
 
-    if re.search(r"\^", ALTMSG):
+    if "^" in ALTMSG:
         ALTMSG, MODFLAG = removeCaret(ALTMSG, MODFLAG)
 
     # strip - ('ls11, ')+('tls')
     # import code;code.interact(local=dict(locals(), **globals()))
-    if (
-        re.search(r"\(('[\w\d\s,\/\-\/\*\.:'+]+')\)", ALTMSG)
-        or re.search(r"\('[\w\d\s,\/\-\/\*\.:]+", ALTMSG)
-        or re.search(r"'[\w\d\s,\/\-\/\*\.:]+'\)", ALTMSG)
-    ):
+    if PARENS_QUOTED_RE.search(ALTMSG) or PARENS_OPEN_RE.search(ALTMSG) or PARENS_CLOSE_RE.search(ALTMSG):
         ALTMSG, MODFLAG = removeParenthesis(ALTMSG, MODFLAG)
 
-    while re.search("[\x20]{2,}", ALTMSG):
+    while "  " in ALTMSG:
         ALTMSG, MODFLAG = spaceReplace(ALTMSG, MODFLAG)
 
     # One run pre charPreplace
-    if re.search(r"\[[Cc][Hh][Aa][Rr]\][0-9]{1,3}", ALTMSG):
+    if CHAR_RE.search(ALTMSG):
         ALTMSG, MODFLAG = charReplace(ALTMSG, MODFLAG)
 
-    if re.search(r"(\"\+\"|'\+')", ALTMSG):
+    if '"+"' in ALTMSG or "'+'" in ALTMSG:
         ALTMSG, MODFLAG = joinStrings(ALTMSG, MODFLAG)
 
-    while re.search(r"(\"|')(\{[0-9]{1,2}\})+(\"|')[ -fF].+?'.+?'\)(?!(\"|'|;))", ALTMSG):
+    while FORMAT_RE.search(ALTMSG):
         ALTMSG, MODFLAG = formatReplace(ALTMSG, MODFLAG)
 
     # One run post formatReplace for new strings
-    if re.search(r"(\"\+\"|'\+')", ALTMSG):
+    if '"+"' in ALTMSG or "'+'" in ALTMSG:
         ALTMSG, MODFLAG = joinStrings(ALTMSG, MODFLAG)
 
     if "replace" in ALTMSG.lower():
@@ -514,29 +556,28 @@ def deobfuscate(MESSAGE):
             log.error("Curtain processing error for entry - %s", e)
 
     # https://malwaretips.com/threads/how-to-de-obfuscate-powershell-script-commands-examples.76369/
-    if re.search(r"-join\s+?\(\s?'(.+)\.split\(.+\)\s+?\|\s+?foreach", MESSAGE, re.I):
-        chars = re.findall(r"\d{1,3}", MESSAGE)
+    if SPLIT_JOIN_RE.search(MESSAGE):
+        chars = DIGITS_3_RE.findall(MESSAGE)
         ALTMSG = "".join([chr(int(i)) for i in chars])
         MODFLAG = 1
 
-    if re.search(r"join\(\s?['\"]+\s?,\(\s?['\"].+'\s?\)\s?\|\s?foreach-object\s?.+-bxor\s?(0x[\d\w]+)", MESSAGE, re.I):
-        xorkey = re.findall(r"join\(\s?['\"]+\s?,\(\s?['\"].+'\s?\)\s?\|\s?foreach-object\s?.+-bxor\s?(0x[\d\w]+)", MESSAGE, re.I)[
-            0
-        ]
-        chars = re.findall(r"\d{1,3}", MESSAGE)
+    xorkeys = XOR_JOIN_RE.findall(MESSAGE)
+    if xorkeys:
+        xorkey = xorkeys[0]
+        chars = DIGITS_3_RE.findall(MESSAGE)
         ALTMSG = "".join([chr(int(i) ^ int(xorkey, 16)) for i in chars])
         MODFLAG = 1
 
-    if re.search(r'"([{\d{1,3}\}]+)"\-f(.+)\)\)\s+(-replace.*)', MESSAGE, re.I):
-        res = re.findall(r'"([{\d{1,3}\}]+)"\-f(.+)\)\)\s+(-replace.*)', MESSAGE, re.I)
+    res = FORMAT_REPLACE_RE.findall(MESSAGE)
+    if res:
         formated, data, replaces = res[0]
         r = formated.format(*data.split("','")).replace("'", "")
         # split by blocks
-        blocks = re.findall(r"([\[cHAR\]\d{1,3}\+']+\)),(\[char\]\d{1,3})", MESSAGE, re.I)
+        blocks = CHAR_BLOCKS_RE.findall(MESSAGE)
         for i in blocks:
             ALTMSG = r.replace(
-                "".join([chr(int(i)) for i in re.findall(r"\d{1,3}", i[0])]),
-                "".join([chr(int(i)) for i in re.findall(r"\d{1,3}", i[1])]),
+                "".join([chr(int(i)) for i in DIGITS_3_RE.findall(i[0])]),
+                "".join([chr(int(i)) for i in DIGITS_3_RE.findall(i[1])]),
             )
             MODFLAG = 1
             # Remove camel case obfuscation as last step
@@ -548,6 +589,119 @@ def deobfuscate(MESSAGE):
     return ALTMSG
 
 
+def block_digest(message):
+    return hashlib.sha256(message.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class BlockTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise BlockTimeout()
+
+
+def deobfuscate_inline(message, timeout):
+    """deobfuscate() under a SIGALRM timer, which only the main thread can set"""
+    if not timeout or threading.current_thread() is not threading.main_thread():
+        return deobfuscate(message)
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return deobfuscate(message)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _watch_parent(parent):
+    # workers block on the task queue forever once their parent is gone
+    while os.getppid() == parent:
+        time.sleep(1)
+    os._exit(1)
+
+
+def _init_worker(parent):
+    threading.Thread(target=_watch_parent, args=(parent,), daemon=True).start()
+
+
+def start_pool(workers):
+    """Process pool usable from CAPE's daemonic processing workers, or None.
+
+    multiprocessing refuses to start children from a daemonic process. The flag only guards
+    that check, so it is lifted until the pool is terminated; the workers exit with their parent.
+    """
+    process = multiprocessing.current_process()
+    daemon = process.daemon
+    try:
+        process.daemon = False
+        return multiprocessing.Pool(workers, initializer=_init_worker, initargs=(os.getpid(),))
+    except (AssertionError, OSError) as e:
+        process.daemon = daemon
+        log.warning("Curtain process pool unavailable, deobfuscating inline: %s", e)
+        return None
+
+
+def deobfuscate_blocks(messages, workers=DEFAULT_WORKERS, timeout=DEFAULT_BLOCK_TIMEOUT):
+    """
+    Deobfuscate unique script blocks, spread over a process pool when workers > 1.
+
+    Parameters:
+        messages (iterable): powershell blocks, duplicates are only deobfuscated once
+        workers (int): size of the process pool, 1 or less runs inline
+        timeout (int): seconds a single block may take
+
+    Returns:
+        dict: sha256 of the block -> deobfuscated powershell
+    """
+    results = {}
+    unique = {}
+    for message in messages:
+        digest = block_digest(message)
+        if message in _deobfuscated:
+            results[digest] = _deobfuscated[message]
+        else:
+            unique.setdefault(digest, message)
+
+    pool = None
+    daemon = multiprocessing.current_process().daemon
+    if workers > 1 and len(unique) > 1:
+        pool = start_pool(min(workers, len(unique)))
+
+    if pool is None:
+        for digest, message in unique.items():
+            try:
+                results[digest] = deobfuscate_inline(message, timeout)
+            except BlockTimeout:
+                log.warning("Curtain deobfuscation of block %s exceeded %d seconds", digest, timeout)
+                results[digest] = TIMEOUT_MESSAGE
+    else:
+        try:
+            pending = {digest: pool.apply_async(deobfuscate, (message,)) for digest, message in unique.items()}
+            for digest, job in pending.items():
+                try:
+                    results[digest] = job.get(timeout=timeout)
+                except multiprocessing.TimeoutError:
+                    log.warning("Curtain deobfuscation of block %s exceeded %d seconds", digest, timeout)
+                    results[digest] = TIMEOUT_MESSAGE
+                except Exception as e:
+                    log.error("Curtain processing error for block %s - %s", digest, e)
+                    results[digest] = "No alteration of event."
+        finally:
+            # Kill workers stuck on a pathological block instead of waiting for them
+            pool.terminate()
+            pool.join()
+            multiprocessing.current_process().daemon = daemon
+
+    for digest, message in unique.items():
+        if results[digest] == TIMEOUT_MESSAGE:
+            continue
+        if len(_deobfuscated) >= MEMO_SIZE:
+            del _deobfuscated[next(iter(_deobfuscated))]
+        _deobfuscated[message] = results[digest]
+    return results
+
+
 class Curtain(Processing):
     """Parse Curtain log for PowerShell 4104 Events."""
 
@@ -673,13 +827,21 @@ class Curtain(Processing):
 
         new_dict = list(messages_by_task.values())
 
+        deobfuscated = {}
+        if FILTERFLAG == 0:
+            deobfuscated = deobfuscate_blocks(
+                (block["message"] for block in new_dict if block["message"] is not None),
+                workers=int(self.options.get("workers", DEFAULT_WORKERS)),
+                timeout=int(self.options.get("timeout", DEFAULT_BLOCK_TIMEOUT)),
+            )
+
         for block in new_dict:
             MESSAGE = block["message"]
             pid = block["pid"]
             # Save the record
             if FILTERFLAG == 0 and MESSAGE is not None:
                 COUNTER += 1
-                ALTMSG = deobfuscate(MESSAGE)
+                ALTMSG = deobfuscated[block_digest(MESSAGE)]
 
                 # Save the output
                 pids[pid]["events"].append({str(COUNTER): {"original": MESSAGE.strip(), "altered": ALTMSG}})
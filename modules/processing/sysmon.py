@@ -1,8 +1,8 @@
 import logging
 import os
 import re
+from xml.etree import ElementTree
 
-import xmltodict
 from lib.cuckoo.common.abstracts import Processing
 from lib.cuckoo.common.exceptions import CuckooProcessingError
 
@@ -12,46 +12,152 @@ __author__ = "@FernandoDoming,@cccs-kevin"
 __version__ = "2.0.0"
 
 
+# Process creations of the analysis tooling itself, matched against the CommandLine of EventID 1
+NOISY_PROC_CREATIONS_RE = re.compile(
+    "|".join(
+        "(?:%s)" % pattern
+        for pattern in (
+            r"C:\\Windows\\System32\\wevtutil\.exe\s+clear-log\s+microsoft-windows-(sysmon|powershell)\/operational",
+            r"bin\\is32bit.exe",
+            r"bin\\inject-(?:x86|x64).exe",
+            r"C:\\Windows\\System32\\wevtutil.exe\s+query-events microsoft-windows-powershell\/operational\s+\/rd:true\s+\/e:root\s+\/format:xml\s+\/uni:true",
+            r"C:\\Windows\\System32\\wevtutil.exe\s+query-events\s+microsoft-windows-sysmon\/operational\s+\/format:xml",
+        )
+    )
+)
+
+# Bytes of sysmon data fed to the XML parser at a time
+READ_CHUNK_SIZE = 1024 * 1024
+
+
 def parseXmlToJson(xml):
     return {child.tag: parseXmlToJson(child) if list(child) else child.text or "" for child in list(xml)}
 
 
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def element_to_dict(element):
+    """Convert an ElementTree element into the same structure xmltodict.parse produces."""
+    result = {"@" + _local_name(key): value for key, value in element.attrib.items()}
+    for child in element:
+        key = _local_name(child.tag)
+        value = element_to_dict(child)
+        if key in result:
+            if not isinstance(result[key], list):
+                result[key] = [result[key]]
+            result[key].append(value)
+        else:
+            result[key] = value
+    text = element.text.strip() if element.text else ""
+    if text:
+        if not result:
+            return text
+        result["#text"] = text
+    return result or None
+
+
+def event_data(event, name):
+    """Return the value of the named EventData/Data field of an event."""
+    data = (event.get("EventData") or {}).get("Data") or []
+    if isinstance(data, dict):
+        data = [data]
+    for field in data:
+        if isinstance(field, dict) and field.get("@Name") == name:
+            return field.get("#text")
+    return None
+
+
+def massage_linux_line(line: bytes):
+    # Remove the date+hostname+service+pid from the line
+    if b": <" in line:
+        _, content = line.split(b": <", 1)
+        return (b"<" + content).strip()
+    return None
+
+
 def massage_linux_data(journalctl_output: list) -> bytes:
-    # Remove the date+hostname+service+pid from each line
     massaged_output = []
     for line in journalctl_output:
-        if b": <" in line:
-            _, content = line.split(b": <")
-            refined_content = b"<" + content
-            massaged_output.append(refined_content.strip())
+        refined_content = massage_linux_line(line)
+        if refined_content is not None:
+            massaged_output.append(refined_content)
 
     return b"<Events>" + b"\n".join(massaged_output) + b"</Events>"
 
 
-class Sysmon(Processing):
-    def remove_noise(self, data):
-        filtered_proc_creations_re = (
-            r"C:\\Windows\\System32\\wevtutil\.exe\s+clear-log\s+microsoft-windows-(sysmon|powershell)\/operational",
-            r"bin\\is32bit.exe",
-            r"bin\\inject-(?:x86|x64).exe",
-            r"C:\\Windows\\System32\\wevtutil.exe\s+query-events microsoft-windows-powershell\/operational\s+\/rd:true\s+\/e:root\s+\/format:xml\s+\/uni:true",
-            r"C:\\Windows\\System32\\wevtutil.exe\s+query-events\s+microsoft-windows-sysmon\/operational\s+\/format:xml",
-        )
+def iter_windows_chunks(path):
+    # sysmon.xml is read as latin1, as the whole-file parser always did
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk.decode("latin1")
+
+
+def iter_linux_chunks(path):
+    yield b"<Events>"
+    with open(path, "rb") as f:
+        for line in f:
+            refined_content = massage_linux_line(line)
+            if refined_content is not None:
+                yield refined_content + b"\n"
+    yield b"</Events>"
+
+
+def iter_events(chunks, event_ids=None, fields=None):
+    """Yield Event elements one at a time as xmltodict-style dicts.
+
+    Only events whose EventID is in event_ids are kept when given, and fields limits the
+    EventData/Data entries of every kept event to those names.
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    root = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for action, element in parser.read_events():
+            if action == "start":
+                if root is None:
+                    root = element
+                continue
+            if _local_name(element.tag) != "Event":
+                continue
+            event = element_to_dict(element) or {}
+            # Drop what has been converted so the tree never grows past one event
+            root.clear()
+            if event_ids and (event.get("System") or {}).get("EventID") not in event_ids:
+                continue
+            if "}" in element.tag:
+                event = {"@xmlns": element.tag[1:].split("}", 1)[0], **event}
+            if fields and isinstance(event.get("EventData"), dict):
+                data = event["EventData"].get("Data") or []
+                if isinstance(data, dict):
+                    data = [data]
+                event["EventData"]["Data"] = [field for field in data if isinstance(field, dict) and field.get("@Name") in fields]
+            yield event
+    parser.close()
+
 
-        filtered = []
-        for event in data:
-            is_filtered = False
-            if event["System"]["EventID"] == "1":
-                for p in filtered_proc_creations_re:
-                    cmdline = event["EventData"]["Data"][9].get("#text")
-                    if cmdline and re.search(p, cmdline):
-                        log.info("Supressed %s because it is noisy", cmdline)
-                        is_filtered = True
+class Sysmon(Processing):
+    def is_noise(self, event):
+        if (event.get("System") or {}).get("EventID") != "1":
+            return False
+        cmdline = event_data(event, "CommandLine")
+        if cmdline and NOISY_PROC_CREATIONS_RE.search(cmdline):
+            log.info("Supressed %s because it is noisy", cmdline)
+            return True
+        return False
 
-            if not is_filtered:
-                filtered.append(event)
+    def remove_noise(self, data):
+        return [event for event in data if not self.is_noise(event)]
 
-        return filtered
+    def _option_set(self, name):
+        value = self.options.get(name) if getattr(self, "options", None) else None
+        if not value:
+            return None
+        return {item.strip() for item in str(value).split(",") if item.strip()}
 
     def run(self):
         self.key = "sysmon"
@@ -70,31 +176,23 @@ class Sysmon(Processing):
             return
 
         # Figure out which sysmon data file we will be using
-        sysmon_path = None
-        windows = False
-        linux = False
         if os.path.exists(windows_sysmon_data_path):
             sysmon_path = windows_sysmon_data_path
-            windows = True
+            chunks = iter_windows_chunks(sysmon_path)
         elif os.path.exists(linux_sysmon_data_path):
             sysmon_path = linux_sysmon_data_path
-            linux = True
+            chunks = iter_linux_chunks(sysmon_path)
         else:
             return
 
-        data = None
+        # Optional projection, e.g. event_ids = 1,3,11 and fields = Image,CommandLine,ParentImage
+        event_ids = self._option_set("event_ids")
+        fields = self._option_set("fields")
+        if fields:
+            # Needed by the noise filter
+            fields.add("CommandLine")
+
         try:
-            if windows:
-                xml = open(sysmon_path, "rb").read()
-                xml = xml.decode("latin1").encode("utf8")
-                data = xmltodict.parse(xml)["Events"]["Event"]
-            elif linux:
-                journalctl_output = open(sysmon_path, "rb").readlines()
-                xml = massage_linux_data(journalctl_output)
-                data = xmltodict.parse(xml)["Events"]["Event"]
-            else:
-                return
+            return [event for event in iter_events(chunks, event_ids, fields) if not self.is_noise(event)]
         except Exception as e:
             raise CuckooProcessingError(f"Failed parsing {sysmon_path}: {e}")
-
-        return self.remove_noise(data)
@@ -0,0 +1,37 @@
+"""Add the following to your $CUCKOO_PATH/conf/processing.conf
+[tlscerts]
+enabled = yes            # yes/no
+mmap = yes               # Map the capture instead of reading it record by record
+max_flow_bytes = 262144  # Stop following a TCP flow after this many bytes
+
+pcap2cert is a reporting module, so it runs after the signatures. This module extracts the
+sha1 of the server certificates from the capture during processing, for bad_ssl_certs.
+"""
+
+import hashlib
+import logging
+import os
+from base64 import b64decode
+
+from lib.cuckoo.common.abstracts import Processing
+from modules.reporting.pcap2cert import MAX_FLOW_BYTES, PCAP2CERT
+
+log = logging.getLogger(__name__)
+
+
+class TLSCerts(Processing):
+    """Sha1 of the server certificates seen in the network capture."""
+
+    def run(self):
+        self.key = "tls_certs"
+        pcap_path = os.path.join(self.analysis_path, "dump.pcap")
+        if not os.path.exists(pcap_path):
+            return []
+
+        with open(pcap_path, "rb") as f:
+            certificates = PCAP2CERT().extract_file(
+                f,
+                use_mmap=self.options.get("mmap", True),
+                max_flow_bytes=int(self.options.get("max_flow_bytes", MAX_FLOW_BYTES)),
+            )
+        return sorted({hashlib.sha1(b64decode(encoded)).hexdigest() for encoded in (certificates or {}).values()})
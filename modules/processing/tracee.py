@@ -1,14 +1,38 @@
 import base64
+import gzip
 import json
 import logging
 import os
-import subprocess
 import zlib
+from itertools import islice
 
 from lib.cuckoo.common.abstracts import Processing
 
+try:
+    import orjson
+
+    HAVE_ORJSON = True
+except ImportError:
+    HAVE_ORJSON = False
+
 log = logging.getLogger(__name__)
 
+json_loads = orjson.loads if HAVE_ORJSON else json.loads
+
+
+def json_dumps(obj):
+    if HAVE_ORJSON:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+# Lines logged for tracee's own strace helper, matched on the raw (still escaped) line
+STRACE_MARKER = '\\"processName\\":\\"strace\\"'
+# Number of log lines read and decoded per batch
+BATCH_SIZE = 4096
+# Nesting kept in the exported process tree, deeper chains are listed flat
+MAX_TREE_DEPTH = 64
+
 __author__ = "@theoleecj2"
 __version__ = "1.0.0"
 
@@ -66,33 +90,88 @@ def load_syscalls_args():
 
 
 class ProcTree:
-    def __init__(self, pid, details):
+    """Process tree node.
+
+    All nodes of a tree share one pid -> node index owned by the root, so lookups are
+    O(1) instead of a recursive search of the whole tree.
+    """
+
+    def __init__(self, pid, details, parent=None):
         self.children = {}
         self.pid = pid
         self.details = details
+        self.parent = parent
+        self.index = parent.index if parent else {pid: self}
 
     def add_child(self, pid, details):
-        self.children[pid] = ProcTree(pid, details)
+        existing = self.index.get(pid)
+        if existing is not None and existing is not self:
+            if existing.parent is self:
+                # Another execve in the same process: keep its descendants
+                existing.update_details(details)
+                return existing
+            if (
+                existing.parent is not None
+                and existing.parent.parent is None
+                and existing.details.get("desc") == "PARENT"
+                and not self.has_ancestor(existing)
+            ):
+                # Placeholder created for an unknown parent, now we know where it belongs
+                del existing.parent.children[pid]
+                existing.parent = self
+                existing.update_details(details)
+                self.children[pid] = existing
+                return existing
+            # Otherwise the pid has been reused: the old node stays in the tree, lookups go to the new one
+        child = ProcTree(pid, details, parent=self)
+        self.children[pid] = child
+        self.index[pid] = child
+        return child
 
     def update_details(self, details):
         self.details = details
 
+    def has_ancestor(self, node):
+        parent = self.parent
+        while parent is not None:
+            if parent is node:
+                return True
+            parent = parent.parent
+        return False
+
     def get_child(self, pid):
-        if pid == self.pid:
-            return self
-        else:
-            for child in self.children:
-                result = self.children[child].get_child(pid)
-                if result:
-                    return result
-        return None
-
-    def to_dict(self):
+        return self.index.get(pid)
+
+    def to_dict(self, max_depth=None):
+        """Export the tree without recursion.
+
+        Below max_depth levels, descendants are listed flat under "descendants" with their
+        parent pid, so the exported document stays shallow enough for JSON encoders.
+        """
         output = {"pid": self.pid, "details": dict(self.details), "children": {}}
-        for child in self.children:
-            output["children"][child] = self.children[child].to_dict()
+        stack = [(self, output, 0)]
+        while stack:
+            node, node_dict, depth = stack.pop()
+            if max_depth is not None and depth >= max_depth:
+                if node.children:
+                    node_dict["descendants"] = node.flatten()
+                continue
+            for pid, child in node.children.items():
+                child_dict = {"pid": child.pid, "details": dict(child.details), "children": {}}
+                node_dict["children"][pid] = child_dict
+                stack.append((child, child_dict, depth + 1))
         return output
 
+    def flatten(self):
+        """Return every descendant as {"pid", "ppid", "details"}, in depth-first order."""
+        descendants = []
+        stack = list(reversed(self.children.values()))
+        while stack:
+            node = stack.pop()
+            descendants.append({"pid": node.pid, "ppid": node.parent.pid, "details": dict(node.details)})
+            stack.extend(reversed(node.children.values()))
+        return descendants
+
 
 class TraceeAnalysis(Processing):
     """Tracee Analyzer v1."""
@@ -100,6 +179,24 @@ class TraceeAnalysis(Processing):
     order = 2
     os = "linux"
 
+    def iter_events(self, logpath):
+        """Stream decoded tracee events, dropping strace noise without a second copy of the log."""
+        if not os.path.exists(logpath):
+            log.warning("Tracee log not found: %s", logpath)
+            return
+        with open(logpath, "r") as f:
+            while True:
+                batch = list(islice(f, BATCH_SIZE))
+                if not batch:
+                    break
+                for ln in batch:
+                    if not ln.strip() or STRACE_MARKER in ln:
+                        continue
+                    try:
+                        yield json_loads(json_loads(ln)["log"])
+                    except Exception as e:
+                        log.info("Could not process Tracee line: %s - %s", ln[:256], e)
+
     def run(self):
         """
         Run analysis on tracee logs and files
@@ -114,70 +211,51 @@ class TraceeAnalysis(Processing):
         tree = ProcTree(0, {"desc": "(ABSTRACTION) root process"})
 
         logpath = os.path.join(self.analysis_path, "logs", "tracee.log")
-        subprocess.run(
-            r"""grep -v '\\"processName\\":\\"strace\\"' """ + logpath + " > " + logpath + ".cleaner",
-            shell=True,
-            capture_output=True,
-            text=True,
-        )
-
-        f = open(logpath + ".cleaner", "r")
-        ln = f.readline()
-
-        output = {"metadata": {"security_events": []}, "syscalls": []}  # trace security events and store process tree
-        all_syscalls = output["syscalls"]
+        # Syscalls go to a line-delimited, compressed sidecar instead of the results dict
+        syscalls_path = os.path.join(self.analysis_path, "logs", "tracee_syscalls.jsonl.gz")
+
+        output = {"metadata": {"security_events": []}}  # trace security events and store process tree
         output_metadata = output["metadata"]
         ev_idx = -1
 
-        while ln:
-            ln = f.readline()
-            if len(ln) == 0:
-                continue
-            lg = None
-
-            try:
-                lg = json.loads(json.loads(ln)["log"])
-            except Exception as e:
-                log.info("Could not process Tracee line: %s - %s", str(lg), e)
-                continue
-
-            if lg.get("syscall", None):
-                ev_idx += 1
-                lg["idx"] = ev_idx
-                lg["cat"] = syscall_catalog.get(lg["syscall"], {"category": "misc"})["category"]
-                # outfile.write(json.dumps(lg) + "\n")
-                all_syscalls.append(lg)
-
-                if lg["syscall"] == "execve":
-                    for arg in lg["args"]:
-                        if arg["name"] == "argv":
-                            if not tree.get_child(lg["parentProcessId"]):
-                                tree.add_child(lg["parentProcessId"], {"desc": "PARENT"})
-
-                            arg2 = []
-                            for a in lg["args"]:
-                                if "env" in a["name"]:
-                                    arg2 = a["value"]
-
-                            tree.get_child(lg["parentProcessId"]).add_child(
-                                lg["processId"],
-                                {
-                                    "desc": arg["value"],
-                                    "cmdline": arg["value"],  # "full": lg,
-                                    "env": arg2,
-                                },
-                            )
-            elif lg.get("eventName", None) in sec_events:
-                ev_idx += 1
-                lg["idx"] = ev_idx
-                all_syscalls.append(lg)
-
-            if lg.get("eventName", None) in sec_events:
-                lg["idx"] = ev_idx
-                output_metadata["security_events"].append(lg)
-
-        f.close()
-
-        output_metadata["proctree"] = tree.to_dict()
+        with gzip.open(syscalls_path, "wt", encoding="utf-8") as syscalls_out:
+            for lg in self.iter_events(logpath):
+                if lg.get("syscall", None):
+                    ev_idx += 1
+                    lg["idx"] = ev_idx
+                    lg["cat"] = syscall_catalog.get(lg["syscall"], {"category": "misc"})["category"]
+                    syscalls_out.write(json_dumps(lg) + "\n")
+
+                    if lg["syscall"] == "execve":
+                        for arg in lg["args"]:
+                            if arg["name"] == "argv":
+                                if not tree.get_child(lg["parentProcessId"]):
+                                    tree.add_child(lg["parentProcessId"], {"desc": "PARENT"})
+
+                                arg2 = []
+                                for a in lg["args"]:
+                                    if "env" in a["name"]:
+                                        arg2 = a["value"]
+
+                                tree.get_child(lg["parentProcessId"]).add_child(
+                                    lg["processId"],
+                                    {
+                                        "desc": arg["value"],
+                                        "cmdline": arg["value"],  # "full": lg,
+                                        "env": arg2,
+                                    },
+                                )
+                elif lg.get("eventName", None) in sec_events:
+                    ev_idx += 1
+                    lg["idx"] = ev_idx
+                    syscalls_out.write(json_dumps(lg) + "\n")
+
+                if lg.get("eventName", None) in sec_events:
+                    lg["idx"] = ev_idx
+                    output_metadata["security_events"].append(lg)
+
+        output_metadata["syscalls_count"] = ev_idx + 1
+        output_metadata["syscalls_path"] = os.path.relpath(syscalls_path, self.analysis_path)
+        output_metadata["proctree"] = tree.to_dict(max_depth=MAX_TREE_DEPTH)
 
         return str(base64.b64encode(zlib.compress(bytearray(json.dumps(output), "utf-8"))), "ascii")
@@ -4,20 +4,51 @@
 
 import logging
 import os
+import time
 
 from lib.cuckoo.common.abstracts import Report
-from lib.cuckoo.common.exceptions import CuckooDependencyError
+from lib.cuckoo.common.exceptions import CuckooDependencyError, CuckooReportError
 from lib.cuckoo.common.objects import File
 
 try:
-    from elasticsearch import Elasticsearch
+    from elasticsearch import Elasticsearch, helpers
 
     HAVE_ELASTICSEARCH = True
 except ImportError:
     HAVE_ELASTICSEARCH = False
 
+log = logging.getLogger(__name__)
 logging.getLogger("elasticsearch").setLevel(logging.WARNING)
 
+# Calls per chunk document, the Django view paginates on this
+CALLS_PER_CHUNK = 100
+# Documents and bytes per bulk request
+BULK_DOCS = 500
+BULK_BYTES = 10 * 1024 * 1024
+
+# Clients are kept per worker process so consecutive reports reuse the connection pool
+_clients = {}
+
+
+def chunk_ids(task_id, pid, calls, chunk_size=CALLS_PER_CHUNK):
+    """Client-side ids of the call chunks of a process, known before anything is indexed."""
+    count = (len(calls) + chunk_size - 1) // chunk_size
+    return [f"{task_id}-{pid}-{number}" for number in range(count)]
+
+
+def iter_call_chunks(index_name, task_id, processes, chunk_size=CALLS_PER_CHUNK):
+    """Lazily yield one bulk index action per chunk of calls, without copying the call lists."""
+    for process in processes:
+        pid = process["process_id"]
+        calls = process["calls"]
+        for number, start in enumerate(range(0, len(calls), chunk_size)):
+            yield {
+                "_index": index_name,
+                "_type": "calls",
+                "_id": f"{task_id}-{pid}-{number}",
+                "_source": {"pid": pid, "calls": calls[start : start + chunk_size]},
+            }
+
 
 class ElasticsearchDB(Report):
     """Stores report in Elastic Search."""
@@ -28,15 +59,40 @@ class ElasticsearchDB(Report):
         """Connects to Elasticsearch database, loads options and set connectors.
         @raise CuckooReportError: if unable to connect.
         """
-        self.es = Elasticsearch(
-            hosts=[
-                {
-                    "host": self.options.get("host", "127.0.0.1"),
-                    "port": self.options.get("port", 9200),
-                }
-            ],
-            timeout=60,
-        )
+        host = self.options.get("host", "127.0.0.1")
+        port = self.options.get("port", 9200)
+        self.es = _clients.get((host, port))
+        if self.es is None:
+            self.es = Elasticsearch(hosts=[{"host": host, "port": port}], timeout=60)
+            _clients[(host, port)] = self.es
+
+    def bulk_index(self, actions):
+        """Streams bulk actions to Elasticsearch.
+        @param actions: iterable of bulk actions.
+        @return: number of indexed documents.
+        @raise CuckooReportError: if any document was rejected.
+        """
+        options = {
+            "chunk_size": int(self.options.get("bulk_docs", BULK_DOCS)),
+            "max_chunk_bytes": int(self.options.get("bulk_bytes", BULK_BYTES)),
+            "raise_on_error": False,
+        }
+        threads = int(self.options.get("bulk_threads", 1))
+        if threads > 1:
+            responses = helpers.parallel_bulk(self.es, actions, thread_count=threads, **options)
+        else:
+            responses = helpers.streaming_bulk(self.es, actions, **options)
+
+        indexed = 0
+        errors = []
+        for ok, item in responses:
+            if ok:
+                indexed += 1
+            else:
+                errors.append(item)
+        if errors:
+            raise CuckooReportError(f"Elasticsearch rejected {len(errors)} documents, first error: {errors[0]}")
+        return indexed
 
     def run(self, results: dict):
         """Writes report.
@@ -51,6 +107,11 @@ class ElasticsearchDB(Report):
         self.connect()
         index_prefix = self.options.get("index", "cuckoo")
         search_only = self.options.get("searchonly", False)
+        chunk_size = int(self.options.get("chunk_size", CALLS_PER_CHUNK))
+        task_id = results["info"]["id"]
+        started = time.perf_counter()
+        calls_count = 0
+        actions = []
 
         # Create a copy of the dictionary. This is done in order to not modify
         # the original dictionary and possibly compromise the following
@@ -64,38 +125,19 @@ class ElasticsearchDB(Report):
             if "network" not in report:
                 report["network"] = {}
 
-            # Store API calls in chunks for pagination in Django
+            # Store API calls in chunks for pagination in Django. Chunk ids are
+            # assigned here, so the process entries reference them before the
+            # chunks themselves are streamed to Elasticsearch.
             if "processes" in report.get("behavior", {}):
+                processes = report["behavior"]["processes"]
                 new_processes = []
-                for process in report["behavior"]["processes"]:
-                    new_process = dict(process)
-                    chunk = []
-                    chunks_ids = []
-                    # Loop on each process call.
-                    for call in process["calls"]:
-                        # If the chunk size is 100 or if the loop is completed then
-                        # store the chunk in Elastcisearch.
-                        if len(chunk) == 100:
-                            to_insert = {"pid": process["process_id"], "calls": chunk}
-                            pchunk = self.es.index(index=self.index_name, doc_type="calls", body=to_insert)
-                            chunk_id = pchunk["_id"]
-                            chunks_ids.append(chunk_id)
-                            # Reset the chunk.
-                            chunk = []
-
-                        # Append call to the chunk.
-                        chunk.append(call)
-
-                    # Store leftovers.
-                    if chunk:
-                        to_insert = {"pid": process["process_id"], "calls": chunk}
-                        pchunk = self.es.index(index=self.index_name, doc_type="calls", body=to_insert)
-                        chunk_id = pchunk["_id"]
-                        chunks_ids.append(chunk_id)
-
-                    # Add list of chunks.
-                    new_process["calls"] = chunks_ids
+                for process in processes:
+                    new_process = {key: value for key, value in process.items() if key != "calls"}
+                    new_process["calls"] = chunk_ids(task_id, process["process_id"], process["calls"], chunk_size)
                     new_processes.append(new_process)
+                    calls_count += len(process["calls"])
+
+                actions = iter_call_chunks(self.index_name, task_id, processes, chunk_size)
 
                 # Store the results in the report.
                 report["behavior"] = dict(report["behavior"])
@@ -137,5 +179,17 @@ class ElasticsearchDB(Report):
                 "virustotal_summary": f'{results["virustotal"]["positives"]}/{results["virustotal"]["total"]}',
             }
 
-        # Store the report and retrieve its object id.
-        self.es.index(index=self.index_name, doc_type="analysis", id=results["info"]["id"], body=report)
+        # Store the call chunks, then the report itself.
+        indexed = self.bulk_index(actions) if actions else 0
+        self.es.index(index=self.index_name, doc_type="analysis", id=task_id, body=report)
+
+        elapsed = time.perf_counter() - started
+        log.info(
+            "Task %s: indexed %d call chunks (%d calls) and the report into %s in %.2fs (%.0f docs/s)",
+            task_id,
+            indexed,
+            calls_count,
+            self.index_name,
+            elapsed,
+            (indexed + 1) / elapsed if elapsed else 0,
+        )
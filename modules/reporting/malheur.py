@@ -3,51 +3,67 @@
 # See the file 'docs/LICENSE' for copying permission.
 
 import contextlib
+import fcntl
 import hashlib
+import logging
 import os
 import random
+import shutil
 import subprocess
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
+from functools import lru_cache
 
 from lib.cuckoo.common.abstracts import Report
 from lib.cuckoo.common.constants import CUCKOO_ROOT
 from lib.cuckoo.common.exceptions import CuckooReportError
 
+log = logging.getLogger(__name__)
+
+# Full re-cluster of every stored report, incremental runs in between
+FULL_CLUSTER_INTERVAL = 24 * 60 * 60
+EMPTY_VECTOR_WARNING = "Warning: Discarding empty feature vector"
+
+
+# Distinct tokens kept per worker, path components and API names repeat across most reports
+TOKEN_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def token_hash(token: str) -> str:
+    """Short feature hash of a MIST token, computed once per distinct token"""
+    return hashlib.blake2b(token.encode("utf8", "surrogatepass"), digest_size=4).hexdigest()
+
 
 def sanitize_file(filename: str) -> str:
     normals = filename.lower().replace("\\", " ").replace(".", " ").split(" ")
-    hashed_components = [hashlib.md5(normal).hexdigest()[:8] for normal in normals[-3:]]
-    return " ".join(hashed_components)
+    return " ".join(token_hash(normal) for normal in normals[-3:])
 
 
 def sanitize_reg(keyname: str) -> str:
     normals = keyname.lower().replace("\\", " ").split(" ")
-    hashed_components = [hashlib.md5(normal).hexdigest()[:8] for normal in normals[-2:]]
-    return " ".join(hashed_components)
+    return " ".join(token_hash(normal) for normal in normals[-2:])
 
 
 def sanitize_cmd(cmd: str) -> str:
     normals = cmd.lower().replace('"', "").replace("\\", " ").replace(".", " ").split(" ")
-    hashed_components = [hashlib.md5(normal).hexdigest()[:8] for normal in normals]
-    return " ".join(hashed_components)
+    return " ".join(token_hash(normal) for normal in normals)
 
 
 def sanitize_generic(value: str) -> str:
-    return hashlib.md5(value.lower()).hexdigest()[:8]
+    return token_hash(value.lower())
 
 
 def sanitize_domain(domain: str) -> str:
-    components = domain.lower().split(".")
-    hashed_components = [hashlib.md5(comp).hexdigest()[:8] for comp in components]
-    return " ".join(hashed_components)
+    return " ".join(token_hash(comp) for comp in domain.lower().split("."))
 
 
 def sanitize_ip(ipaddr: str) -> str:
     components = ipaddr.split(".")
     class_c = components[:3]
-    return f"{hashlib.md5('.'.join(class_c)).hexdigest()[:8]} {hashlib.md5(ipaddr).hexdigest()[:8]}"
+    return f"{token_hash('.'.join(class_c))} {token_hash(ipaddr)}"
 
 
 def sanitize_url(url: str) -> str:
@@ -55,7 +71,37 @@ def sanitize_url(url: str) -> str:
     uri = url.partition(":")[-1] if ":" in url else url
     uri = uri.strip("/")
     quoted = urllib.parse.quote(uri.encode("utf8")).lower()
-    return hashlib.md5(quoted).hexdigest()[:8]
+    return token_hash(quoted)
+
+
+# Behavior summary list -> MIST feature prefix and sanitizer, in output order
+SUMMARY_FEATURES = (
+    ("files", "file access|", sanitize_file),
+    ("write_files", "file write|", sanitize_file),
+    ("delete_files", "file delete|", sanitize_file),
+    ("read_files", "file read|", sanitize_file),
+    ("keys", "reg access|", sanitize_reg),
+    ("read_keys", "reg read|", sanitize_reg),
+    ("write_keys", "reg write|", sanitize_reg),
+    ("delete_keys", "reg delete|", sanitize_reg),
+    ("executed_commands", "cmd exec|", sanitize_cmd),
+    ("resolved_apis", "api resolv|", sanitize_generic),
+    ("mutexes", "mutex access|", sanitize_generic),
+    ("created_services", "service create|", sanitize_generic),
+    ("started_services", "service start|", sanitize_generic),
+)
+
+
+def summary_mist_lines(summary: dict) -> list:
+    """Converts all behavior summary lists to MIST lines in one pass"""
+    lists = [(prefix, sanitize, summary[key]) for key, prefix, sanitize in SUMMARY_FEATURES]
+    lines = [None] * sum(len(entries) for _, _, entries in lists)
+    position = 0
+    for prefix, sanitize, entries in lists:
+        for entry in entries:
+            lines[position] = prefix + sanitize(entry)
+            position += 1
+    return lines
 
 
 def mist_convert(results: dict) -> str:
@@ -75,26 +121,14 @@ def mist_convert(results: dict) -> str:
         lines.extend(
             (
                 "# URL",
-                f"# MD5: {hashlib.md5(results['target']['url']).hexdigest()}",
-                f"# SHA1: {hashlib.sha1(results['target']['url']).hexdigest()}",
-                f"# SHA256: {hashlib.sha256(results['target']['url']).hexdigest()}",
+                f"# MD5: {hashlib.md5(results['target']['url'].encode()).hexdigest()}",
+                f"# SHA1: {hashlib.sha1(results['target']['url'].encode()).hexdigest()}",
+                f"# SHA256: {hashlib.sha256(results['target']['url'].encode()).hexdigest()}",
             )
         )
 
     if "summary" in results.get("behavior", {}):
-        lines.extend(f"file access|{sanitize_file(entry)}" for entry in results["behavior"]["summary"]["files"])
-        lines.extend(f"file write|{sanitize_file(entry)}" for entry in results["behavior"]["summary"]["write_files"])
-        lines.extend(f"file delete|{sanitize_file(entry)}" for entry in results["behavior"]["summary"]["delete_files"])
-        lines.extend(f"file read|{sanitize_file(entry)}" for entry in results["behavior"]["summary"]["read_files"])
-        lines.extend(f"reg access|{sanitize_reg(entry)}" for entry in results["behavior"]["summary"]["keys"])
-        lines.extend(f"reg read|{sanitize_reg(entry)}" for entry in results["behavior"]["summary"]["read_keys"])
-        lines.extend(f"reg write|{sanitize_reg(entry)}" for entry in results["behavior"]["summary"]["write_keys"])
-        lines.extend(f"reg delete|{sanitize_reg(entry)}" for entry in results["behavior"]["summary"]["delete_keys"])
-        lines.extend(f"cmd exec|{sanitize_cmd(entry)}" for entry in results["behavior"]["summary"]["executed_commands"])
-        lines.extend(f"api resolv|{sanitize_generic(entry)}" for entry in results["behavior"]["summary"]["resolved_apis"])
-        lines.extend(f"mutex access|{sanitize_generic(entry)}" for entry in results["behavior"]["summary"]["mutexes"])
-        lines.extend(f"service create|{sanitize_generic(entry)}" for entry in results["behavior"]["summary"]["created_services"])
-        lines.extend(f"service start|{sanitize_generic(entry)}" for entry in results["behavior"]["summary"]["started_services"])
+        lines.extend(summary_mist_lines(results["behavior"]["summary"]))
 
     if "signatures" in results:
         for entry in results["signatures"]:
@@ -143,9 +177,127 @@ def mist_convert(results: dict) -> str:
     return "\n".join(lines) + "\n"
 
 
+def write_atomic(path: str, data: str):
+    """Writes data to a temp file outside the queue folders and renames it to path,
+    so a concurrent malheur run never picks up a partial report"""
+    tmp_path = os.path.join(os.path.dirname(os.path.dirname(path)), f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as outfile:
+        outfile.write(data)
+    os.replace(tmp_path, path)
+
+
+def discard_empty_vectors(err: str, reportsdir: str):
+    """Removes reports malheur reported as empty feature vectors"""
+    for line in err.splitlines():
+        if line.startswith(EMPTY_VECTOR_WARNING):
+            badfile = line.split("'", 2)[1].split("'", 1)[0]
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(reportsdir, os.path.basename(badfile)))
+
+
 class Malheur(Report):
     """Performs classification on the generated MIST reports"""
 
+    def run_malheur(self, action: str, dataset: str, outputfile: str, home: str = None):
+        cmdline = ("malheur", "-c", self.cfgpath, "-o", outputfile, action, dataset)
+        # Prototypes and rejected reports persist in $HOME/.malheur between incremental runs
+        env = dict(os.environ, HOME=home or self.basedir)
+        run = subprocess.run(cmdline, stdin=subprocess.DEVNULL, capture_output=True, text=True, env=env)
+        discard_empty_vectors(run.stderr, dataset)
+        discard_empty_vectors(run.stderr, self.reportsdir)
+        if run.returncode:
+            log.warning("malheur %s exited with %d: %s", action, run.returncode, run.stderr.strip())
+        return run.returncode
+
+    def rebuild_state(self):
+        """Replaces the incremental state with one seeded from every stored report, so later
+        increments classify against the prototypes of the full cluster, not the old ones"""
+        statedir = os.path.join(self.basedir, ".malheur")
+        seeddir = os.path.join(self.basedir, "seed")
+        shutil.rmtree(seeddir, ignore_errors=True)
+        os.makedirs(os.path.join(seeddir, ".malheur"))
+        try:
+            seeded = self.run_malheur("increment", self.reportsdir, os.path.join(seeddir, "malheur.txt"), home=seeddir) == 0
+            shutil.rmtree(statedir, ignore_errors=True)
+            if seeded:
+                os.rename(os.path.join(seeddir, ".malheur"), statedir)
+            else:
+                # no state at all beats prototypes from before the full cluster
+                log.warning("Can't rebuild the Malheur incremental state, starting from an empty one")
+        finally:
+            shutil.rmtree(seeddir, ignore_errors=True)
+
+    def full_cluster(self):
+        """Re-clusters every stored report and replaces the classification state"""
+        # Reports queued while malheur runs aren't part of this run, leave them for the next increment
+        clustered = os.listdir(self.pendingdir)
+        outputfile = os.path.join(self.basedir, f"malheur.txt.{hashlib.md5(str(random.random()).encode()).hexdigest()}")
+        returncode = self.run_malheur("cluster", self.reportsdir, outputfile)
+        if returncode or not os.path.exists(outputfile):
+            with contextlib.suppress(OSError):
+                os.remove(outputfile)
+            # keep malheur.txt, the state and the queue as they are, the next run tries again
+            raise RuntimeError(f"malheur cluster exited with {returncode}")
+        # replace previous classification state with new results atomically
+        os.rename(outputfile, outputfile[:-33])
+        self.rebuild_state()
+        with open(self.stampfile, "w") as f:
+            f.write(str(time.time()))
+        for name in clustered:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.pendingdir, name))
+
+    def increment(self):
+        """Classifies pending reports against the stored prototypes and clusters the rejected ones"""
+        shutil.rmtree(self.batchdir, ignore_errors=True)
+        os.makedirs(self.batchdir)
+        for name in os.listdir(self.pendingdir):
+            os.rename(os.path.join(self.pendingdir, name), os.path.join(self.batchdir, name))
+        if not os.listdir(self.batchdir):
+            os.rmdir(self.batchdir)
+            return False
+
+        outputfile = os.path.join(self.basedir, "malheur.increment.txt")
+        self.run_malheur("increment", self.batchdir, outputfile)
+        if os.path.exists(outputfile):
+            with open(outputfile) as src, open(os.path.join(self.basedir, "malheur.txt"), "a") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(outputfile)
+        shutil.rmtree(self.batchdir, ignore_errors=True)
+        return True
+
+    def full_cluster_due(self) -> bool:
+        interval = int(self.options.get("full_interval", FULL_CLUSTER_INTERVAL))
+        try:
+            with open(self.stampfile) as f:
+                return time.time() - float(f.read().strip() or 0) >= interval
+        except (OSError, ValueError):
+            return True
+
+    def process_queue(self) -> bool:
+        """Single-flight runner: only the reporter holding the lock runs malheur, others just queue their report.
+        @return: False if another reporter is already running malheur.
+        """
+        while True:
+            with open(self.lockfile, "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+                try:
+                    if self.options.get("mode", "incremental") != "incremental" or self.full_cluster_due():
+                        self.full_cluster()
+                    else:
+                        # Drain reports queued by other reporters while we were running
+                        while self.increment():
+                            pass
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+            # A report queued after the last drain but before the unlock was skipped by its
+            # reporter, which found the lock taken: run again rather than leave it stranded
+            if not os.listdir(self.pendingdir):
+                return True
+
     def run(self, results: dict):
         """Runs Malheur processing
         @return: Nothing.  Results of this processing are obtained at an arbitrary future time.
@@ -153,32 +305,24 @@ class Malheur(Report):
         if results["target"]["category"] in ["pcap"]:
             return
 
-        basedir = os.path.join(CUCKOO_ROOT, "storage", "malheur")
-        cfgpath = os.path.join(CUCKOO_ROOT, "conf", "malheur.conf")
-        reportsdir = os.path.join(basedir, "reports")
+        self.basedir = os.path.join(CUCKOO_ROOT, "storage", "malheur")
+        self.cfgpath = os.path.join(CUCKOO_ROOT, "conf", "malheur.conf")
+        self.reportsdir = os.path.join(self.basedir, "reports")
+        self.pendingdir = os.path.join(self.basedir, "pending")
+        self.batchdir = os.path.join(self.basedir, "batch")
+        self.lockfile = os.path.join(self.basedir, "malheur.lock")
+        self.stampfile = os.path.join(self.basedir, "last_full_cluster")
         task_id = str(results["info"]["id"])
-        outputfile = os.path.join(basedir, f"malheur.txt.{hashlib.md5(str(random.random()).encode()).hexdigest()}")
-        with contextlib.suppress(Exception):
-            os.makedirs(reportsdir)
+        for path in (self.reportsdir, self.pendingdir):
+            with contextlib.suppress(Exception):
+                os.makedirs(path)
         mist = mist_convert(results)
         if mist:
-            with open(os.path.join(reportsdir, f"{task_id}.txt"), "w") as outfile:
-                outfile.write(mist)
-
-        # might need to prevent concurrent modifications to internal state of malheur by only allowing
-        # one analysis to be running malheur at a time
+            write_atomic(os.path.join(self.reportsdir, f"{task_id}.txt"), mist)
+            write_atomic(os.path.join(self.pendingdir, f"{task_id}.txt"), mist)
 
         try:
-            cmdline = ("malheur", "-c", cfgpath, "-o", outputfile, "cluster", reportsdir)
-            run = subprocess.Popen(cmdline, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = run.communicate()
-            for line in err.splitlines():
-                if line.startswith("Warning: Discarding empty feature vector"):
-                    badfile = line.split("'", 2)[1].split("'", 1)[0]
-                    os.remove(os.path.join(reportsdir, badfile))
-
-            # replace previous classification state with new results atomically
-            os.rename(outputfile, outputfile[:-33])
-
+            if not self.process_queue():
+                log.debug("Malheur is already running, task %s queued for the next run", task_id)
         except Exception as e:
             raise CuckooReportError(f"Failed to perform Malheur classification: {e}") from e
@@ -9,8 +9,10 @@
 import json
 import logging
 import os
+import threading
+import time
 from collections import deque
-from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 
@@ -33,7 +35,7 @@ try:
     HAVE_PYMISP = True
     pymisp_logger.setLevel(logging.ERROR)
 except ImportError:
-    HAVE_PYMISP = True
+    HAVE_PYMISP = False
     print("poetry run pip3 install pymisp=2.4.144")
 
 log = logging.getLogger(__name__)
@@ -43,6 +45,19 @@ ttps_json = {}
 mitre_json_path = os.path.join(CUCKOO_ROOT, "data", "mitre_attack.json")
 if os.path.exists(mitre_json_path):
     ttps_json = json.load(open(mitre_json_path))
+
+
+def build_ttp_index(attack_json):
+    """Map ATT&CK external ids (T1055, T1055.012, ...) to technique names"""
+    index = {}
+    for obj in attack_json.get("objects", []) or []:
+        references = obj.get("external_references") or []
+        if references and references[0].get("external_id") and "name" in obj:
+            index.setdefault(references[0]["external_id"], obj["name"])
+    return index
+
+
+ttp_names = build_ttp_index(ttps_json)
 malpedia_json_path = os.path.join(CUCKOO_ROOT, "data", "malpedia.json")
 if os.path.exists(malpedia_json_path):
     malpedia_json = json.load(open(os.path.join(CUCKOO_ROOT, "data", "malpedia.json")))
@@ -83,6 +98,57 @@ name_update_shema = {
 }
 
 
+class RateLimitedExecutor:
+    """Bounded thread pool for MISP API calls, with a minimum interval between calls and retries of the reads."""
+
+    def __init__(self, threads=5, rate=5.0, retries=3, backoff=2.0):
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="misp")
+        self.interval = 1.0 / rate if rate else 0
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def _wait_slot(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _call(self, func, retry, *args, **kwargs):
+        attempts = self.retries if retry else 1
+        for attempt in range(attempts):
+            self._wait_slot()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt == attempts - 1:
+                    raise
+                log.warning("MISP call %s failed (%s), retrying", getattr(func, "__name__", func), e)
+                time.sleep(self.backoff * (attempt + 1))
+
+    def submit(self, func, *args, retry=False, **kwargs):
+        """Run func in the pool. Only pass retry=True for idempotent calls (search, get_event):
+        a write that timed out may still have been applied, retrying it would duplicate it."""
+        return self.pool.submit(self._call, func, retry, *args, **kwargs)
+
+    def call(self, func, *args, retry=False, **kwargs):
+        return self.submit(func, *args, retry=retry, **kwargs).result()
+
+
+_executors = {}
+
+
+def get_executor(threads, rate):
+    """One executor per worker process, so reports share the pool and the rate limit"""
+    key = (threads, rate)
+    if key not in _executors:
+        _executors[key] = RateLimitedExecutor(threads, rate)
+    return _executors[key]
+
+
 class MISP(Report):
     """MISP Analyzer."""
 
@@ -92,14 +158,12 @@ class MISP(Report):
         if malfamily in name_update_shema:
             malfamily = name_update_shema[malfamily]
         if malfamily in malpedia_json:
-            self.misp.tag(event["uuid"], f'misp-galaxy:malpedia="{malfamily}"')
+            event.add_tag(f'misp-galaxy:malpedia="{malfamily}"')
 
     def signature(self, results, event):
         for ttp in results.get("ttps", []) or []:
-            for i in ttps_json.get("objects", []) or []:
-                with suppress(Exception):
-                    if i["external_references"][0]["external_id"] == ttp:
-                        self.misp.tag(event, f'misp-galaxy:mitre-attack-pattern="{i["name"]}-{ttp}"')
+            if ttp in ttp_names:
+                event.add_tag(f'misp-galaxy:mitre-attack-pattern="{ttp_names[ttp]}-{ttp}"')
 
     def sample_hashes(self, results, event):
         if results.get("target", {}).get("file", {}):
@@ -111,7 +175,7 @@ class MISP(Report):
             misp_object.add_attribute("sha1", value=f["sha1"], category="Payload delivery")
             misp_object.add_attribute("sha256", value=f["sha256"], category="Payload delivery")
             misp_object.add_attribute("ssdeep", value=f["ssdeep"], category="Payload delivery")
-            self.misp.add_object(event, misp_object)
+            event.add_object(misp_object)
 
     def all_network(self, results, event):
         """All of the accessed URLS as per the PCAP."""
@@ -139,7 +203,7 @@ class MISP(Report):
                     if block["request"] not in domains and block["request"] not in whitelist:
                         if block["answers"]:
                             domains[block["request"]] = block["answers"][0]["data"]
-                            ips.add(domain[block["answers"][0]["data"]])
+                            ips.add(block["answers"][0]["data"])
 
             # Added CAPE Addresses
             for section in results.get("CAPE", []) or []:
@@ -155,13 +219,11 @@ class MISP(Report):
                 event.add_attribute("url", url)
             for ip in sorted(list(ips)):
                 event.add_attribute("ip-dst", ip)
-            for domain, ips in domains.items():
+            for domain, ip in domains.items():
                 obj = MISPObject("domain-ip")
                 obj.add_attribute("domain", domain)
-                for ip in ips:
-                    obj.add_attribute("ip", ip)
+                obj.add_attribute("ip", ip)
                 event.add_object(obj)
-            self.misp.update_event(event)
 
     def dropped_files(self, results, event):
         """
@@ -181,8 +243,6 @@ class MISP(Report):
             data = Path(r.get("path")).read_bytes()
             with BytesIO(data) as f:
                 event.add_attribute("malware-sample", value=os.path.basename(r.get("path")), data=f, expand="binary")
-        event.run_expansions()
-        self.misp.update_event(event)
         """
         # Load the event from MISP (we cannot use event as it
         # does not contain the sample uploaded above, nor it is
@@ -233,6 +293,7 @@ class MISP(Report):
         self.threads = self.options.get("threads", "")
         if not self.threads:
             self.threads = 5
+        executor = get_executor(int(self.threads), float(self.options.get("rate", 5)))
 
         self.iocs = deque()
         self.misper = {}
@@ -250,22 +311,25 @@ class MISP(Report):
                 if results.get("detections"):
                     malfamily = ",".join(block["family"] for block in results["detections"])
 
-                response = self.misp.search(
-                    "attributes", value=results["target"]["file"]["sha256"], return_format="json", pythonify=True
+                # Look for an existing event while this one is assembled locally
+                existing = executor.submit(
+                    self.misp.search,
+                    "attributes",
+                    value=results["target"]["file"]["sha256"],
+                    return_format="json",
+                    pythonify=True,
+                    retry=True,
                 )
-                if response:
-                    event = self.misp.get_event(response[0].event_id, pythonify=True)
-                else:
-                    event = MISPEvent()
-                    event.distribution = distribution
-                    event.threat_level_id = threat_level_id
-                    event.analysis = analysis
-                    event.info = f"{info} {malfamily} - {results.get('info', {}).get('id')}"
-                    event = self.misp.add_event(event, pythonify=True)
+
+                event = MISPEvent()
+                event.distribution = distribution
+                event.threat_level_id = threat_level_id
+                event.analysis = analysis
+                event.info = f"{info} {malfamily} - {results.get('info', {}).get('id')}"
 
                 # Add a specific tag to flag Cuckoo's event
                 if tag:
-                    self.misp.tag(event, tag)
+                    event.add_tag(tag)
 
                 # malpedia galaxy
                 if malpedia_json:
@@ -282,11 +346,11 @@ class MISP(Report):
                     f = target.get("file", {})
                     if target.get("category") == "file" and f:
                         data = Path(f["path"]).read_bytes()
-                        with BytesIO(data) as f:
+                        with BytesIO(data) as sample:
                             event.add_attribute(
                                 "malware-sample",
                                 value=os.path.basename(f["path"]),
-                                data=f,
+                                data=sample,
                                 expand="binary",
                                 comment="Sample run",
                             )
@@ -314,11 +378,23 @@ class MISP(Report):
                             event.add_attribute("regkey", regkey)
 
                 event.run_expansions()
-                self.misp.update_event(event)
+
+                # Push everything in one request, merged into the existing event if there is one
+                response = existing.result()
+                if response:
+                    stored = executor.call(self.misp.get_event, response[0].event_id, pythonify=True, retry=True)
+                    for event_tag in event.tags:
+                        stored.add_tag(event_tag)
+                    stored.attributes.extend(event.attributes)
+                    for misp_object in event.objects:
+                        stored.add_object(misp_object)
+                    event = executor.call(self.misp.update_event, stored, pythonify=True)
+                else:
+                    event = executor.call(self.misp.add_event, event, pythonify=True)
 
                 # Make event public
                 if self.options.get("published", True):
-                    self.misp.publish(event)
+                    executor.call(self.misp.publish, event)
 
         except Exception as e:
             log.error("Failed to generate JSON report: %s", e, exc_info=True)
@@ -1,14 +1,17 @@
 import hashlib
 import logging
+import mmap
+import multiprocessing
 import os
 import socket
 import struct
-from base64 import b64encode
+from base64 import b64decode, b64encode
 from io import BufferedReader
-from typing import Dict
+from typing import Dict, Iterator, Tuple
 
 import dpkt
 from lib.cuckoo.common.abstracts import Report
+from lib.cuckoo.common.cert_store import CERT_STORE_PATH, CertStore
 from lib.cuckoo.common.constants import CUCKOO_ROOT
 
 try:
@@ -21,6 +24,260 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
+PCAP_HEADER = struct.Struct("<IHHiIII")
+PCAP_MAGICS = {0xA1B2C3D4: "<", 0xA1B23C4D: "<", 0xD4C3B2A1: ">", 0x4D3CB2A1: ">"}
+LINKTYPE_ETHERNET = 1
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+ETHERTYPE_PPPOE = 0x8864
+PPP_IPV4 = 0x0021
+
+TLS_HANDSHAKE = 0x16
+HANDSHAKE_CERTIFICATE = 0x0B
+HANDSHAKE_SERVER_HELLO_DONE = 0x0E
+# Certificates are exchanged at the start of a session, later bytes of a flow are never needed
+MAX_FLOW_BYTES = 256 * 1024
+SEQ_MASK = 0xFFFFFFFF
+
+
+def iter_pcap_buffer(buf) -> Iterator[Tuple[int, memoryview]]:
+    """Yield (linktype, frame) from a pcap held in memory or mmap, frames are slices of buf"""
+    view = memoryview(buf)
+    magic = struct.unpack_from("<I", view, 0)[0] if len(view) >= PCAP_HEADER.size else None
+    if magic not in PCAP_MAGICS:
+        raise ValueError("not a pcap file")
+    endian = PCAP_MAGICS[magic]
+    linktype = struct.unpack_from(endian + "I", view, 20)[0]
+    record = struct.Struct(endian + "IIII")
+    offset = PCAP_HEADER.size
+    end = len(view)
+    while offset + record.size <= end:
+        incl_len = record.unpack_from(view, offset)[2]
+        offset += record.size
+        if offset + incl_len > end:
+            break
+        yield linktype, view[offset : offset + incl_len]
+        offset += incl_len
+
+
+def iter_pcap_file(f: BufferedReader) -> Iterator[Tuple[int, memoryview]]:
+    """Yield (linktype, frame) reading one record at a time from a file object"""
+    header = f.read(PCAP_HEADER.size)
+    magic = struct.unpack_from("<I", header, 0)[0] if len(header) == PCAP_HEADER.size else None
+    if magic not in PCAP_MAGICS:
+        raise ValueError("not a pcap file")
+    endian = PCAP_MAGICS[magic]
+    linktype = struct.unpack_from(endian + "I", header, 20)[0]
+    record = struct.Struct(endian + "IIII")
+    while True:
+        header = f.read(record.size)
+        if len(header) < record.size:
+            break
+        incl_len = record.unpack(header)[2]
+        frame = f.read(incl_len)
+        if len(frame) < incl_len:
+            break
+        yield linktype, memoryview(frame)
+
+
+def ethernet_ipv4(frame: memoryview):
+    """Return the IPv4 packet of an Ethernet frame (VLAN and PPPoE aware), or None"""
+    offset = 12
+    if len(frame) < offset + 2:
+        return None
+    ethertype = int.from_bytes(frame[offset : offset + 2], "big")
+    while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 6:
+        offset += 4
+        ethertype = int.from_bytes(frame[offset : offset + 2], "big")
+    offset += 2
+    if ethertype == ETHERTYPE_PPPOE and len(frame) >= offset + 8:
+        if int.from_bytes(frame[offset + 6 : offset + 8], "big") != PPP_IPV4:
+            return None
+        ethertype = ETHERTYPE_IPV4
+        offset += 8
+    if ethertype != ETHERTYPE_IPV4:
+        return None
+    return frame[offset:]
+
+
+def dpkt_ipv4(frame: memoryview):
+    """Slow path for other link types: let dpkt find the IP layer"""
+    try:
+        upperdata = dpkt.ethernet.Ethernet(bytes(frame)).data
+        # iteratively find IP layer, as some connections have pppoe and ppp layers
+        while not isinstance(upperdata, (dpkt.ip.IP, bytes, str)):
+            upperdata = upperdata.data
+    except Exception:
+        return None
+    if not isinstance(upperdata, dpkt.ip.IP):
+        return None
+    return memoryview(bytes(upperdata))
+
+
+def tcp_segment(ip: memoryview):
+    """Return (src, dst, sport, dport, seq, payload) of an unfragmented IPv4/TCP packet, or None"""
+    if len(ip) < 20 or ip[0] >> 4 != 4 or ip[9] != socket.IPPROTO_TCP:
+        return None
+    # skip non-first fragments
+    if int.from_bytes(ip[6:8], "big") & 0x1FFF:
+        return None
+    ihl = (ip[0] & 0x0F) * 4
+    total_len = min(int.from_bytes(ip[2:4], "big"), len(ip))
+    tcp = ip[ihl:total_len]
+    if len(tcp) < 20:
+        return None
+    doff = (tcp[12] >> 4) * 4
+    payload = tcp[doff:]
+    if not payload:
+        return None
+    sport, dport, seq = struct.unpack_from("!HHI", tcp, 0)
+    return bytes(ip[12:16]), bytes(ip[16:20]), sport, dport, seq, payload
+
+
+class TLSStream:
+    """Reassembles one TCP direction just far enough to read its TLS Certificate message."""
+
+    __slots__ = ("next_seq", "records", "handshake", "pending", "received", "max_bytes", "done")
+
+    def __init__(self, max_bytes=MAX_FLOW_BYTES):
+        self.next_seq = None
+        self.records = bytearray()
+        self.handshake = bytearray()
+        self.pending = {}
+        self.received = 0
+        self.max_bytes = max_bytes
+        self.done = False
+
+    def finish(self):
+        self.done = True
+        self.records = self.handshake = None
+        self.pending = {}
+
+    def append(self, payload):
+        self.records += payload
+        self.next_seq = (self.next_seq + len(payload)) & SEQ_MASK
+        while self.next_seq in self.pending:
+            segment = self.pending.pop(self.next_seq)
+            self.records += segment
+            self.next_seq = (self.next_seq + len(segment)) & SEQ_MASK
+
+    def feed(self, seq: int, payload: memoryview):
+        """Add a segment, returns the DER certificates of a Certificate message once it completed"""
+        if self.next_seq is None:
+            # Only flows opening with a TLS handshake record are worth buffering
+            if payload[0] != TLS_HANDSHAKE:
+                self.finish()
+                return []
+            self.next_seq = seq
+
+        ahead = (seq - self.next_seq) & SEQ_MASK
+        if ahead == 0:
+            self.append(payload)
+        elif ahead < 1 << 31:
+            self.pending.setdefault(seq, bytes(payload))
+        else:
+            # retransmission, keep only the part past what we already have
+            behind = SEQ_MASK + 1 - ahead
+            if behind >= len(payload):
+                return []
+            self.append(payload[behind:])
+
+        self.received += len(payload)
+        certificates = self.parse()
+        if not self.done and self.received > self.max_bytes:
+            self.finish()
+        return certificates
+
+    def parse(self):
+        # Strip complete handshake record headers into one handshake byte stream
+        records = self.records
+        position = 0
+        while len(records) - position >= 5:
+            if records[position] != TLS_HANDSHAKE:
+                self.finish()
+                return []
+            length = int.from_bytes(records[position + 3 : position + 5], "big")
+            if len(records) - position - 5 < length:
+                break
+            self.handshake += memoryview(records)[position + 5 : position + 5 + length]
+            position += 5 + length
+        del records[:position]
+
+        handshake = self.handshake
+        position = 0
+        while len(handshake) - position >= 4:
+            msg_type = handshake[position]
+            length = int.from_bytes(handshake[position + 1 : position + 4], "big")
+            if len(handshake) - position - 4 < length:
+                break
+            if msg_type == HANDSHAKE_CERTIFICATE:
+                certificates = parse_certificate_message(memoryview(handshake)[position + 4 : position + 4 + length])
+                self.finish()
+                return certificates
+            if msg_type == HANDSHAKE_SERVER_HELLO_DONE:
+                self.finish()
+                return []
+            position += 4 + length
+        del handshake[:position]
+        return []
+
+
+def parse_certificate_message(body: memoryview):
+    """Split a TLS 1.0-1.2 Certificate message into DER certificates"""
+    certificates = []
+    if len(body) < 3:
+        return certificates
+    total = min(int.from_bytes(body[0:3], "big") + 3, len(body))
+    position = 3
+    while position + 3 <= total:
+        length = int.from_bytes(body[position : position + 3], "big")
+        position += 3
+        # certificate length exceeded message length, caused by packet data loss
+        if position + length > total:
+            break
+        certificates.append(bytes(body[position : position + length]))
+        position += length
+    return certificates
+
+
+def extract_pcap_certificates(job: Tuple[int, str]) -> Tuple[int, str, Dict[str, bytes]]:
+    """Pool worker: (task_id, pcap path) -> (task_id, pcap path, {sha1: DER})"""
+    task_id, path = job
+    certificates = {}
+    try:
+        with open(path, "rb") as f:
+            extracted = PCAP2CERT().extract_file(f) or {}
+    except OSError as e:
+        log.error("Can't read %s: %s", path, e)
+        extracted = {}
+    for encoded in extracted.values():
+        der = b64decode(encoded)
+        certificates[hashlib.sha1(der).hexdigest()] = der
+    return task_id, path, certificates
+
+
+def extract_many(jobs, workers: int = None, store_path: str = CERT_STORE_PATH) -> Dict[str, int]:
+    """Extract certificates from many pcaps in a process pool and record them in the certificate store.
+    @param jobs: iterable of (task_id, pcap path), rotated captures of one task share its id.
+    @param workers: pool size, defaults to the CPU count.
+    @param store_path: certificate store to update.
+    @return: counters of the run.
+    """
+    ders = {}
+    sightings = set()
+    pcaps = 0
+    with multiprocessing.Pool(workers) as pool:
+        for task_id, path, certificates in pool.imap_unordered(extract_pcap_certificates, jobs, chunksize=4):
+            pcaps += 1
+            for sha1, der in certificates.items():
+                ders.setdefault(sha1, der)
+                sightings.add((sha1, task_id))
+            log.debug("%s: %d certificates", path, len(certificates))
+
+    with CertStore(store_path) as store:
+        store.add_many((sha1, ders[sha1], task_id) for sha1, task_id in sightings)
+    return {"pcaps": pcaps, "certificates": len(ders), "sightings": len(sightings)}
+
 
 class PCAP2CERT(Report):
     """Extract certs and convert them to PEM"""
@@ -32,100 +289,63 @@ class PCAP2CERT(Report):
         cert = c.load_certificate(c.FILETYPE_ASN1, data)
         return c.dump_certificate(c.FILETYPE_PEM, cert)
 
-    def extract_file(self, f: BufferedReader) -> Dict[str, bytes]:
-        doneList = []
-        tcp_piece = {}
+    def extract_frames(self, frames: Iterator[Tuple[int, memoryview]], max_flow_bytes: int = MAX_FLOW_BYTES) -> Dict[str, bytes]:
         certificates = {}
+        streams = {}
         try:
-            pcap = dpkt.pcap.Reader(f)
-        except Exception as e:
+            for linktype, frame in frames:
+                ip = ethernet_ipv4(frame) if linktype == LINKTYPE_ETHERNET else None
+                if ip is None:
+                    ip = dpkt_ipv4(frame)
+                    if ip is None:
+                        continue
+                segment = tcp_segment(ip)
+                if segment is None:
+                    continue
+                src, dst, sport, dport, seq, payload = segment
+                tuple4 = (src, dst, sport, dport)
+                stream = streams.get(tuple4)
+                if stream is None:
+                    stream = streams[tuple4] = TLSStream(max_flow_bytes)
+                elif stream.done:
+                    continue
+                ders = stream.feed(seq, payload)
+                if not ders:
+                    continue
+                srcip = socket.inet_ntoa(src)
+                for sub_cert_count, der in enumerate(ders, 1):
+                    md5cert = hashlib.md5(der).hexdigest()
+                    filename = f"{srcip.replace('.', '_')}_{sport}_{sub_cert_count}_{md5cert}"
+                    certificates.setdefault(filename, b64encode(der))  # self.convert_cert(der))
+        except ValueError as e:
             log.info("Error: %s", e)
             return
-
-        count = 0
-        try:
-            for _, buf in pcap:
-                count += 1
-                try:
-                    ethernet = dpkt.ethernet.Ethernet(buf)
-                    if not hasattr(ethernet, "data"):
-                        continue
-
-                    upperdata = ethernet.data
-                    # iteratively find IP layer, as some connections have pppoe and ppp layers
-                    while not isinstance(upperdata, (dpkt.ip.IP, str)):
-                        upperdata = upperdata.data
-                    if isinstance(upperdata, str):
-                        continue
-                    # if upperdata.sport != 443: continue
-                    ippack = upperdata
-                    tcppack = ippack.data
-                    ssldata = tcppack.data
-                    # drop empty packets, including those with similar SEQ replies
-                    if not ssldata:
-                        continue
-                    srcip = socket.inet_ntoa(ippack.src)
-                    if srcip in doneList:
-                        continue
-                    if not hasattr(tcppack, "seq"):
-                        continue
-                    tuple4 = (srcip, socket.inet_ntoa(ippack.dst), tcppack.sport, tcppack.dport)
-                    tcp_piece.setdefault(tuple4, {})[tcppack.seq] = ssldata
-                except Exception as e:
-                    log.error(e)
         except Exception as e:
             log.error(e)
-
-        for t4, dic in tcp_piece.items():
-            srcip = t4[0]
-            sport = t4[2]
-            if srcip in doneList:
-                continue
-            seq = min(dic.keys())
-            sslcombined = dic[seq]
-            piecelen = len(dic[seq])
-            while seq + piecelen in dic:
-                seq += piecelen
-                sslcombined += dic[seq]
-                piecelen = len(dic[seq])
-            totallen = len(sslcombined)
-
-            curpos = 0
-            while curpos < totallen and totallen - curpos >= 12 and sslcombined[curpos] == "\x16":
-                handshake_len = struct.unpack("!H", sslcombined[curpos + 3 : curpos + 5])[0]
-                curpos += 5
-                cur_handshakelen = 0
-                while cur_handshakelen < handshake_len and curpos + 4 < totallen:
-                    this_handshake_len = struct.unpack("!I", "\x00" + sslcombined[curpos + 1 : curpos + 4])[0]
-                    if sslcombined[curpos] == "\x0b":
-                        # certificate
-                        certlen = struct.unpack("!I", "\x00" + sslcombined[curpos + 4 : curpos + 7])[0]
-                        # certificate length exceeded packet's length, caused by packet data loss
-                        if certlen > totallen:
-                            break
-                        curpos += 7
-                        sub_cert_len = 0
-                        sub_cert_count = 1
-                        while sub_cert_len < certlen:
-                            this_sub_len = struct.unpack("!I", "\x00" + sslcombined[curpos : curpos + 3])[0]
-                            curpos += 3
-                            this_sub_cert = sslcombined[curpos : curpos + this_sub_len]
-                            sub_cert_len += this_sub_len + 3  # +3 includes certificate length: 3 bytes
-                            curpos += this_sub_len
-                            md5cert = hashlib.md5(this_sub_cert).hexdigest()
-                            filename = f"{srcip.replace('.', '_')}_{sport}_{sub_cert_count}_{md5cert}"
-                            certificates.setdefault(filename, b64encode(this_sub_cert))  # self.convert_cert(this_sub_cert))
-                            sub_cert_count += 1
-                    else:
-                        # skip if not certificate
-                        curpos += this_handshake_len + 4
-                    cur_handshakelen += this_handshake_len + 4
-
-                if cur_handshakelen >= handshake_len:
-                    continue
-
         return certificates
 
+    def extract_file(self, f: BufferedReader, use_mmap: bool = True, max_flow_bytes: int = MAX_FLOW_BYTES) -> Dict[str, bytes]:
+        """Extract server certificates from a pcap.
+        @param f: pcap file object.
+        @param use_mmap: map the file instead of reading it record by record.
+        @param max_flow_bytes: stop following a flow after this many bytes.
+        @return: {"<srcip>_<sport>_<n>_<md5>": base64 DER}.
+        """
+        mapped = None
+        if use_mmap:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError):
+                mapped = None
+        frames = iter_pcap_buffer(mapped) if mapped is not None else iter_pcap_file(f)
+        try:
+            return self.extract_frames(frames, max_flow_bytes)
+        finally:
+            # frames are views into the map, drop them before unmapping
+            frames.close()
+            if mapped is not None:
+                mapped.close()
+
     def run(self, results: dict):
         """Run analysis.
         @return: {host:cert}.
@@ -139,6 +359,24 @@ class PCAP2CERT(Report):
         pcap_path = f"{CUCKOO_ROOT}/storage/analyses/{analysis_id}/dump.pcap"
         if os.path.exists(pcap_path):
             with open(pcap_path, "rb") as file_pcap:
-                certificates = self.extract_file(file_pcap)
+                certificates = self.extract_file(
+                    file_pcap,
+                    use_mmap=self.options.get("mmap", True),
+                    max_flow_bytes=int(self.options.get("max_flow_bytes", MAX_FLOW_BYTES)),
+                )
             if certificates:
                 results["certs"] = certificates
+                if self.options.get("cert_store", True):
+                    self.store_certificates(analysis_id, certificates)
+
+    def store_certificates(self, task_id, certificates: Dict[str, bytes]):
+        """Record this task's certificates so signatures can look them up on reprocessing"""
+        rows = []
+        for encoded in certificates.values():
+            der = b64decode(encoded)
+            rows.append((hashlib.sha1(der).hexdigest(), der, task_id))
+        try:
+            with CertStore() as store:
+                store.add_many(rows)
+        except Exception as e:
+            log.error("Can't update certificate store: %s", e)
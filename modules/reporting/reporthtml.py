@@ -2,27 +2,13 @@
 # This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
 # See the file 'docs/LICENSE' for copying permission.
 
-import base64
-import codecs
 import logging
 import os
 
 from lib.cuckoo.common.abstracts import Report
-from lib.cuckoo.common.constants import CUCKOO_ROOT
 from lib.cuckoo.common.exceptions import CuckooReportError
-from lib.cuckoo.common.objects import File
-from lib.cuckoo.common.path_utils import path_exists
-from web.analysis.templatetags.analysis_tags import flare_capa_attck, flare_capa_capabilities, flare_capa_mbc, malware_config
-from web.analysis.templatetags.key_tags import dict2list, getkey, parentfixup, str2list
-from web.analysis.templatetags.pdf_tags import datefmt
-
-try:
-    from jinja2.environment import Environment
-    from jinja2.loaders import FileSystemLoader
-
-    HAVE_JINJA2 = True
-except ImportError:
-    HAVE_JINJA2 = False
+from lib.cuckoo.common.report_templates import HAVE_JINJA2, StageTimer, get_template, write_streamed
+from lib.cuckoo.common.screenshots import load_screenshots
 
 log = logging.getLogger(__name__)
 
@@ -38,54 +24,21 @@ class ReportHTML(Report):
         if not HAVE_JINJA2:
             raise CuckooReportError("Failed to generate HTML report: Jinja2 Python library is not installed")
 
-        shots_path = os.path.join(self.analysis_path, "shots")
-        if path_exists(shots_path) and self.options.screenshots:
-            shots = []
-            counter = 1
-            for shot_name in os.listdir(shots_path):
-                if not shot_name.endswith((".jpg", ".png")):
-                    continue
-
-                shot_path = os.path.join(shots_path, shot_name)
-
-                if os.path.getsize(shot_path) == 0:
-                    continue
-
-                shot = {}
-                shot["id"] = os.path.splitext(File(shot_path).get_name())[0]
-                shot["data"] = base64.b64encode(open(shot_path, "rb").read()).decode()
-                shots.append(shot)
-
-                counter += 1
-
-            shots.sort(key=lambda shot: shot["id"])
-            results["shots"] = shots
-        else:
-            results["shots"] = []
-
-        env = Environment(autoescape=True)
-        env.filters.update(
-            {
-                "getkey": getkey,
-                "str2list": str2list,
-                "dict2list": dict2list,
-                "parentfixup": parentfixup,
-                "malware_config": malware_config,
-                "flare_capa_capability": flare_capa_capabilities,
-                "flare_capa_attck": flare_capa_attck,
-                "flare_capa_mbc": flare_capa_mbc,
-                "datefmt": datefmt,
-            }
-        )
-        env.loader = FileSystemLoader(os.path.join(CUCKOO_ROOT, "data", "html"))
-        results["local_conf"] = self.options
+        timer = StageTimer("report.html")
+        # Screenshots are read lazily while rendering and never stored in results
+        shots = []
+        if self.options.screenshots:
+            with timer.stage("screenshots"):
+                shots = load_screenshots(os.path.join(self.analysis_path, "shots"), thumbnails=False)
 
+        context = {"results": dict(results, shots=shots, local_conf=self.options), "summary_report": False}
         try:
-            tpl = env.get_template("report.html")
-            html = tpl.render({"results": results, "summary_report": False})
-            with codecs.open(os.path.join(self.reports_path, "report.html"), "w", encoding="utf-8") as report:
-                report.write(html)
+            with timer.stage("template"):
+                tpl = get_template("report.html")
+            with timer.stage("render"):
+                write_streamed(tpl, context, os.path.join(self.reports_path, "report.html"))
         except Exception as e:
-            log.exception("Failed to generate summary HTML report: %s", e)
+            log.exception("Failed to generate HTML report: %s", e)
+        timer.log(results.get("info", {}).get("id"))
 
         return True
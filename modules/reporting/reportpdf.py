@@ -9,6 +9,8 @@ from subprocess import call
 from lib.cuckoo.common.abstracts import Report
 from lib.cuckoo.common.exceptions import CuckooReportError
 from lib.cuckoo.common.path_utils import path_exists
+from lib.cuckoo.common.report_templates import HAVE_JINJA2, StageTimer, get_template, template_exists, write_streamed
+from lib.cuckoo.common.screenshots import load_screenshots
 
 try:
     from weasyprint import HTML
@@ -17,6 +19,11 @@ try:
 except ImportError:
     HAVE_WEASYPRINT = False
 
+log = logging.getLogger(__name__)
+
+# Minimal print layout in data/html, rendered directly instead of converting the summary report
+PRINT_TEMPLATE = "report_print.html"
+
 
 class ReportPDF(Report):
     """Stores report in PDF format."""
@@ -24,25 +31,53 @@ class ReportPDF(Report):
     # ensure we run after the summary HTML report
     order = 10
 
+    def render_print_template(self, results, timer):
+        """Renders the print template next to the other reports.
+        @return: path of the rendered HTML.
+        """
+        if not HAVE_JINJA2:
+            raise CuckooReportError("Failed to generate PDF report: Jinja2 Python library is not installed")
+        template = self.options.get("template", PRINT_TEMPLATE)
+        if not template_exists(template):
+            raise CuckooReportError(f"Print template {template} not found in data/html")
+        shots = []
+        if self.options.get("screenshots", True):
+            with timer.stage("screenshots"):
+                shots = load_screenshots(os.path.join(self.analysis_path, "shots"), thumbnails=True)
+        html_path = os.path.join(self.reports_path, "print-report.html")
+        with timer.stage("template"):
+            tpl = get_template(template)
+        with timer.stage("render"):
+            write_streamed(tpl, {"results": dict(results, shots=shots)}, html_path)
+        return html_path
+
     def run(self, results):
-        if not os.path.isfile(os.path.join(self.reports_path, "summary-report.html")):
-            raise CuckooReportError(
-                "Unable to open summary HTML report to convert to PDF: Ensure reporthtmlsummary is enabled in reporting.conf"
-            )
+        timer = StageTimer("report.pdf")
+        # mode = summary converts summary-report.html, mode = template renders the print template
+        if self.options.get("mode", "summary") == "template":
+            html_path = self.render_print_template(results, timer)
+        else:
+            html_path = os.path.join(self.reports_path, "summary-report.html")
+            if not os.path.isfile(html_path):
+                raise CuckooReportError(
+                    "Unable to open summary HTML report to convert to PDF: Ensure reporthtmlsummary is enabled in reporting.conf"
+                )
 
         if path_exists("/usr/bin/xvfb-run") and path_exists("/usr/bin/wkhtmltopdf"):
-            call(
-                [
-                    "/usr/bin/xvfb-run",
-                    "--auto-servernum",
-                    "--server-num",
-                    "1",
-                    "/usr/bin/wkhtmltopdf",
-                    "-q",
-                    os.path.join(self.reports_path, "summary-report.html"),
-                    os.path.join(self.reports_path, "report.pdf"),
-                ]
-            )
+            with timer.stage("wkhtmltopdf"):
+                call(
+                    [
+                        "/usr/bin/xvfb-run",
+                        "--auto-servernum",
+                        "--server-num",
+                        "1",
+                        "/usr/bin/wkhtmltopdf",
+                        "-q",
+                        html_path,
+                        os.path.join(self.reports_path, "report.pdf"),
+                    ]
+                )
+            timer.log(results.get("info", {}).get("id"))
             return True
 
         if not HAVE_WEASYPRINT:
@@ -54,6 +89,8 @@ class ReportPDF(Report):
         logger.handlers = []
         logger.setLevel(logging.ERROR)
 
-        HTML(os.path.join(self.reports_path, "summary-report.html")).write_pdf(os.path.join(self.reports_path, "report.pdf"))
+        with timer.stage("weasyprint"):
+            HTML(html_path).write_pdf(os.path.join(self.reports_path, "report.pdf"))
+        timer.log(results.get("info", {}).get("id"))
 
         return True
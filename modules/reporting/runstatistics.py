@@ -1,4 +1,9 @@
+import json
 import logging
+import os
+from collections import Counter
+from datetime import datetime
+from operator import itemgetter
 
 from lib.cuckoo.common.abstracts import Report
 from lib.cuckoo.core.database import Database
@@ -6,6 +11,20 @@ from lib.cuckoo.core.database import Database
 log = logging.getLogger(__name__)
 main_db = Database()
 
+REGISTRY_APIS = ("RegSetValueEx", "RegCreateKey", "RegDeleteKey")
+CALL_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+get_api = itemgetter("api")
+
+
+def call_span(calls):
+    """Seconds between the first and last call of a process, None if unknown"""
+    try:
+        first = datetime.strptime(calls[0]["timestamp"], CALL_TIMESTAMP_FORMAT)
+        last = datetime.strptime(calls[-1]["timestamp"], CALL_TIMESTAMP_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (last - first).total_seconds()
+
 
 class RunStatistics(Report):
     "Notify us about analysis is done"
@@ -29,18 +48,51 @@ class RunStatistics(Report):
         """Count api calss and registry modified.
         return two int values.
         """
-        calls_count = 0
-        registry_keys_count = 0
+        histogram = self.getApiHistogram(results)
+        return sum(histogram.values()), sum(histogram[api] for api in REGISTRY_APIS)
+
+    def getApiHistogram(self, results):
+        """Count calls per API over all processes.
+        Every call list is counted once with Counter's C loop and the result is reused by
+        the other statistics.
+        @return Counter {api: calls}.
+        """
+        if getattr(self, "_histogram_for", None) is results:
+            return self._api_histogram
+        histogram = Counter()
+        self._process_counts = []
         try:
-            processes = results.get("behavior", {}).get("processes")
-            for process in processes:
-                calls_count += len(process.get("calls", []))
-                for call in process.get("calls"):
-                    if call.get("api") in ("RegSetValueEx", "RegCreateKey", "RegDeleteKey"):
-                        registry_keys_count += 1
-            return calls_count, registry_keys_count
+            for process in results.get("behavior", {}).get("processes") or []:
+                calls = process.get("calls") or []
+                counts = Counter(map(get_api, calls))
+                histogram.update(counts)
+                self._process_counts.append((process, calls, counts))
         except Exception as e:
             log.error('Failed to RunStatistics "%s" :%s', self.__class__.__name__, e)
+        self._histogram_for = results
+        self._api_histogram = histogram
+        return histogram
+
+    def getProcessCallRates(self, results):
+        """Calls per second of each process, over the span between its first and last call.
+        @return list of dicts.
+        """
+        self.getApiHistogram(results)
+        rates = []
+        for process, calls, counts in self._process_counts:
+            span = call_span(calls) if calls else None
+            total = sum(counts.values())
+            rates.append(
+                {
+                    "process_id": process.get("process_id"),
+                    "process_name": process.get("process_name"),
+                    "calls": total,
+                    "seconds": span,
+                    "calls_per_second": round(total / span, 2) if span else None,
+                    "top_apis": counts.most_common(10),
+                }
+            )
+        return rates
 
     def getDomainsCount(self, results):
         """Count Domains
@@ -101,6 +153,22 @@ class RunStatistics(Report):
             detail["anti_issues"],
         ) = self.getSignaturesAndAlertCount(results)
         detail["files_written"] = self.getFilesWrittenCount(results)
+
+        # Capacity planning data that doesn't fit the statistics table
+        try:
+            with open(os.path.join(self.reports_path, "run_statistics.json"), "w") as f:
+                json.dump(
+                    {
+                        "detail": detail,
+                        "api_histogram": dict(self.getApiHistogram(results).most_common()),
+                        "processes": self.getProcessCallRates(results),
+                    },
+                    f,
+                )
+        except Exception as e:
+            log.error("Failed to write run statistics: %s", e)
+
+        # One transaction for all counters
         with main_db.session.begin():
             if main_db.add_statistics_to_task(task_id, detail):
                 log.debug("Run statistics succeeded!")
@@ -10,16 +10,32 @@ port = 514            # Port of your syslog server/listener
 protocol = tcp        # Protocol to send data over
 logfile = yes         # Store logfile in reports directory?
 logname = syslog.log  # if yes, what logname? [Default: syslog.txt]
+rfc5424 = no          # Prefix messages with an RFC 5424 header
+framing = legacy      # TCP only: legacy (one connection per message) or octet (persistent, octet-counted RFC 6587)
+queue_size = 1000     # Messages buffered while the server is unreachable
+batch_size = 100      # Messages per TCP write with octet framing
+flush_timeout = 30    # Seconds a report waits for its message to be delivered
 
 -KillerInstinct
 """
 
+import atexit
+import logging
 import os
+import queue
 import socket
+import threading
+import time
+from datetime import datetime, timezone
 
 from lib.cuckoo.common.abstracts import Report
+from lib.cuckoo.common.domain_matcher import DomainSuffixTrie
 from lib.cuckoo.common.exceptions import CuckooReportError
+from lib.cuckoo.common.ip_ranges import IPRangeSet
 
+log = logging.getLogger(__name__)
+
+# Exact IPs, "a.b.c." prefixes or CIDR networks
 ipwhitelist = [
     "131.107.255.255",  # msftncsi
     "134.170.51.254",  # M$
@@ -37,6 +53,7 @@ ipwhitelist = [
     "8.8.8.8",  # DNS
 ]
 
+# ".example.com" matches any subdomain, other entries the exact name
 dnwhitelist = [
     ".google.com",
     ".gmail.com",
@@ -51,141 +68,266 @@ dnwhitelist = [
 ]
 
 
+def ip_prefix_to_network(entry):
+    """Turn a dotted prefix such as "192.168." into "192.168.0.0/16", other entries are kept"""
+    if not entry.endswith("."):
+        return entry
+    octets = entry.rstrip(".").split(".")
+    return ".".join(octets + ["0"] * (4 - len(octets))) + f"/{8 * len(octets)}"
+
+
+IP_ALLOWLIST = IPRangeSet(ip_prefix_to_network(entry) for entry in ipwhitelist)
+DOMAIN_ALLOWLIST = DomainSuffixTrie("*" + entry if entry.startswith(".") else entry for entry in dnwhitelist)
+
+# user.notice, as rsyslog assigns to messages without a PRI
+SYSLOG_PRI = 13
+SEND_RETRIES = 3
+RECONNECT_DELAY = 2
+FLUSH_TIMEOUT = 30
+
+
+def rfc5424(message, hostname=socket.gethostname(), app_name="cape"):
+    timestamp = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    return f"<{SYSLOG_PRI}>1 {timestamp} {hostname} {app_name} {os.getpid()} - - {message}"
+
+
+class SyslogSender:
+    """Syslog connection fed through a bounded queue by a background thread.
+
+    With octet framing, TCP messages are batched and octet-counted (RFC 6587) so a batch is
+    one write, the connection is kept across reports and reopened when a write fails.
+    Legacy framing sends each TCP message on its own connection, as receivers expecting
+    the historical format delimit messages by the connection close.
+    """
+
+    def __init__(self, server, port, proto, queue_size=1000, batch_size=100, framing="legacy"):
+        self.address = (server, int(port))
+        self.proto = proto
+        self.octet_framing = proto == "tcp" and framing == "octet"
+        self.batch_size = batch_size if self.octet_framing else 1
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.sock = None
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._worker, name="syslog-sender", daemon=True)
+        self.thread.start()
+
+    def send(self, message, timeout=5):
+        try:
+            self.queue.put(message.encode("utf-8"), timeout=timeout)
+        except queue.Full:
+            raise CuckooReportError("Syslog queue is full, is the syslog server reachable?")
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """Wait until queued messages are sent or given up on.
+        @raise CuckooReportError: if messages are still queued after timeout or were dropped since the last flush.
+        """
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self.dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            raise CuckooReportError(f"Failed to send {dropped} syslog messages to {self.address[0]}:{self.address[1]}")
+        if self.queue.unfinished_tasks:
+            raise CuckooReportError(f"{self.queue.unfinished_tasks} syslog messages still queued after {timeout}s")
+
+    def _connect(self):
+        if self.proto == "tcp":
+            self.sock = socket.create_connection(self.address, timeout=30)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def _write(self, batch):
+        if self.sock is None:
+            self._connect()
+        if self.octet_framing:
+            self.sock.sendall(b"".join(b"%d %s" % (len(message), message) for message in batch))
+        elif self.proto == "tcp":
+            try:
+                for message in batch:
+                    self.sock.sendall(message)
+            finally:
+                self._close()
+        else:
+            for message in batch:
+                self.sock.sendto(message, self.address)
+
+    def _worker(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for attempt in range(SEND_RETRIES):
+                try:
+                    self._write(batch)
+                    break
+                except OSError as e:
+                    log.warning("Failed to send %d syslog messages to %s:%s: %s", len(batch), *self.address, e)
+                    self._close()
+                    time.sleep(RECONNECT_DELAY * (attempt + 1))
+            else:
+                log.error("Dropped %d syslog messages after %d attempts", len(batch), SEND_RETRIES)
+                with self.dropped_lock:
+                    self.dropped += len(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+
+_senders = {}
+
+
+def get_sender(server, port, proto, queue_size=1000, batch_size=100, framing="legacy"):
+    """One sender per destination and worker process, reused by every report"""
+    key = (server, int(port), proto, framing)
+    sender = _senders.get(key)
+    if sender is None:
+        sender = _senders[key] = SyslogSender(server, port, proto, queue_size, batch_size, framing)
+    return sender
+
+
+@atexit.register
+def _flush_senders():
+    # Only helps processes exiting normally, pool workers leave through os._exit: run() flushes too
+    for sender in _senders.values():
+        try:
+            sender.flush()
+        except CuckooReportError as e:
+            log.error(e)
+
+
 class Syslog(Report):
     """Creates the syslog data to be sent.
     @param results: Cuckoo results dict
     @return: String containing syslog data built from the results dict.
     """
 
-    def createLog(self, results):
-        syslog = ""
-        syslog += f'Timestamp="{results["info"]["started"].replace("-", "/")}" '
-        syslog += f'id="{results["info"]["id"]}" '
+    def logFields(self, results):
+        """Yields the key=\"value\" fields of the syslog message."""
+        yield f'Timestamp="{results["info"]["started"].replace("-", "/")}"'
+        yield f'id="{results["info"]["id"]}"'
         submittype = results["target"]["category"]
-        syslog += f'Submission="{submittype}" '
+        yield f'Submission="{submittype}"'
         if submittype == "file":
-            syslog += f'MD5="{results["target"]["file"]["md5"]}" '
-            syslog += f'SHA1="{results["target"]["file"]["sha1"]}" '
-            syslog += f'File_Name="{results["target"]["file"]["name"]}" '
-            syslog += f'File_Size="{results["target"]["file"]["size"]}" '
-            syslog += f'File_Type="{results["target"]["file"]["type"]}" '
+            yield f'MD5="{results["target"]["file"]["md5"]}"'
+            yield f'SHA1="{results["target"]["file"]["sha1"]}"'
+            yield f'File_Name="{results["target"]["file"]["name"]}"'
+            yield f'File_Size="{results["target"]["file"]["size"]}"'
+            yield f'File_Type="{results["target"]["file"]["type"]}"'
             if "PDF" in str(results["target"]["file"]["type"]):
                 if results["static"]["pdf"].get("Keywords", {}).get("obj", 0):
-                    syslog += f'Object_Count="{results["static"]["pdf"]["Keywords"]["obj"]}" '
+                    yield f'Object_Count="{results["static"]["pdf"]["Keywords"]["obj"]}"'
                 else:
-                    syslog += 'Object_Count="0" '
+                    yield 'Object_Count="0"'
                 if results["static"]["pdf"].get("JSStreams", []):
-                    syslog += f'Total_Streams="{len(results["static"]["pdf"]["JSStreams"])}" '
+                    yield f'Total_Streams="{len(results["static"]["pdf"]["JSStreams"])}"'
                 else:
-                    syslog += 'Total_Streams="0" '
+                    yield 'Total_Streams="0"'
         elif results["target"]["category"] == "url":
-            syslog += f'URL="{results["target"]["url"]}" '
+            yield f'URL="{results["target"]["url"]}"'
         # Here you can process the custom field if need be. My example stores
         # usernames and ticket numbers in the Custom field. I parse and output
         # it for syslog translation. Fields in custom are seperated by ";" and
         # key/value pairs are seperated by ":".
         # custom = results["info"]["custom"]
         # Set default value of "-"
-        # ticket = 'ticket="-" '
-        # uname = 'User="-" '
+        # ticket = 'ticket="-"'
+        # uname = 'User="-"'
         # Parse custom, check for a new value.
         # for option in custom.split(';'):
         #    if "user:" in option:
-        #        uname = f'User="{option.rsplit(":", 1)[-1]}" '
+        #        uname = f'User="{option.rsplit(":", 1)[-1]}"'
         #    if "ticket:" in option:
-        #        ticket = f'ticket="{option.rsplit(":", 1)[-1]}" '
-        # syslog += uname
-        # syslog += ticket
+        #        ticket = f'ticket="{option.rsplit(":", 1)[-1]}"'
+        # yield uname
+        # yield ticket
 
         if "malscore" in results:
-            syslog += f'MalScore="{results["malscore"]}" '
+            yield f'MalScore="{results["malscore"]}"'
         if results.get("malfamily"):
-            syslog += f'MalFamily="{results["malfamily"]}" '
+            yield f'MalFamily="{results["malfamily"]}"'
 
         if "network" in results:
             if "hosts" in results["network"]:
-                goodips = []
-                # Walks the IP exception list, appends to a multi-value ";" delimited field.
-                for ip in results["network"]["hosts"]:
-                    if ip["ip"] not in ipwhitelist:
-                        goodips.append(ip["ip"])
+                # Drops allowlisted IPs, appends the rest to a multi-value ";" delimited field.
+                goodips = [ip["ip"] for ip in results["network"]["hosts"] if ip["ip"] not in IP_ALLOWLIST]
                 if goodips == []:
-                    syslog += 'Related_IPs="-" '
+                    yield 'Related_IPs="-"'
                 else:
-                    syslog += f'Related_IPs="{";".join(goodips)}" '
+                    yield f'Related_IPs="{";".join(goodips)}"'
             else:
-                syslog += 'Related_IPs="-" '
+                yield 'Related_IPs="-"'
 
             if "domains" in results["network"]:
-                resultsdms = []
-                baddms = []
-                gooddms = []
-                # Walks the domain exception list, appends to a multi-value ";" delimited field.
-                for domain in results["network"]["domains"]:
-                    if domain["domain"] not in dnwhitelist:
-                        resultsdms.append(domain["domain"])
-                        for a in dnwhitelist:
-                            if domain["domain"].endswith(a):
-                                baddms.append(domain["domain"])
-                for domain in resultsdms:
-                    if domain not in baddms:
-                        gooddms.append(domain)
+                # Drops allowlisted domains, appends the rest to a multi-value ";" delimited field.
+                gooddms = [domain["domain"] for domain in results["network"]["domains"] if domain["domain"] not in DOMAIN_ALLOWLIST]
                 if gooddms == []:
-                    syslog += 'Related_Domains="-" '
+                    yield 'Related_Domains="-"'
                 else:
-                    syslog += f'Related_Domains="{";".join(gooddms)}" '
+                    yield f'Related_Domains="{";".join(gooddms)}"'
             else:
-                syslog += 'Related_Domains="-" '
+                yield 'Related_Domains="-"'
             # Some network stats...
             if "tcp" in results["network"]:
-                syslog += f'Total_TCP="{len(results["network"]["tcp"])}" '
+                yield f'Total_TCP="{len(results["network"]["tcp"])}"'
             else:
-                syslog += 'Total_TCP="0" '
+                yield 'Total_TCP="0"'
             if "udp" in results["network"]:
-                syslog += f'Total_UDP="{len(results["network"]["udp"])}" '
+                yield f'Total_UDP="{len(results["network"]["udp"])}"'
             else:
-                syslog += 'Total_UDP="0" '
+                yield 'Total_UDP="0"'
         # VT stats if available
         if "virustotal" in results:
             if all(val in list(results["virustotal"].keys()) for val in ("positives", "total")):
                 VT_bad = str(results["virustotal"]["positives"])
                 VT_total = str(results["virustotal"]["total"])
-                syslog += f'Virustotal="{VT_bad}/{VT_total}" '
+                yield f'Virustotal="{VT_bad}/{VT_total}"'
             else:
-                syslog += 'Virustotal="Not Found" '
+                yield 'Virustotal="Not Found"'
             # Vendor specific detections here. Included two examples.
             # if submittype == "file":
             #    if results["virustotal"]["scans"]["Symantec"]["detected"]:
             #        svirus = results["virustotal"]["scans"]["Symantec"]["result"]
-            #        syslog += f'Symantec="{svirus}" '
+            #        yield f'Symantec="{svirus}"'
             #    else:
-            #        syslog += 'Symantec="No Detection" '
+            #        yield 'Symantec="No Detection"'
             #    if results["virustotal"]["scans"]["McAfee"]["detected"]:
             #        mvirus = results["virustotal"]["scans"]["McAfee"]["result"]
-            #        syslog += f'McAfee="{mvirus}" '
+            #        yield f'McAfee="{mvirus}"'
             #    else:
-            #        syslog += 'McAfee="No Detection" '
+            #        yield 'McAfee="No Detection"'
         else:
-            syslog += 'Virustotal="Not Checked" '
+            yield 'Virustotal="Not Checked"'
             # Vendor specific case when there is no detection
             # if submittype == "file":
-            #    syslog += 'Symantec="N/A" '
-            #    syslog += 'McAfee="N/A" '
+            #    yield 'Symantec="N/A"'
+            #    yield 'McAfee="N/A"'
         sigs = []
         for sig in results["signatures"]:
             sigs.append(sig["name"])
         if sigs == []:
-            syslog += 'Cuckoo_Sigs="-" '
+            yield 'Cuckoo_Sigs="-"'
         else:
             # Ignore all sigs EXCEPT Virustotal for URL analysis
             # (FP's is signatures for IE mechanics)
             if submittype == "url" and "antivirus_virustotal" in sigs:
-                syslog += 'Cuckoo_Sigs="antivirus_virustotal" '
+                yield 'Cuckoo_Sigs="antivirus_virustotal"'
             # Otherwise generate the multi-value field.
             elif submittype == "file":
-                syslog += f'Cuckoo_Sigs="{";".join(sigs)}" '
+                yield f'Cuckoo_Sigs="{";".join(sigs)}"'
             else:
-                syslog += 'Cuckoo_Sigs="-" '
+                yield 'Cuckoo_Sigs="-"'
         # Creates a multi-value ";" delimited field for yara signatures
         # (File analysis)
         if submittype == "file":
@@ -194,11 +336,12 @@ class Syslog(Report):
                 for rule in results["target"]["file"]["yara"]:
                     yara.append(rule["name"])
             if yara == []:
-                syslog += 'Yara="-" '
+                yield 'Yara="-"'
             else:
-                syslog += f'Yara="{";".join(yara)}" '
+                yield f'Yara="{";".join(yara)}"'
 
-        return syslog
+    def createLog(self, results):
+        return "".join(f"{field} " for field in self.logFields(results))
 
     def run(self, results):
         """Sends report.
@@ -230,30 +373,25 @@ class Syslog(Report):
             logfile = self.options.get("logname", "syslog.txt")
             # Log syslog results to the reports directory
             try:
-                syslogfile = open(str(os.path.join(self.reports_path, logfile)), "w")
-                syslogfile.write(result)
+                with open(str(os.path.join(self.reports_path, logfile)), "w") as syslogfile:
+                    syslogfile.write(result)
             except Exception:
                 raise CuckooReportError("Error writing the syslog output file")
-            finally:
-                syslogfile.close()
-        # Attempt to connect to the syslog server
+
+        # Queue the message on the persistent connection of this worker
+        if self.options.get("rfc5424", False):
+            result = rfc5424(result)
         try:
-            server_address = (server, port)
-            if proto == "tcp":
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect(server_address)
-                # Attempt to send the syslog string to the syslog server
-                try:
-                    sock.sendall(bytes(result, encoding="UTF-8"))
-                except Exception:
-                    raise CuckooReportError("Failed to send data to syslog server")
-                finally:
-                    sock.close()
-            elif proto == "udp":
-                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                try:
-                    sock.sendto(bytes(result, encoding="UTF-8"), server_address)
-                except Exception:
-                    raise CuckooReportError("Failed to send data to syslog server")
-        except (UnicodeError, TypeError, IOError) as e:
+            sender = get_sender(
+                server,
+                port,
+                proto,
+                queue_size=int(self.options.get("queue_size", 1000)),
+                batch_size=int(self.options.get("batch_size", 100)),
+                framing=self.options.get("framing", "legacy"),
+            )
+            sender.send(result)
+        except (UnicodeError, TypeError, ValueError) as e:
             raise CuckooReportError(f"Failed to send syslog data: {e}")
+        # Workers exit without running atexit handlers, don't leave the message on the queue
+        sender.flush(timeout=int(self.options.get("flush_timeout", FLUSH_TIMEOUT)))
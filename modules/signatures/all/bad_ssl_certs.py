@@ -13,7 +13,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+from base64 import b64decode
+
 from lib.cuckoo.common.abstracts import Signature
+from lib.cuckoo.common.cert_store import task_cert_sha1s
 
 
 class BadSSLCerts(Signature):
@@ -56,6 +60,16 @@ class BadSSLCerts(Signature):
                 if sha in sha1_indicators.keys() and sha not in matches.keys():
                     matches[sha] = sha1_indicators[sha]
 
+        # Certificates of the capture from the tlscerts processing module, plus the ones pcap2cert
+        # extracted in a previous report of this task or back-filled into the certificate store
+        seen = set(self.results.get("tls_certs") or [])
+        seen.update(task_cert_sha1s(self.results.get("info", {}).get("id")))
+        for encoded in (self.results.get("certs") or {}).values():
+            seen.add(hashlib.sha1(b64decode(encoded)).hexdigest())
+        for sha in seen:
+            if sha in sha1_indicators and sha not in matches:
+                matches[sha] = sha1_indicators[sha]
+
         if matches:
             for item in matches.keys():
                 self.families.append(matches[item].split(" ")[0])
@@ -14,24 +14,20 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import csv
-import ipaddress
 import logging
 import os
 
 from lib.cuckoo.common.abstracts import Signature
 from lib.cuckoo.common.constants import CUCKOO_ROOT
+from lib.cuckoo.common.ip_ranges import PRIVATE_IP_RANGES, IPRangeSet
 
 log = logging.getLogger()
 
-ip_ranges = []
+ip_ranges = IPRangeSet()
 HAVE_MSFT_PUB_IPS = False
 msf_public_ips_list = os.path.join(CUCKOO_ROOT, "extra", "msft-public-ips.csv")
 if os.path.exists(msf_public_ips_list):
-    with open(msf_public_ips_list, "r") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            ip_ranges.append(row["Prefix"])
+    ip_ranges = IPRangeSet.from_csv(msf_public_ips_list, column="Prefix")
     HAVE_MSFT_PUB_IPS = True
 else:
     log.debug(
@@ -40,12 +36,7 @@ else:
 
 
 def check_ip_in_ranges(ip_address):
-    ip = ipaddress.ip_address(ip_address)
-    for ip_range in ip_ranges:
-        network = ipaddress.ip_network(ip_range)
-        if ip in network:
-            return True
-    return False
+    return ip_address in ip_ranges
 
 
 class NetworkCountryDistribution(Signature):
@@ -95,8 +86,8 @@ class NetworkMultipleDirectIPConnections(Signature):
 
         count = 0
         ips = []
-        for host in self.results.ge("network", {}).get("hosts", []):
-            if host["ip"] not in ips and not host["hostname"] and not host["ip"].startswith(("10.", "172.16.", "192.168.")):
+        for host in self.results.get("network", {}).get("hosts", []):
+            if host["ip"] not in ips and not host["hostname"] and host["ip"] not in PRIVATE_IP_RANGES:
                 # Verify whether they are not part of the MICROSOFT-CORP-MSN-AS-BLOCK.
                 if not check_ip_in_ranges(host["ip"]):
                     ips.append(host["ip"])
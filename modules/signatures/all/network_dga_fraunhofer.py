@@ -17,6 +17,7 @@ import os
 
 from lib.cuckoo.common.abstracts import Signature
 from lib.cuckoo.common.constants import CUCKOO_ROOT
+from lib.cuckoo.common.dga_index import get_dga_index
 from lib.cuckoo.common.fraunhofer_helper import get_dga_lookup_dict
 
 try:
@@ -48,6 +49,7 @@ class NetworkDGAFraunhofer(Signature):
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
         self.bloom_location = os.path.join(CUCKOO_ROOT, "data", "dga.bloom")
+        self.index_location = os.path.join(CUCKOO_ROOT, "data", "dga.index")
         # the dga families have produced FPs and will not be able to change weight or malfamily
         # we could consider to already ignore them in create_bloom.py
         self.allowed_families = [
@@ -56,6 +58,13 @@ class NetworkDGAFraunhofer(Signature):
             "Virut",
         ]
 
+        # mmap-ed index written by utils/create_bloom.py, shared read-only by every worker
+        self.dga_index = get_dga_index(self.index_location)
+        if self.dga_index is not None:
+            self.bloom = None
+            self.dga_lookup_dict = {}
+            return
+
         try:
             # init bloomfilter to be able to do a really quick lookup if a domain is in the bloomfilter
             self.bloom = BloomFilter()
@@ -69,6 +78,9 @@ class NetworkDGAFraunhofer(Signature):
             self.dga_lookup_dict = {}
 
     def run(self):
+        if self.dga_index is not None:
+            return self.run_index()
+
         if not HAS_FLOR:
             return False
 
@@ -113,3 +125,26 @@ class NetworkDGAFraunhofer(Signature):
                     has_match = True
 
         return has_match
+
+    def run_index(self):
+        has_match = False
+        for dns in self.results.get("network", {}).get("dns", []):
+            request = dns.get("request", "")
+            if not request:
+                continue
+            family = None
+            labels = request.split(".")
+            # same domain extraction and length filter as the bloomfilter path
+            if len(labels) > 1:
+                _domain = labels[-2] + "." + labels[-1]
+                if len(_domain) > 7 and _domain != request:
+                    family = self.dga_index.family(_domain)
+            if not family:
+                family = self.dga_index.family(request)
+            if family:
+                tmp_fam = family.split("_")[0]
+                if tmp_fam and tmp_fam not in self.families and tmp_fam not in self.allowed_families:
+                    self.families.append(tmp_fam)
+                    has_match = True
+
+        return has_match
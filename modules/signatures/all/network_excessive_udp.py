@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from lib.cuckoo.common.abstracts import Signature
+from lib.cuckoo.common.ip_ranges import PRIVATE_IP_RANGES
 
 
 class NetworkExcessiveUDP(Signature):
@@ -41,11 +42,7 @@ class NetworkExcessiveUDP(Signature):
                 if uniqueips > 100:
                     return True
                     break
-                if (
-                    dstip not in ips
-                    and dstport not in whitelistports
-                    and not dstip.startswith(("127.", "10.", "172.16.", "192.168."))
-                ):
+                if dstip not in ips and dstport not in whitelistports and dstip not in PRIVATE_IP_RANGES:
                     ips.append(dstip)
                     uniqueips += 1
 
@@ -30,7 +30,7 @@ class AntiVMSystem(Signature):
     mbcs += ["OC0008", "C0036", "C0036.005"]  # micro-behaviour
     evented = True
 
-    filter_category = set(
+    filter_categories = set(
         [
             "registry",
         ]
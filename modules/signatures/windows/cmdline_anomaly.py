@@ -19,6 +19,9 @@ except ImportError:
     import re
 
 from lib.cuckoo.common.abstracts import Signature
+from lib.cuckoo.common.cmdline_index import get_cmdline_index, register_terms
+
+register_terms("cmd", "powershell", "forfiles")
 
 
 class CmdlineObfuscation(Signature):
@@ -35,15 +38,14 @@ class CmdlineObfuscation(Signature):
 
     def run(self):
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             # using cmd.exe via comspec
-            if "%comspec" in cmdline.lower():
+            if "%comspec" in lower:
                 ret = True
                 self.data.append({"command": cmdline})
 
             # character obfuscation
-            elif "cmd" in cmdline.lower() and (
+            elif "cmd" in lower and (
                 cmdline.count("^") > 3
                 or cmdline.count("&") > 6
                 or cmdline.count("+") > 4
@@ -54,22 +56,22 @@ class CmdlineObfuscation(Signature):
                 self.data.append({"command": cmdline})
 
             # concatenation
-            elif "cmd" in cmdline.lower() and re.search("(%[^%]+%){4}", cmdline):
+            elif "cmd" in lower and re.search("(%[^%]+%){4}", cmdline):
                 ret = True
                 self.data.append({"command": cmdline})
 
             # Set variables obfsucation
-            elif "cmd" in cmdline.lower() and cmdline.lower().count("set ") > 2:
+            elif "cmd" in lower and lower.count("set ") > 2:
                 ret = True
                 self.data.append({"command": cmdline})
 
             # Set call obfuscation
-            elif "cmd" in cmdline.lower() and "set " in cmdline.lower() and "call " in cmdline.lower():
+            elif "cmd" in lower and "set " in lower and "call " in lower:
                 ret = True
                 self.data.append({"command": cmdline})
 
             # for loop obfuscation
-            elif "cmd" in cmdline.lower() and "set " in cmdline.lower() and "for " in cmdline.lower():
+            elif "cmd" in lower and "set " in lower and "for " in lower:
                 ret = True
                 self.data.append({"command": cmdline})
 
@@ -89,9 +91,8 @@ class CmdlineSwitches(Signature):
 
     def run(self):
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            if "cmd" in cmdline.lower() and ("/V" in cmdline or "\V" in cmdline):
+        for cmdline, lower in get_cmdline_index(self.results).containing("cmd"):
+            if "cmd" in lower and ("/V" in cmdline or "\V" in cmdline):
                 ret = True
                 self.data.append({"command": cmdline})
 
@@ -111,9 +112,8 @@ class CmdlineTerminate(Signature):
 
     def run(self):
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            if "cmd" in cmdline.lower() and ("/C" in cmdline or "\C" in cmdline or "/R" in cmdline or "\R" in cmdline):
+        for cmdline, lower in get_cmdline_index(self.results).containing("cmd"):
+            if "cmd" in lower and ("/C" in cmdline or "\C" in cmdline or "/R" in cmdline or "\R" in cmdline):
                 ret = True
                 self.data.append({"command": cmdline})
 
@@ -144,9 +144,7 @@ class LongCommandline(Signature):
         ]
 
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower and len(lower) > 250:
                     ret = True
@@ -179,9 +177,7 @@ class CommandLineHTTPLink(Signature):
             "msiexec",
         ]
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     if "http://" in lower or "https://" in lower:
@@ -216,9 +212,7 @@ class CommandLineReversedHTTPLink(Signature):
             "msiexec",
         ]
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     if "//:ptth" in lower or "//:sptth" in lower:
@@ -241,10 +235,9 @@ class PowershellRenamedCommandLine(Signature):
 
     def run(self):
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            if "powershell" in cmdline.lower() and not cmdline.lower().startswith("powershell"):
-                if re.findall("=\W+powershell", cmdline.lower()):
+        for cmdline, lower in get_cmdline_index(self.results).containing("powershell"):
+            if "powershell" in lower and not lower.startswith("powershell"):
+                if re.findall("=\W+powershell", lower):
                     ret = True
                     self.data.append({"command": cmdline})
 
@@ -273,10 +266,9 @@ class CommandLineLongString(Signature):
             "wscript",
         ]
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
-                if utility in cmdline.lower():
+                if utility in lower:
                     for string in cmdline.split():
                         if len(string) > 100 and "http://" not in string and "https://" not in string:
                             ret = True
@@ -300,9 +292,8 @@ class CommandLineForFilesWildCard(Signature):
 
     def run(self):
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            if "forfiles" in cmdline.lower() and "@file" in cmdline.lower() and "*" in cmdline:
+        for cmdline, lower in get_cmdline_index(self.results).containing("forfiles"):
+            if "forfiles" in lower and "@file" in lower and "*" in cmdline:
                 ret = True
                 self.data.append({"command": cmdline})
 
@@ -1,9 +1,12 @@
-import re
-
 from lib.cuckoo.common.abstracts import Signature
+from lib.cuckoo.common.cmdline_index import get_cmdline_index
+from lib.cuckoo.common.domain_matcher import DomainListMatcher
 
 from data.cryptopools import pool_domains
 
+# prefix semantics, like the re.match over pool_domains this replaces
+POOL_DOMAINS = DomainListMatcher(pool_domains, prefix=True)
+
 
 class MINERS(Signature):
     name = "cryptopool_domains"
@@ -34,12 +37,11 @@ class MINERS(Signature):
         else:
             self.extra_domains += domains
 
-        for domain in self.extra_domains:
-            if (
-                domain in pool_domains
-                or any([re.match(pool_domain, domain) for pool_domain in pool_domains])
-                or self.check_executed_command(pattern=domain, regex=True)
-            ):
+        cmdlines = get_cmdline_index(self.results)
+        for domain in set(self.extra_domains):
+            if not domain:
+                continue
+            if POOL_DOMAINS.match(domain) or any(cmdlines.containing(domain)):
                 self.malfamily = "crypto miner"
                 self.results["malfamily"] = "crypto miner"
                 self.results["malfamily_tag"] = "Behavior"
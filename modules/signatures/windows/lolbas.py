@@ -1,4 +1,25 @@
 from lib.cuckoo.common.abstracts import Signature
+from lib.cuckoo.common.cmdline_index import get_cmdline_index, register_terms
+
+register_terms(
+    "pester",
+    "ssh",
+    "cmd",
+    "powershell",
+    "conhost.exe",
+    "fltmc",
+    "aspnet_compiler.exe",
+    "gfxdownloadwrapper.exe",
+    "wscript",
+    "cscript",
+    "certoc",
+    "runexehelper.exe",
+    "ttdinject.exe",
+    "appvlp.exe",
+    "pcalua.exe",
+    "cdb.exe",
+    "devinit",
+)
 
 
 class LOLBAS_ExecuteBinaryViaPesterPSModule(Signature):
@@ -13,9 +34,7 @@ class LOLBAS_ExecuteBinaryViaPesterPSModule(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("pester"):
             if "pester" in lower and not "http" in lower:
                 self.data.append({"command": cmdline})
                 return True
@@ -35,9 +54,7 @@ class LOLBAS_ExecuteBinaryViaOpenSSH(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("ssh"):
             if "ssh" in lower and (
                 ("-o" in lower and ("proxycommand=" in lower or "localcommand=" in lower))
                 or ("localhost" in lower and ".exe" in lower)
@@ -61,9 +78,7 @@ class LOLBAS_ExecuteBinaryVisualStudioLiveShare(Signature):
 
     def run(self):
 
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             # False-Positives
             # REF: https://github.com/elastic/protections-artifacts/blob/main/behavior/rules/windows/defense_evasion_dll_execution_via_visual_studio_live_share.toml
             if "--pipe" in lower and "visualstudio.com/" in lower:
@@ -87,9 +102,7 @@ class LOLBAS_EvadeExecutionViaDeviceCredentialDeployment(Signature):
 
     def run(self):
 
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("cmd", "powershell"):
             if ("cmd" in lower or "powershell" in lower) and "devicecredentialdeployment" in lower:
                 self.data.append({"command": cmdline})
                 return True
@@ -108,9 +121,7 @@ class LOLBAS_IndirectCommandExecutionViaConsoleWindowHost(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("conhost.exe"):
             if "conhost.exe" in lower and any(process in lower for process in ("cmd /c", "powershell", "script", "mshta", "curl")):
                 self.data.append({"command": cmdline})
                 return True
@@ -129,8 +140,7 @@ class LOLBAS_EvadeExecutionViaFilterManagerControl(Signature):
     evented = True
 
     def run(self):
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("fltmc"):
             if "fltmc" in lower and "unload" in lower and any(arg in lower for arg in ("security", "sysmon", "esensor", "Elastic")):
                 self.data.append({"command": cmdline})
                 return True
@@ -152,9 +162,7 @@ class LOLBAS_EvadeExecutionViaASPNetCompiler(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("aspnet_compiler.exe"):
             if "aspnet_compiler.exe" in lower and "-v" in lower and "-f" in lower and "-u" in lower and not "-d" in lower:
                 self.data.append({"command": cmdline})
                 return True
@@ -176,9 +184,7 @@ class LOLBAS_EvadeExecutionViaIntelGFXDownloadWrapper(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("gfxdownloadwrapper.exe"):
             if "gfxdownloadwrapper.exe" in lower and (
                 "run" in lower
                 and any(arg in lower for arg in ("0", "2"))
@@ -201,9 +207,7 @@ class LOLBAS_ScriptletProxyExecutionViaPubprn(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("wscript", "cscript"):
             if ("wscript" in lower or "cscript" in lower) and "pubprn" in lower and "script:http" in lower:
                 self.data.append({"command": cmdline})
                 return True
@@ -222,9 +226,7 @@ class LOLBAS_RegisterDLLViaMSIEXEC(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if (
                 "msiexec" in lower
                 and any(arg in lower for arg in ("/z", "/y", "-y", "-z"))
@@ -248,9 +250,7 @@ class LOLBAS_RegisterDLLViaOdbcconf(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
 
             # Falses:
             # REF: https://github.com/elastic/protections-artifacts/blob/main/behavior/rules/windows/defense_evasion_suspicious_imageload_via_odbc_driver_configuration_program.toml
@@ -277,9 +277,7 @@ class LOLBAS_RegisterDLLViaCertOC(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("certoc"):
             if "certoc" in lower and (("-loaddll" in lower and ".dll" in lower) or ("-getcacaps" in lower and "http" in lower)):
                 self.data.append({"command": cmdline})
                 return True
@@ -298,9 +296,7 @@ class LOLBAS_ExecuteBinaryViaScriptRunner(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
 
             # Exclude conhost.exe (False-postive):
             # REF: https://github.com/elastic/protections-artifacts/blob/main/behavior/rules/windows/defense_evasion_system_binary_proxy_execution_via_scriptrunner.toml
@@ -324,9 +320,7 @@ class LOLBAS_ExecuteMsiexecViaExplorer(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if (
                 "explorer" in lower
                 and "msiexec" in lower
@@ -350,9 +344,7 @@ class LOLBAS_PerformMaliciousActivitiesViaHeadlessBrowser(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
 
             # I have tried it on other browsers
             if any(
@@ -407,9 +399,7 @@ class LOLBAS_ExecuteBinaryViaRunExeHelperUtility(Signature):
                 return False
 
     def on_complete(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("runexehelper.exe"):
             if "runexehelper.exe" in lower and lower.endswith(".exe"):
                 self.data.append({"command": cmdline})
                 return True
@@ -428,9 +418,7 @@ class LOLBAS_ExecuteBinaryViaTTDinject(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("ttdinject.exe"):
             if "ttdinject.exe" in lower and "/launch" in lower and not "\\ttdinject.exe" in lower:
                 self.data.append({"command": cmdline})
                 return True
@@ -453,9 +441,7 @@ class LOLBAS_ExecuteBinaryViaAppVLP(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("appvlp.exe"):
             if "appvlp.exe" in lower and not (
                 "\\program files\\" in lower or "\\program files (x86)\\" in lower or "rundll32.exe" in lower
             ):
@@ -501,9 +487,7 @@ class LOLBAS_ExecuteBinaryViaInternetExplorerExporter(Signature):
 
     def on_complete(self):
         if self.detected:
-            cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-            for cmdline in cmdlines:
-                lower = cmdline.lower()
+            for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
                 if "extexport.exe" in lower:
                     self.data.append({"command": cmdline})
                     return True
@@ -522,9 +506,7 @@ class LOLBAS_ExecuteSuspiciousPowerShellViaSQLPS(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if any(process in lower for process in ("sqltoolsps.exe", "sqlps.exe")) and any(
                 arg in lower
                 for arg in (
@@ -559,9 +541,7 @@ class LOLBAS_ExecuteSuspiciousPowerShellViaRunscripthelper(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             argumentCount = lower.split()
             if "runscripthelper.exe" in lower and "surfacecheck" and (len(argumentCount) - 1) > 3:
                 self.data.append({"command": cmdline})
@@ -582,9 +562,7 @@ class LOLBAS_ExecuteBinaryViaPcalua(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("pcalua.exe"):
             if "pcalua.exe" in lower and "-a" in lower and not "-d" in lower:
                 self.data.append({"command": cmdline})
                 return True
@@ -604,9 +582,7 @@ class LOLBAS_ExecuteBinaryViaCDB(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("cdb.exe"):
             if "cdb.exe" in lower and any(arg in lower for arg in ("-cf", "-c", "-pd")):
                 self.data.append({"command": cmdline})
                 return True
@@ -664,9 +640,7 @@ class LOLBAS_ExecuteRemoteMSIViaDevinit(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("devinit"):
             if "devinit" in lower and "msi-install" in lower and "http" in lower and ".msi" in lower:
                 self.data.append({"command": cmdline})
                 return True
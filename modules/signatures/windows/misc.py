@@ -1,4 +1,7 @@
 from lib.cuckoo.common.abstracts import Signature
+from lib.cuckoo.common.cmdline_index import get_cmdline_index, register_terms
+
+register_terms("qemu", "sfx.exe", "localbridge", "addinprocess")
 
 
 class SuspiciousExecutionViaMicrosoftExchangeTransportAgent(Signature):
@@ -97,8 +100,7 @@ class SuspiciousScheduledTaskCreationviaMasqueradedXMLFile(Signature):
                 return False
 
     def on_complete(self):
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if (
                 "schtasks.exe" in lower
                 and any(arg in lower for arg in ("/create", "-create"))
@@ -123,8 +125,7 @@ class PotentialProtocolTunnelingViaLegitUtilities(Signature):
     evented = True
 
     def run(self):
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if (
                 "3389" in lower
                 and any(arg in lower for arg in ("-L", "-P", "-R", "-pw", "-ssh"))
@@ -152,8 +153,7 @@ class PotentialProtocolTunnelingViaQEMU(Signature):
     evented = True
 
     def run(self):
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("qemu"):
             if "qemu" in lower and "netdev" in lower and "nographic" in lower and "restrict=off" in lower:
                 return True
 
@@ -228,9 +228,7 @@ class ExecutionFromSelfExtractingArchive(Signature):
 
     def on_complete(self):
         if self.detected:
-            cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-            for cmdline in cmdlines:
-                lower = cmdline.lower()
+            for cmdline, lower in get_cmdline_index(self.results).containing("sfx.exe"):
                 if "sfx.exe" in lower and "-p" in lower and "-d" in lower:
                     self.data.append({"command": cmdline})
                     return True
@@ -408,8 +406,7 @@ class MSOfficeCMDRCE(Signature):
     ]
 
     def run(self):
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("localbridge"):
             if "localbridge" in lower and any(
                 arg in lower for arg in ("ms-officecmd", "launchofficeappforresult", "--gpu-launcher")
             ):
@@ -605,8 +602,7 @@ class MountCopyToWebDavShare(Signature):
     evented = True
 
     def run(self):
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if ("rundll32.exe" in lower and "\\program files\\microsoft office\\root\\office16\\mlcfg32.cpl" in lower) or (
                 any(
                     proc in lower
@@ -1110,9 +1106,7 @@ class SuspiciousExecutionViaDotnetRemoting(Signature):
     evented = True
 
     def run(self):
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("addinprocess"):
             if "addinprocess" in lower and "/guid" in lower and "/pid" in lower:
                 self.data.append({"command": cmdline})
                 return True
@@ -13,12 +13,160 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-try:
-    import re2 as re
-except ImportError:
-    import re
-
 from lib.cuckoo.common.abstracts import Signature
+from lib.cuckoo.common.domain_matcher import HostCategoryMatcher
+
+SOCIAL_MEDIA_DOMAINS = [
+    "api.twitter.com",
+    "cdn.discordapp.com",
+    "api.telegram.org",
+    "api.instagram.com",
+    "graph.facebook.com",
+    "wa.me",
+    "gist.github.com",
+    "raw.githubusercontent.com",
+    "telete.in",
+    "api.whatsapp.com",
+    "api.vkontakte.ru",
+    "api.vk.com",
+    "files.slack.com",
+]
+
+PASTE_SITE_DOMAINS = [
+    "pastebin.com",
+    "paste.ee",
+    "pastecode.xyz",
+    "rentry.co",
+    "paste.nrecom.net",
+    "hastebin.com",
+    "privatebin.info",
+    "penyacom.org",
+    "controlc.com",
+    "tiny-paste.com",
+    "paste.teknik.io",
+    "privnote.com",
+    "hushnote.herokuapp.com",
+    "justpaste.it",
+    "stikked.ch",
+    "dpaste.com",
+    "pastebin.pl",
+]
+
+URL_SHORTENER_DOMAINS = [
+    "2no.co",
+    "42url.com",
+    "bit.do",
+    "bit.ly",
+    "cml.lol",
+    "coki.me",
+    "cutt.ly",
+    "dik.si",
+    "dwz.mk",
+    "e.vg",
+    "gg-l.xyz",
+    "goo.gl",
+    "hyp.ae",
+    "ic9.in",
+    "is.gd",
+    "ito.mx",
+    "iurl.vip",
+    "kutti.co",
+    "litby.us",
+    "long.af",
+    "longurl.in",
+    "maxiurl.com",
+    "me2.do",
+    "mjt.lu",
+    "n9.cl",
+    "rb.gy",
+    "rebrand.ly",
+    "s.id",
+    "s3r.io",
+    "s59.site",
+    "shorturl.at",
+    "shrtcnl.com",
+    "t.ly",
+    "vtaurl.com",
+    "webz.cc",
+    "www.shorturl.at",
+    "www.temporary-url.com",
+    "ykm.de",
+    "zws.im",
+]
+
+TEMP_STORAGE_DOMAINS = [
+    "send-anywhere.com",
+    "sendgb.com",
+    "volafile.org",
+    "uploadfiles.io",
+    "sendpace.com",
+    "filedropper.com",
+    "myairbridge.co",
+    "u.teknik.io",
+    "p.teknik.io",
+    "upload.sexy",
+    "digitalassets.ams3.digitaloceanspaces.com",
+    "api.sendspace.com",
+    "www.fileden.com",
+    "a.pomf.cat",
+    "dropmb.com",
+    "transfer.sh",
+    "1fichier.com",
+    "gofile.io",
+]
+
+TEMP_URLDNS_DOMAINS = [
+    ".requestbin.net",
+]
+
+INTERACTSH_DOMAINS = [
+    ".interact.sh",
+]
+
+FREE_WEB_HOSTING_DOMAINS = [
+    ".000webhostapp.com",
+    ".repl.co",
+    ".glitch.me",
+    ".ck.page",
+]
+
+ARCHIVE_DOMAINS = [
+    "archive.org",
+    "archive.is",
+    "archive.ph",
+    "archive.today",
+]
+
+OPEN_SOURCE_DOMAINS = [
+    "gist.github.com",
+    "raw.githubusercontent.com",
+]
+
+SERVICE_INTERFACE_DOMAINS = [
+    "mockbin.org",
+    "run.mocky.io",
+    "webhook.site",
+    "devtunnels.ms",
+]
+
+# "Host: <domain>" headers and "https://<domain>" URL prefixes
+HTTPS_DOMAIN_MATCHER = HostCategoryMatcher(
+    host_categories={
+        "socialmedia": SOCIAL_MEDIA_DOMAINS,
+        "pastesite": PASTE_SITE_DOMAINS,
+        "urlshortener": URL_SHORTENER_DOMAINS,
+        "tempstorage": TEMP_STORAGE_DOMAINS,
+        "archive": ARCHIVE_DOMAINS,
+        "opensource": OPEN_SOURCE_DOMAINS,
+        "serviceinterface": SERVICE_INTERFACE_DOMAINS,
+    },
+    # Domains matched anywhere in the buffer or after the URL scheme
+    substring_categories={
+        "temp_urldns": TEMP_URLDNS_DOMAINS,
+        "interactsh": INTERACTSH_DOMAINS,
+        "free_webhosting": FREE_WEB_HOSTING_DOMAINS,
+    },
+)
 
 
 class NetworkCnCHTTPSGeneric(Signature):
@@ -73,40 +221,23 @@ class NetworkCnCHTTPSSocialMedia(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            "api.twitter.com",
-            "cdn.discordapp.com",
-            "api.telegram.org",
-            "api.instagram.com",
-            "graph.facebook.com",
-            "wa.me",
-            "gist.github.com",
-            "raw.githubusercontent.com",
-            "telete.in",
-            "api.whatsapp.com",
-            "api.vkontakte.ru",
-            "api.vk.com",
-            "files.slack.com",
-        ]
+        self.domains = SOCIAL_MEDIA_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                host_header = "Host: " + domain
-                if host_header in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "socialmedia" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if url.startswith("https://" + domain):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "socialmedia" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -132,44 +263,23 @@ class NetworkCnCHTTPSPasteSite(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            "pastebin.com",
-            "paste.ee",
-            "pastecode.xyz",
-            "rentry.co",
-            "paste.nrecom.net",
-            "hastebin.com",
-            "privatebin.info",
-            "penyacom.org",
-            "controlc.com",
-            "tiny-paste.com",
-            "paste.teknik.io",
-            "privnote.com",
-            "hushnote.herokuapp.com",
-            "justpaste.it",
-            "stikked.ch",
-            "dpaste.com",
-            "pastebin.pl",
-        ]
+        self.domains = PASTE_SITE_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                host_header = "Host: " + domain
-                if host_header in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "pastesite" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if url.startswith("https://" + domain):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "pastesite" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -195,66 +305,23 @@ class NetworkCnCHTTPSURLShortenerSite(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            "2no.co",
-            "42url.com",
-            "bit.do",
-            "bit.ly",
-            "cml.lol",
-            "coki.me",
-            "cutt.ly",
-            "dik.si",
-            "dwz.mk",
-            "e.vg",
-            "gg-l.xyz",
-            "goo.gl",
-            "hyp.ae",
-            "ic9.in",
-            "is.gd",
-            "ito.mx",
-            "iurl.vip",
-            "kutti.co",
-            "litby.us",
-            "long.af",
-            "longurl.in",
-            "maxiurl.com",
-            "me2.do",
-            "mjt.lu",
-            "n9.cl",
-            "rb.gy",
-            "rebrand.ly",
-            "s.id",
-            "s3r.io",
-            "s59.site",
-            "shorturl.at",
-            "shrtcnl.com",
-            "t.ly",
-            "vtaurl.com",
-            "webz.cc",
-            "www.shorturl.at",
-            "www.temporary-url.com",
-            "ykm.de",
-            "zws.im",
-        ]
+        self.domains = URL_SHORTENER_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                host_header = "Host: " + domain
-                if host_header in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "urlshortener" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if url.startswith("https://" + domain):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "urlshortener" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -280,45 +347,23 @@ class NetworkCnCHTTPSTempStorageSite(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            "send-anywhere.com",
-            "sendgb.com",
-            "volafile.org",
-            "uploadfiles.io",
-            "sendpace.com",
-            "filedropper.com",
-            "myairbridge.co",
-            "u.teknik.io",
-            "p.teknik.io",
-            "upload.sexy",
-            "digitalassets.ams3.digitaloceanspaces.com",
-            "api.sendspace.com",
-            "www.fileden.com",
-            "a.pomf.cat",
-            "dropmb.com",
-            "transfer.sh",
-            "1fichier.com",
-            "gofile.io",
-        ]
+        self.domains = TEMP_STORAGE_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                host_header = "Host: " + domain
-                if host_header in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "tempstorage" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if url.startswith("https://" + domain):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "tempstorage" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -396,27 +441,23 @@ class NetworkCnCHTTPSTempURLDNS(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            ".requestbin.net",
-        ]
+        self.domains = TEMP_URLDNS_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                if domain in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "temp_urldns" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if re.match("https://.*\\" + domain + ".*", url):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "temp_urldns" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -442,27 +483,23 @@ class NetworkCnCHTTPSInteractsh(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            ".interact.sh",
-        ]
+        self.domains = INTERACTSH_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                if domain in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "interactsh" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if re.match("https://.*\\" + domain + ".*", url):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "interactsh" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -516,30 +553,23 @@ class NetworkCnCHTTPSFreeWebHosting(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            ".000webhostapp.com",
-            ".repl.co",
-            ".glitch.me",
-            ".ck.page",
-        ]
+        self.domains = FREE_WEB_HOSTING_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                if domain in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "free_webhosting" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if re.match("https://.*\\" + domain + ".*", url):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "free_webhosting" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -841,31 +871,23 @@ class NetworkCnCHTTPSArchive(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            "archive.org",
-            "archive.is",
-            "archive.ph",
-            "archive.today",
-        ]
+        self.domains = ARCHIVE_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                host_header = "Host: " + domain
-                if host_header in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "archive" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if url.startswith("https://" + domain):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "archive" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -891,29 +913,23 @@ class NetworkCnCHTTPSOpenSource(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            "gist.github.com",
-            "raw.githubusercontent.com",
-        ]
+        self.domains = OPEN_SOURCE_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                host_header = "Host: " + domain
-                if host_header in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "opensource" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if url.startswith("https://" + domain):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "opensource" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -939,31 +955,23 @@ class NetworkCnCHTTPSServiceInterface(Signature):
 
     def __init__(self, *args, **kwargs):
         Signature.__init__(self, *args, **kwargs)
-        self.domains = [
-            "mockbin.org",
-            "run.mocky.io",
-            "webhook.site",
-            "devtunnels.ms",
-        ]
+        self.domains = SERVICE_INTERFACE_DOMAINS
         self.urls = []
 
     def on_call(self, call, process):
         buff = self.get_argument(call, "Buffer")
         if buff:
-            for domain in self.domains:
-                host_header = "Host: " + domain
-                if host_header in buff:
-                    self.data.append({"http_request": buff})
-                    if self.pid:
-                        self.mark_call()
+            if "serviceinterface" in HTTPS_DOMAIN_MATCHER.scan_buffer(buff):
+                self.data.append({"http_request": buff})
+                if self.pid:
+                    self.mark_call()
 
         elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW"):
             url = self.get_argument(call, "URL")
-            for domain in self.domains:
-                if url.startswith("https://" + domain):
-                    self.urls.append(url)
-                    if self.pid:
-                        self.mark_call()
+            if url and "serviceinterface" in HTTPS_DOMAIN_MATCHER.scan_url(url):
+                self.urls.append(url)
+                if self.pid:
+                    self.mark_call()
 
     def on_complete(self):
         for url in list(set(self.urls)):
@@ -17,6 +17,7 @@ import base64
 import binascii
 
 from lib.cuckoo.common.abstracts import Signature
+from lib.cuckoo.common.cmdline_index import get_cmdline_index
 from lib.cuckoo.common.utils import convert_to_printable
 
 try:
@@ -75,9 +76,7 @@ class PowershellCommandSuspicious(Signature):
         ]
 
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if "powershell" in lower:
                 for command in commands:
                     if command in lower:
@@ -166,9 +165,7 @@ class PowershellRenamed(Signature):
         ]
 
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if "powershell" not in lower:
                 for command in commands:
                     if command in lower:
@@ -262,9 +259,7 @@ class PowershellReversed(Signature):
         ]
 
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for command in commands:
                 if command[::-1] in lower:
                     ret = True
@@ -293,9 +288,7 @@ class PowershellVariableObfuscation(Signature):
 
     def run(self):
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if "powershell" in lower:
                 if re.search("\$[^env=]*=.*\$[^env=]*=", lower):
                     ret = True
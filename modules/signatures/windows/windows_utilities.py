@@ -7,6 +7,9 @@ except ImportError:
     import re
 
 from lib.cuckoo.common.abstracts import Signature
+from lib.cuckoo.common.cmdline_index import get_cmdline_index, register_terms
+
+register_terms("ping", "certutil", "mavinject")
 
 
 class UsesWindowsUtilitiesScheduler(Signature):
@@ -34,8 +37,8 @@ class UsesWindowsUtilitiesScheduler(Signature):
         if process["process_name"].lower() in self.filter_processnames:
             # ToDo this doesn't apply MITRE map conversion for newer versions
             self.ttps += ["T1053.005"] if process["process_name"].lower() == "schtasks" else ["T1053.002"]  # MITRE v7,8
-            for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-                if re.search(process["process_name"].lower(), cmdline.lower()):
+            for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
+                if re.search(process["process_name"].lower(), lower):
                     self.data.append({"command": cmdline})
             return True
         return False
@@ -115,8 +118,7 @@ class UsesWindowsUtilities(Signature):
             r"Internet Explorer",
         ]
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if re.search(utility, lower):
                     if (
@@ -204,8 +206,7 @@ class SuspiciousCommandTools(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility_regex in utilities:
                 if re.search(utility_regex, lower):
                     if not any(re.search(whitelist_regex, cmdline) for whitelist_regex in whitelist):
@@ -236,8 +237,7 @@ class ScriptToolExecuted(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     if utility == "powershell":
@@ -261,8 +261,7 @@ class SuspiciousPingUse(Signature):
 
     def run(self):
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("ping"):
             if "ping" in lower and ("-n" in lower or "/n" in lower):
                 ret = True
                 self.data.append({"command": cmdline})
@@ -308,8 +307,7 @@ class WMICCommandSuspicious(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if "wmic" in lower:
                 for argument in self.arguments:
                     if argument in lower:
@@ -391,8 +389,7 @@ class SuspiciousCertutilUse(Signature):
 
     def run(self):
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("certutil"):
             if "certutil" in lower and ("urlcache" in lower or "encode" in lower or "decode" in lower or "addstore" in lower):
                 ret = True
                 self.data.append({"command": cmdline})
@@ -461,8 +458,7 @@ class DotNETCSCBuild(Signature):
 
     def run(self):
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             if "csc " in lower or "csc.exe" in lower:
                 ret = True
                 self.data.append({"command": cmdline})
@@ -537,8 +533,7 @@ class UsesWindowsUtilitiesAppCmd(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -565,8 +560,7 @@ class UsesWindowsUtilitiesCipher(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -594,8 +588,7 @@ class UsesWindowsUtilitiesClickOnce(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -624,8 +617,7 @@ class UsesWindowsUtilitiesCSVDELDFIDE(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -652,8 +644,7 @@ class UsesWindowsUtilitiesCurl(Signature):
         )
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -680,9 +671,7 @@ class UsesWindowsUtilitiesDSQuery(Signature):
         ]
 
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -707,8 +696,7 @@ class UsesWindowsUtilitiesEsentutl(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -734,8 +722,7 @@ class UsesWindowsUtilitiesFinger(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -762,8 +749,7 @@ class UsesWindowsUtilitiesMode(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -792,8 +778,7 @@ class UsesWindowsUtilitiesNltest(Signature):
         ]
 
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -820,9 +805,7 @@ class UsesWindowsUtilitiesNTDSutil(Signature):
         ]
 
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -847,9 +830,7 @@ class UsesWindowsUtilitiesXcopy(Signature):
         )
 
         ret = False
-        cmdlines = self.results.get("behavior", {}).get("summary", {}).get("executed_commands", [])
-        for cmdline in cmdlines:
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).iter_lowered():
             for utility in utilities:
                 if utility in lower:
                     ret = True
@@ -998,8 +979,7 @@ class MavInjectLolbin(Signature):
 
     def run(self):
         ret = False
-        for cmdline in self.results.get("behavior", {}).get("summary", {}).get("executed_commands", []):
-            lower = cmdline.lower()
+        for cmdline, lower in get_cmdline_index(self.results).containing("mavinject"):
             if "mavinject" in lower and ("injectrunning" in lower or "hmodule" in lower):
                 ret = True
                 self.data.append({"command": cmdline})
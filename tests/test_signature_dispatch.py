@@ -0,0 +1,84 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+# the signatures need CAPE's Signature base class, only available in a CAPE checkout
+pytest.importorskip("lib.cuckoo.common.abstracts")
+
+from lib.cuckoo.common.signature_dispatch import SignatureDispatchIndex  # noqa: E402
+from modules.signatures.windows.antidebug_windows import AntiDBGWindows  # noqa: E402
+from modules.signatures.windows.antisandbox_scripttimer import AntiSandboxScriptTimer  # noqa: E402
+from modules.signatures.windows.antivm_generic_cpu import AntiVMCPU  # noqa: E402
+from modules.signatures.windows.browser_scanbox import BrowserScanbox  # noqa: E402
+from modules.signatures.windows.generic_metrics import SystemMetrics  # noqa: E402
+from modules.signatures.windows.powershell_command import PowershellDownload  # noqa: E402
+
+SIGNATURE_CLASSES = (BrowserScanbox, AntiDBGWindows, AntiVMCPU, SystemMetrics, PowershellDownload)
+
+
+@pytest.fixture
+def index():
+    return SignatureDispatchIndex([cls({}) for cls in SIGNATURE_CLASSES])
+
+
+def names(signatures):
+    return [sig.name for sig in signatures]
+
+
+def call(api, category, **arguments):
+    return {"api": api, "category": category, "arguments": [{"name": name, "value": value} for name, value in arguments.items()]}
+
+
+def test_api_and_category_must_both_match(index):
+    # browser_scanbox filters on both its APIs and the browser category
+    assert names(index.subscribers("JsEval", "browser")) == ["browser_scanbox"]
+    assert names(index.subscribers("JsEval", "process")) == []
+
+
+def test_only_evented_signatures_are_indexed(index):
+    # antivm_generic_cpu has filters and on_call but isn't evented
+    assert "antivm_generic_cpu" not in names(index.signatures)
+    assert names(index.subscribers("RegQueryValueExA", "registry")) == []
+
+
+def test_category_and_api_only_signatures(index):
+    assert names(index.subscribers("FindWindowA", "windows")) == ["antidebug_windows"]
+    # an empty filter_categories set doesn't restrict generic_metrics
+    assert names(index.subscribers("GetSystemMetrics", "misc")) == ["generic_metrics"]
+    assert names(index.subscribers("NtCreateFile", "filesystem")) == []
+
+
+def test_subscribers_keep_load_order():
+    signatures = [AntiSandboxScriptTimer({}), AntiDBGWindows({})]
+    expected = ["antisandbox_script_timer", "antidebug_windows"]
+    assert names(SignatureDispatchIndex(signatures).subscribers("FindWindowA", "windows")) == expected
+    assert names(SignatureDispatchIndex(signatures[::-1]).subscribers("FindWindowA", "windows")) == expected[::-1]
+
+
+def test_dispatch_filters_processnames(index):
+    recv = call("recv", "network", buffer="payload")
+    index.dispatch(recv, {"process_name": "cmd.exe"})
+    assert index.stats() == {"offered": 1, "delivered": {}}
+
+    index.dispatch(recv, {"process_name": "powershell.exe"})
+    assert index.stats() == {"offered": 2, "delivered": {"powershell_download": 1}}
+
+
+def test_dispatch_returns_matches(index):
+    script = "var logger; document.onkeypress = keypress; setInterval(sendChar, 100)"
+    matched = index.dispatch(call("JsEval", "browser", Javascript=script), {"process_name": "iexplore.exe"})
+    assert names(matched) == ["browser_scanbox"]
+    assert index.dispatch(call("JsEval", "browser", Javascript="alert(1)"), {"process_name": "iexplore.exe"}) == []
+    assert index.stats()["delivered"] == {"browser_scanbox": 2}
+
+
+def test_failing_signature_is_retired(index):
+    bad_call = {"api": "GetSystemMetrics", "category": "misc"}
+    sig = index.subscribers("GetSystemMetrics", "misc")[0]
+    sig.on_call = lambda call, process: 1 / 0
+    assert index.dispatch(bad_call, {"process_name": "a.exe"}) == []
+    index.dispatch(bad_call, {"process_name": "a.exe"})
+    assert index.stats() == {"offered": 2, "delivered": {"generic_metrics": 1}}
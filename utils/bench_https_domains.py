@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# Replays SslEncryptPacket buffers and InternetOpenUrl URLs against the per-signature
+# domain loops formerly used by network_cnc_encrypted.py and the shared HostCategoryMatcher,
+# and exits 1 when the two report different categories for a buffer or URL.
+
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import re2 as re
+except ImportError:
+    import re
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from modules.signatures.windows.network_cnc_encrypted import HTTPS_DOMAIN_MATCHER
+
+
+def _categories(domains_by_category):
+    categories = {}
+    for domain, names in domains_by_category.items():
+        for category in names:
+            categories.setdefault(category, []).append(domain)
+    return categories
+
+
+# {category: [domains]} as the signatures listed them before sharing the matcher
+HOST_CATEGORIES = _categories(HTTPS_DOMAIN_MATCHER.host_domains)
+SUBSTRING_CATEGORIES = _categories(HTTPS_DOMAIN_MATCHER.substring_domains)
+
+
+def load_corpus(paths):
+    """Collect buffers and URLs from report.json files or raw buffer files."""
+    buffers, urls = [], []
+    for path in paths:
+        if path.endswith(".json"):
+            with open(path) as f:
+                report = json.load(f)
+            for process in report.get("behavior", {}).get("processes", []):
+                for call in process.get("calls", []):
+                    for arg in call.get("arguments", []):
+                        if call["api"] == "SslEncryptPacket" and arg["name"] == "Buffer":
+                            buffers.append(arg["value"])
+                        elif call["api"] in ("InternetOpenUrlA", "InternetOpenUrlW") and arg["name"] == "URL":
+                            urls.append(arg["value"])
+        else:
+            with open(path, "rb") as f:
+                buffers.append(f.read().decode("latin-1"))
+    return buffers, urls
+
+
+def legacy_buffer(buff):
+    """Categories the per-signature loops reported for an SslEncryptPacket buffer"""
+    hits = set()
+    for category, domains in HOST_CATEGORIES.items():
+        for domain in domains:
+            if "Host: " + domain in buff:
+                hits.add(category)
+    for category, domains in SUBSTRING_CATEGORIES.items():
+        for domain in domains:
+            if domain in buff:
+                hits.add(category)
+    return hits
+
+
+def legacy_url(url):
+    """Categories the per-signature loops reported for an InternetOpenUrl URL"""
+    hits = set()
+    for category, domains in HOST_CATEGORIES.items():
+        for domain in domains:
+            if url.startswith("https://" + domain):
+                hits.add(category)
+    for category, domains in SUBSTRING_CATEGORIES.items():
+        for domain in domains:
+            if re.match("https://.*\\" + domain + ".*", url):
+                hits.add(category)
+    return hits
+
+
+def legacy_scan(buffers, urls):
+    return [legacy_buffer(buff) for buff in buffers], [legacy_url(url) for url in urls]
+
+
+def matcher_scan(buffers, urls, signatures):
+    buffer_hits, url_hits = [], []
+    for buff in buffers:
+        # Every signature of the family asks for the same buffer, as the evented runner does
+        for _ in range(signatures):
+            hits = HTTPS_DOMAIN_MATCHER.scan_buffer(buff)
+        buffer_hits.append(set(hits))
+    for url in urls:
+        for _ in range(signatures):
+            hits = HTTPS_DOMAIN_MATCHER.scan_url(url)
+        url_hits.append(set(hits))
+    return buffer_hits, url_hits
+
+
+def compare(kind, items, legacy, matcher):
+    """Print and count the items the two paths report different categories for"""
+    mismatches = 0
+    for item, old, new in zip(items, legacy, matcher):
+        if old != new:
+            mismatches += 1
+            print("MISMATCH %s %r: legacy %s, matcher %s" % (kind, item[:200], sorted(old), sorted(new)))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTTPS domain matching for network_cnc_encrypted signatures")
+    parser.add_argument("corpus", nargs="+", help="report.json files or raw decrypted buffer files")
+    parser.add_argument("--rounds", type=int, default=5, help="Number of replays of the corpus")
+    args = parser.parse_args()
+
+    buffers, urls = load_corpus(args.corpus)
+    signatures = len(HOST_CATEGORIES) + len(SUBSTRING_CATEGORIES)
+    print("Corpus: %d buffers, %d URLs, %d signatures" % (len(buffers), len(urls), signatures))
+
+    results = {}
+    for label, func in (
+        ("legacy", lambda: legacy_scan(buffers, urls)),
+        ("matcher", lambda: matcher_scan(buffers, urls, signatures)),
+    ):
+        best = None
+        for _ in range(args.rounds):
+            HTTPS_DOMAIN_MATCHER.scan_buffer.cache_clear()
+            HTTPS_DOMAIN_MATCHER.scan_url.cache_clear()
+            start = time.perf_counter()
+            results[label] = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("%-8s best of %d: %.4fs" % (label, args.rounds, best))
+
+    legacy_buffers, legacy_urls = results["legacy"]
+    matcher_buffers, matcher_urls = results["matcher"]
+    mismatches = compare("buffer", buffers, legacy_buffers, matcher_buffers) + compare("url", urls, legacy_urls, matcher_urls)
+    hits = sum(1 for found in legacy_buffers + legacy_urls if found)
+    print("%d of %d buffers and URLs matched a category, %d mismatches" % (hits, len(buffers) + len(urls), mismatches))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
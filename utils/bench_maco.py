@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# Regression and throughput benchmark of the MACO extractors over a labelled corpus.
+#
+# The corpus is a directory of payloads named by their sha256, plus labels.json:
+#   {"<sha256>": {"family": "AgentTesla", "config": {...expected ExtractorModel JSON...} or null}}
+# Like MACORunner, every payload is scanned once with the combined ruleset of all extractors, the
+# scan is timed on its own. Every extractor of a family then runs in its own process on that family's
+# payloads its rule matched, with those matches, and reports the config check, time per payload,
+# tracemalloc peak and retained memory and the process peak RSS. Payloads no rule of their family
+# matched are reported as rule misses.
+#
+#   bench_maco.py corpus/ -o today.json
+#   bench_maco.py corpus/ -o today.json --compare yesterday.json   exits 1 on mismatches or slowdowns
+#   bench_maco.py corpus/ --update                                   record current output as expected
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from importlib import metadata
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from modules.parsers import registry
+from modules.parsers.ruleset import ExtractorRuleset
+from modules.parsers.runner import DEFAULT_TIMEOUT, ScannedMatch
+
+REPORT_VERSION = 2
+
+
+def normalize(result):
+    """JSON view of an extractor result, comparable with the labels"""
+    if result is None:
+        return None
+    if hasattr(result, "model_dump_json"):
+        return json.loads(result.model_dump_json(exclude_defaults=True))
+    return json.loads(json.dumps(result, default=str))
+
+
+def run_once(extractor, path, matches):
+    with open(path, "rb") as f:
+        data = f.read()
+    start = time.perf_counter()
+    result = extractor.run(io.BytesIO(data), matches)
+    return result, time.perf_counter() - start
+
+
+def scan_corpus(ruleset, corpus, repeat):
+    """Scan every payload with the combined ruleset, as MACORunner.run_file does.
+    @return: {sha256: {"time": median seconds, "matches": {namespace: [ScannedMatch]}}}
+    """
+    scans = {}
+    for payloads in corpus.values():
+        for sha256, path, _ in payloads:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                found = ruleset.rules.match(path, timeout=DEFAULT_TIMEOUT)
+                times.append(time.perf_counter() - start)
+            matches = {}
+            for match in found:
+                matches.setdefault(match.namespace, []).append(ScannedMatch(match))
+            scans[sha256] = {"time": statistics.median(times), "matches": matches}
+    return scans
+
+
+def bench_extractor(entry, payloads, repeat):
+    """Child process: benchmark one extractor on [(sha256, path, expected config, its matches or None)]"""
+    stats = {"module": entry["module"], "class": entry["class"], "family": entry.get("family"), "payloads": {}}
+    try:
+        extractor = registry.load_extractor(entry)()
+    except Exception as e:
+        stats["error"] = f"can't load: {e}"
+        return stats
+
+    for sha256, path, expected, matches in payloads:
+        record = {"rule_matched": matches is not None}
+        if matches is None:
+            # the runner never calls an extractor its rule didn't select
+            record["config"] = None
+            record["match"] = expected is None
+            stats["payloads"][sha256] = record
+            continue
+        try:
+            times = []
+            for _ in range(repeat):
+                result, elapsed = run_once(extractor, path, matches)
+                times.append(elapsed)
+            tracemalloc.start()
+            run_once(extractor, path, matches)
+            # retained is what the run still holds afterwards (caches, leaks)
+            record["alloc_retained"], record["alloc_peak"] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            record["time"] = statistics.median(times)
+            actual = normalize(result)
+            record["match"] = actual == expected
+            record["config"] = actual
+        except Exception as e:
+            tracemalloc.stop()
+            record["error"] = str(e)
+            record["match"] = False
+        stats["payloads"][sha256] = record
+    # kilobytes on Linux
+    stats["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return stats
+
+
+def summarize(stats):
+    records = [record for record in stats["payloads"].values() if "time" in record]
+    times = [record["time"] for record in records]
+    return {
+        "family": stats.get("family"),
+        "error": stats.get("error"),
+        "payloads": len(stats["payloads"]),
+        "mismatches": sorted(sha256 for sha256, record in stats["payloads"].items() if not record.get("match")),
+        "not_selected": sorted(sha256 for sha256, record in stats["payloads"].items() if not record.get("rule_matched")),
+        "errors": {sha256: record["error"] for sha256, record in stats["payloads"].items() if "error" in record},
+        "time_total": sum(times),
+        "time_mean": statistics.mean(times) if times else 0,
+        "time_max": max(times, default=0),
+        "alloc_peak_max": max((record["alloc_peak"] for record in records), default=0),
+        "alloc_retained_max": max((record["alloc_retained"] for record in records), default=0),
+        "peak_rss_kb": stats.get("peak_rss_kb", 0),
+    }
+
+
+def load_corpus(folder):
+    with open(os.path.join(folder, "labels.json")) as f:
+        labels = json.load(f)
+    corpus = {}
+    for sha256, label in labels.items():
+        path = os.path.join(folder, sha256)
+        if not os.path.exists(path):
+            print(f"Missing payload {sha256}", file=sys.stderr)
+            continue
+        corpus.setdefault(label["family"], []).append((sha256, path, label.get("config")))
+    return labels, corpus
+
+
+def package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def compare(report, baseline, slowdown):
+    """Return the extractors, and the ruleset scan, that got slower than slowdown times their baseline mean"""
+    regressions = {}
+    timings = {"ruleset scan": report["scan"], **report["extractors"]}
+    previous_timings = dict(baseline.get("extractors", {}))
+    if "scan" in baseline:
+        previous_timings["ruleset scan"] = baseline["scan"]
+    for name, current in timings.items():
+        previous = previous_timings.get(name)
+        if not previous or not previous["time_mean"] or not current["time_mean"]:
+            continue
+        ratio = current["time_mean"] / previous["time_mean"]
+        if ratio >= slowdown:
+            regressions[name] = {"before": previous["time_mean"], "after": current["time_mean"], "ratio": ratio}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MACO extractors on a labelled corpus")
+    parser.add_argument("corpus", help="Directory with payloads named by sha256 and labels.json")
+    parser.add_argument("-o", "--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Previous JSON report to compare with")
+    parser.add_argument("--slowdown", type=float, default=2.0, help="Mean time ratio reported as a regression")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Timed runs per payload, the median is kept")
+    parser.add_argument("-f", "--family", action="append", help="Only benchmark these families")
+    parser.add_argument("--update", action="store_true", help="Store the current output as the expected config")
+    args = parser.parse_args()
+
+    labels, corpus = load_corpus(args.corpus)
+    if args.family:
+        corpus = {family: payloads for family, payloads in corpus.items() if family in args.family}
+    families = registry.families()
+
+    # the production ruleset, every extractor's rules compiled together
+    start = time.perf_counter()
+    scans = scan_corpus(ExtractorRuleset(), corpus, args.repeat)
+
+    jobs = []
+    rule_misses = {}
+    for family, payloads in sorted(corpus.items()):
+        entries = families.get(family)
+        if not entries:
+            print(f"No extractor for family {family}", file=sys.stderr)
+            continue
+        namespaces = [f"{entry['module']}.{entry['class']}" for entry in entries]
+        for sha256, _, _ in payloads:
+            if not any(namespace in scans[sha256]["matches"] for namespace in namespaces):
+                rule_misses[sha256] = family
+        for entry, namespace in zip(entries, namespaces):
+            selected = [(sha256, path, expected, scans[sha256]["matches"].get(namespace)) for sha256, path, expected in payloads]
+            jobs.append((entry, selected, args.repeat))
+
+    # a fresh process per extractor, so peak RSS and imports are its own
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        results = pool.starmap(bench_extractor, jobs, chunksize=1)
+
+    scan_times = [scan["time"] for scan in scans.values()]
+
+    report = {
+        "version": REPORT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cape_parsers": package_version("cape-parsers"),
+        "maco": package_version("maco"),
+        "wall_time": time.perf_counter() - start,
+        "scan": {
+            "payloads": len(scan_times),
+            "time_total": sum(scan_times),
+            "time_mean": statistics.mean(scan_times) if scan_times else 0,
+            "time_max": max(scan_times, default=0),
+        },
+        "rule_misses": rule_misses,
+        "extractors": {f"{stats['module']}.{stats['class']}": summarize(stats) for stats in results},
+    }
+
+    scan = report["scan"]
+    print(
+        f"{'ruleset scan':40s} {scan['payloads']:4d} payloads  mean {scan['time_mean'] * 1000:9.2f} ms"
+        f"  max {scan['time_max'] * 1000:9.2f} ms"
+    )
+    for sha256, family in sorted(rule_misses.items(), key=lambda item: (item[1], item[0])):
+        print(f"NO RULE MATCH {family}: {sha256}")
+
+    for name, summary in sorted(report["extractors"].items()):
+        status = summary["error"] or (f"{len(summary['mismatches'])} mismatches" if summary["mismatches"] else "ok")
+        print(
+            f"{name:40s} {summary['payloads']:4d} payloads  mean {summary['time_mean'] * 1000:9.2f} ms"
+            f"  max {summary['time_max'] * 1000:9.2f} ms  alloc {summary['alloc_peak_max'] / 1024:9.0f} KiB"
+            f"  rss {summary['peak_rss_kb'] / 1024:7.1f} MiB  {status}"
+        )
+
+    failed = bool(rule_misses) or any(summary["mismatches"] or summary["error"] for summary in report["extractors"].values())
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.slowdown)
+        report["regressions"] = regressions
+        for name, regression in sorted(regressions.items()):
+            print(
+                f"SLOWER {name}: {regression['before'] * 1000:.2f} ms -> {regression['after'] * 1000:.2f} ms"
+                f" ({regression['ratio']:.1f}x)"
+            )
+        failed = failed or bool(regressions)
+
+    if args.update:
+        for stats in results:
+            for sha256, record in stats["payloads"].items():
+                if "config" in record and record["rule_matched"]:
+                    labels[sha256]["config"] = record["config"]
+        with open(os.path.join(args.corpus, "labels.json"), "w") as f:
+            json.dump(labels, f, indent=1, sort_keys=True)
+        failed = False
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
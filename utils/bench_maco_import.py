@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Cold start cost of the MACO extractors: every measurement runs in a fresh interpreter.
+#   all         import every extractor module (what enumerating them used to require)
+#   rules       import every extractor and resolve its yara_rule
+#   manifest    list families and rule names from the registry manifest
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+
+SCENARIOS = {
+    "all": """
+import glob, importlib, os
+for path in sorted(glob.glob("modules/parsers/MACO/[!_]*.py")):
+    try:
+        importlib.import_module("modules.parsers.MACO." + os.path.basename(path)[:-3])
+    except Exception:
+        pass
+""",
+    "rules": """
+import glob, importlib, os
+from maco.extractor import Extractor
+for path in sorted(glob.glob("modules/parsers/MACO/[!_]*.py")):
+    try:
+        module = importlib.import_module("modules.parsers.MACO." + os.path.basename(path)[:-3])
+    except Exception:
+        continue
+    for value in vars(module).values():
+        if isinstance(value, type) and issubclass(value, Extractor) and value is not Extractor:
+            value.yara_rule
+""",
+    "manifest": """
+from modules.parsers.registry import families
+sum(len(entry["rules"]) for entries in families().values() for entry in entries)
+""",
+}
+
+TIMER = """
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def run(code, env):
+    proc = subprocess.run(
+        [sys.executable, "-c", TIMER.format(code=code)], cwd=ROOT, env=env, capture_output=True, text=True, check=False
+    )
+    if proc.returncode:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else f"exit code {proc.returncode}")
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure MACO extractor cold start times")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="Runs per scenario")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--online", action="store_true", help="Allow downloading missing rules")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    if not args.online:
+        env["CAPE_YARA_OFFLINE"] = "1"
+
+    for scenario in args.scenarios:
+        try:
+            times = [run(SCENARIOS[scenario], env) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{scenario:10s} failed: {e}")
+            continue
+        print(f"{scenario:10s} median {statistics.median(times) * 1000:8.1f} ms  min {min(times) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
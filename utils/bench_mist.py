@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Converts a corpus of report.json files to MIST with per-token hashing (as mist_convert
+# used to do) and with the shared token_hash memo, cold and warm.
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from modules.reporting.malheur import SUMMARY_FEATURES, summary_mist_lines, token_hash
+
+
+def uncached_hash(token):
+    return hashlib.blake2b(token.encode("utf8", "surrogatepass"), digest_size=4).hexdigest()
+
+
+def legacy_summary(summary):
+    # one hash per token, no memo, one list extend per summary list
+    lines = []
+    for key, prefix, _ in SUMMARY_FEATURES:
+        for entry in summary[key]:
+            if prefix.startswith(("file", "cmd")):
+                tokens = entry.lower().replace('"', "").replace("\\", " ").replace(".", " ").split(" ")
+                tokens = tokens if prefix.startswith("cmd") else tokens[-3:]
+            elif prefix.startswith("reg"):
+                tokens = entry.lower().replace("\\", " ").split(" ")[-2:]
+            else:
+                tokens = [entry.lower()]
+            lines.append(prefix + " ".join(uncached_hash(token) for token in tokens))
+    return lines
+
+
+def load_reports(paths):
+    reports = []
+    for path in paths:
+        with open(path) as f:
+            report = json.load(f)
+        if "summary" in report.get("behavior", {}):
+            reports.append(report)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MIST conversion for the Malheur reporter")
+    parser.add_argument("reports", nargs="+", help="report.json files")
+    parser.add_argument("--rounds", type=int, default=3, help="Number of replays of the corpus")
+    args = parser.parse_args()
+
+    reports = load_reports(args.reports)
+    entries = sum(len(report["behavior"]["summary"][key]) for report in reports for key, _, _ in SUMMARY_FEATURES)
+    print("Corpus: %d reports, %d summary entries" % (len(reports), entries))
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for report in reports:
+            legacy_summary(report["behavior"]["summary"])
+    print("%-12s %.4fs/round" % ("legacy", (time.perf_counter() - start) / args.rounds))
+
+    token_hash.cache_clear()
+    start = time.perf_counter()
+    for report in reports:
+        summary_mist_lines(report["behavior"]["summary"])
+    print("%-12s %.4fs" % ("memo cold", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for report in reports:
+            summary_mist_lines(report["behavior"]["summary"])
+    print("%-12s %.4fs/round" % ("memo warm", (time.perf_counter() - start) / args.rounds))
+
+    info = token_hash.cache_info()
+    print("token cache: %d hits, %d misses, %d/%d entries" % (info.hits, info.misses, info.currsize, info.maxsize))
+
+
+if __name__ == "__main__":
+    main()
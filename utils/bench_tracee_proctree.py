@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Builds Tracee process trees from synthetic execve traces: a fork bomb (wide tree),
+# a deep execve chain and a mix with pid reuse, then exports them as TraceeAnalysis does.
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from modules.processing.tracee import MAX_TREE_DEPTH, ProcTree
+
+
+def fork_bomb(count):
+    # every process spawns from one of the first few hundred processes
+    for pid in range(2, count + 2):
+        yield max(1, pid // 300), pid
+
+
+def deep_chain(count):
+    for pid in range(2, count + 2):
+        yield pid - 1, pid
+
+
+def pid_reuse(count, pid_max=32768):
+    rng = random.Random(0)
+    alive = [1]
+    for _ in range(count):
+        parent = rng.choice(alive)
+        pid = rng.randint(2, pid_max)
+        alive.append(pid)
+        if len(alive) > 1000:
+            alive.pop(1)
+        yield parent, pid
+
+
+def build(events):
+    # mirrors the execve handling in TraceeAnalysis.run
+    tree = ProcTree(0, {"desc": "(ABSTRACTION) root process"})
+    for ppid, pid in events:
+        if not tree.get_child(ppid):
+            tree.add_child(ppid, {"desc": "PARENT"})
+        tree.get_child(ppid).add_child(pid, {"desc": ["/bin/sh"], "cmdline": ["/bin/sh"], "env": []})
+    return tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Tracee ProcTree construction and export")
+    parser.add_argument("--processes", type=int, default=100000, help="Number of synthetic execve events per trace")
+    args = parser.parse_args()
+
+    for label, events in (
+        ("fork_bomb", fork_bomb(args.processes)),
+        ("deep_chain", deep_chain(args.processes)),
+        ("pid_reuse", pid_reuse(args.processes)),
+    ):
+        events = list(events)
+        start = time.perf_counter()
+        tree = build(events)
+        built = time.perf_counter()
+        exported = json.dumps(tree.to_dict(max_depth=MAX_TREE_DEPTH))
+        done = time.perf_counter()
+        print(
+            "%-10s %7d events  build %.3fs  export %.3fs  %d nodes indexed  %d bytes"
+            % (label, len(events), built - start, done - built, len(tree.index), len(exported))
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# Builds the MACO YARA rule bundle (modules/parsers/yara/bundle.json) and the extractor manifest.
+# Run it once where the rules can be fetched, then ship the bundle and run with CAPE_YARA_OFFLINE=1.
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from modules.parsers import registry, utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bundle the YARA rules used by the MACO extractors")
+    parser.add_argument("--offline", action="store_true", help="Only bundle rules available locally")
+    parser.add_argument("--bundle", default=utils.YARA_BUNDLE_PATH, help="Bundle path")
+    parser.add_argument("--manifest", default=registry.MANIFEST_PATH, help="Manifest path")
+    args = parser.parse_args()
+
+    # rebuild from the rule files, not from a previous bundle
+    utils._bundle = {}
+    manifest = registry.build_manifest()
+    bundle = {}
+    missing = []
+    for entry in manifest["extractors"]:
+        family = entry["yara_family"]
+        if not family or family in bundle:
+            continue
+        rule = utils.get_YARA_rule(family, offline=args.offline)
+        if rule:
+            bundle[family] = rule
+        else:
+            missing.append(family)
+
+    os.makedirs(os.path.dirname(args.bundle), exist_ok=True)
+    with open(args.bundle, "w") as f:
+        json.dump(bundle, f, sort_keys=True)
+
+    for entry in manifest["extractors"]:
+        entry["rules"] = registry.rule_names(bundle.get(entry["yara_family"]))
+    registry.write_manifest(manifest, args.manifest)
+
+    print(f"{len(bundle)} rules bundled in {args.bundle}, {len(manifest['extractors'])} extractors in {args.manifest}")
+    if missing:
+        print(f"No rule found for: {', '.join(sorted(missing))}")
+
+
+if __name__ == "__main__":
+    main()
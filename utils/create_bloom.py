@@ -30,6 +30,7 @@ except ImportError:
     logging.error("Python library 'flor' is not installed -> pip3 install flor")
 
 from lib.cuckoo.common.constants import CUCKOO_ROOT
+from lib.cuckoo.common.dga_index import write_dga_index
 
 API_URL = "https://dgarchive.caad.fkie.fraunhofer.de/today/1"
 API_USER = ""
@@ -109,4 +110,8 @@ if __name__ == "__main__":
     with gzip.GzipFile(lookup_path, "w") as fout:
         fout.write(json.dumps(dga_lookup_dict).encode())
 
-    logging.info("Successfully generated bloomfilter and dga dict file")
+    # 6. write the mmap-able index (bloom bit array + sorted hash table) used by the signature when present
+    index_path = os.path.join(CUCKOO_ROOT, "data", "dga.index")
+    write_dga_index(index_path, dga_lookup_dict)
+
+    logging.info("Successfully generated bloomfilter, dga dict and dga index files")
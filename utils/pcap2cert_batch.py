@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# Back-fills the certificate store from stored analyses or arbitrary (rotated) pcaps.
+#   pcap2cert_batch.py storage/analyses/*           every dump*.pcap of each analysis
+#   pcap2cert_batch.py --task 1234 rotated/*.pcap    captures belonging to one task
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from lib.cuckoo.common.cert_store import CERT_STORE_PATH
+from modules.reporting.pcap2cert import extract_many
+
+
+def task_from_path(path):
+    name = os.path.basename(os.path.normpath(path))
+    return int(name) if name.isdigit() else None
+
+
+def collect_jobs(paths, task_id=None):
+    for path in paths:
+        if os.path.isdir(path):
+            for pcap in sorted(glob.glob(os.path.join(path, "dump*.pcap"))):
+                yield task_id if task_id is not None else task_from_path(path), pcap
+        elif os.path.isfile(path):
+            yield task_id if task_id is not None else task_from_path(os.path.dirname(path)), path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract TLS certificates from many pcaps into the certificate store")
+    parser.add_argument("paths", nargs="+", help="Analysis directories or pcap files")
+    parser.add_argument("--task", type=int, help="Task id for all given pcaps, by default taken from the analysis directory")
+    parser.add_argument("--workers", type=int, help="Number of worker processes, defaults to the CPU count")
+    parser.add_argument("--store", default=CERT_STORE_PATH, help="Certificate store path")
+    parser.add_argument("-d", "--debug", action="store_true", help="Print debug messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    start = time.perf_counter()
+    stats = extract_many(collect_jobs(args.paths, args.task), workers=args.workers, store_path=args.store)
+    print(
+        "%d pcaps, %d unique certificates, %d task sightings in %.1fs"
+        % (stats["pcaps"], stats["certificates"], stats["sightings"], time.perf_counter() - start)
+    )
+
+
+if __name__ == "__main__":
+    main()